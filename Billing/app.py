@@ -20,5 +20,5 @@ if __name__ == "__main__":
         initialize_database(app, app.extensions["sqlalchemy"].db)
 
 
-    # Start the Flask development server
-    app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
+    # Start the Flask development server (production uses gunicorn, see gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=5001, debug=os.getenv("FLASK_DEBUG") == "1")
\ No newline at end of file
@@ -1,3 +1,4 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
@@ -20,6 +21,14 @@ def create_app(db_uri=None):
     # or part added by Rami for tests
     app.config["SQLALCHEMY_DATABASE_URI"] = db_uri or 'sqlite:///:memory:'
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if db_uri:
+        # Per-process connection pool; sized from the request threads by gunicorn.conf.py
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 2)),
+            "pool_pre_ping": True,  # Replace connections MySQL closed after wait_timeout
+            "pool_recycle": 3600,
+        }
 
     # Initialize plugins
     db.init_app(app)
@@ -0,0 +1,84 @@
+from datetime import datetime
+from sqlalchemy import select
+from app import db
+from app.controller import Provider, Truck
+from app.rates import rate_resolver
+from app.weight_client import get_weight_client
+
+"""
+Bill computation for GET /bill/<provider_id>.
+
+A bill costs a fixed number of round trips, whatever the fleet size:
+one query for the provider's trucks, bulk POST /items and POST /sessions
+calls to the weight service (chunked and sent in parallel by WeightClient).
+Rates come from the in-memory rate_resolver (app/rates.py).
+"""
+
+
+def compute_bill(provider_id, from_time, to_time):
+    """
+    Computes a provider's bill for the sessions its trucks started in a period.
+
+    Every session of the provider's trucks is counted under its produce; the
+    neto of closed sessions is billed at the product's rate in the rate
+    version in effect when the session started, so a product priced by two
+    versions in the period gets one line per rate. Sessions still open, or
+    whose neto is unknown ("na"), are counted but weigh 0.
+
+    Args:
+        provider_id (int): Provider id.
+        from_time, to_time (str): Period, YYYYMMDDHHMMSS.
+
+    Returns:
+        dict: The bill (see README), or None if the provider does not exist.
+
+    Raises:
+        WeightServiceError: If the weight service failed.
+    """
+    provider = db.session.get(Provider, provider_id)
+    if provider is None:
+        return None
+
+    truck_ids = db.session.execute(select(Truck.id).where(Truck.provider_id == provider_id)).scalars().all()
+
+    client = get_weight_client()
+    items = client.get_items(truck_ids, from_time, to_time) if truck_ids else {}
+    session_ids = [s for item in items.values() if item for s in item["sessions"]]
+    sessions = client.get_sessions(session_ids) if session_ids else {}
+
+    truck_count = sum(1 for item in items.values() if item and item["sessions"])
+    versions = rate_resolver.versions()  # One version list for the whole bill, even if an upload adds one meanwhile
+    bill_end = datetime.strptime(to_time, '%Y%m%d%H%M%S')
+    lines = {}  # (lower-cased product, rate) -> {"product", "count", "amount", "rate"}
+    for details in sessions.values():
+        if not details:
+            continue
+        produce = details.get("produce") or "na"
+        # Each session is priced by the rate version in effect when it started
+        started = datetime.strptime(details["datetime"], '%Y%m%d%H%M%S') if details.get("datetime") else bill_end
+        rate = rate_resolver.index(versions.at(started)).rate(produce, provider_id) or 0
+        line = lines.setdefault((produce.lower(), rate), {"product": produce, "count": 0, "amount": 0, "rate": rate})
+        line["count"] += 1
+        if isinstance(details.get("neto"), int):
+            line["amount"] += details["neto"]
+
+    products = []
+    for _, line in sorted(lines.items()):
+        products.append({
+            "product": line["product"],
+            "count": str(line["count"]),
+            "amount": line["amount"],
+            "rate": line["rate"],
+            "pay": line["amount"] * line["rate"],
+        })
+
+    return {
+        "id": str(provider.id),
+        "name": provider.name,
+        "from": from_time,
+        "to": to_time,
+        "truckCount": truck_count,
+        "sessionCount": sum(line["count"] for line in lines.values()),
+        "products": products,
+        "total": sum(product["pay"] for product in products),
+    }
@@ -1,11 +1,15 @@
 from flask import jsonify
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
 from app import db  # Import the database instance
 from openpyxl import load_workbook
 from app import create_app  # Import the factory function
 from datetime import datetime
-import http.client
+import csv
+import io
 import json
+import os
+import time
+from app.weight_client import get_weight_client, WeightServiceError
 
 # Define a Provider model
 class Provider(db.Model):
@@ -13,11 +17,23 @@ class Provider(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)  # Primary key can't be NULL
     name = db.Column(db.String(255), unique=True, nullable=False)  # Ensure 'name' is not NULL
 
+class RateVersion(db.Model):
+    __tablename__ = 'RateVersions'  # One row per uploaded rates file
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
+    effective_from = db.Column(db.DateTime, nullable=False, index=True)  # Sessions from this moment on use the version
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    file_name = db.Column(db.String(255))
+    row_count = db.Column(db.Integer, default=0, nullable=False)
+    published = db.Column(db.Boolean, default=False, nullable=False)  # Set once all of the version's rates are stored
+
 class Rate(db.Model):
     __tablename__ = 'Rates'  # Explicitly define the table name
-    product_id = db.Column(db.String(50), primary_key=True, nullable=False)  # Primary key can't be NULL
+    __table_args__ = (db.Index('idx_version_product', 'version_id', 'product_id'),)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
+    version_id = db.Column(db.Integer, db.ForeignKey('RateVersions.id'), nullable=False)  # Rates never change once stored
+    product_id = db.Column(db.String(50), nullable=False)  # Product name, unique per version and scope
     rate = db.Column(db.Integer, default=0, nullable=False)  # Ensure 'rate' is not NULL
-    scope = db.Column(db.Integer, db.ForeignKey('Provider.id'), nullable=False)  # Relates to Provider.id, cannot be NULL
+    scope = db.Column(db.String(50), db.ForeignKey('Provider.id'), nullable=True)  # Provider.id, NULL for all providers (as in billingdb.sql)
 
 class Truck(db.Model):
     __tablename__ = 'Trucks'  # Explicitly define the table name
@@ -113,64 +129,380 @@ def update_truck_provider(truck_id, new_provider_id):
         db.session.rollback()
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
-def upload_rates_from_excel(file_path):
+BULK_MAX_ITEMS = 10000  # Items per bulk registration request
+BULK_CHUNK = 1000  # Ids per IN list and rows per multi-row INSERT
+
+
+def read_bulk_file(file):
+    """
+    Reads the items of an uploaded CSV (with a header row) or JSON (array) file.
+
+    Returns:
+        list: One dict per item.
+
+    Raises:
+        ValueError: If the file is not valid CSV or JSON.
+    """
+    name = (file.filename or '').lower()
+    content = file.read().decode('utf-8-sig')
+    if name.endswith('.json'):
+        try:
+            items = json.loads(content)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON file: {e}")
+        if not isinstance(items, list):
+            raise ValueError("JSON file must contain an array")
+        return items
+    if name.endswith('.csv'):
+        return [{key.strip(): value for key, value in row.items() if key} for row in csv.DictReader(io.StringIO(content))]
+    raise ValueError("Invalid file type. Allowed types: csv, json")
+
+
+def _chunks(items, size=BULK_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _bulk_response(results):
+    """201 if every item was created, 207 if some were, 400 if none were."""
+    created = sum(1 for result in results if result["status"] == "created")
+    status = 201 if created == len(results) else 207 if created else 400
+    return jsonify({"created": created, "failed": len(results) - created, "results": results}), status
+
+
+def add_providers_bulk(items):
+    """
+    Registers many providers at once.
+
+    Names are checked against the database in one query (and against each
+    other), and all new providers are inserted with multi-row INSERTs and a
+    single commit.
+
+    Args:
+        items (list): Provider names, or dicts with a "name".
+
+    Returns:
+        tuple: (response, status) with one result per item, in order:
+        {"index", "name", "status": "created", "id"} or {"index", "name", "status": "error", "error"}.
+    """
+    results = []
+    names = {}  # lower-cased name -> index of the item creating it
+    for index, item in enumerate(items):
+        name = item.get("name") if isinstance(item, dict) else item
+        name = name.strip() if isinstance(name, str) else None
+        result = {"index": index, "name": name}
+        if not name:
+            result.update(status="error", error="Provider name is required")
+        elif len(name) > 255:
+            result.update(status="error", error="Provider name must be at most 255 characters")
+        elif name.lower() in names:
+            result.update(status="error", error=f"Duplicate of item {names[name.lower()]}")
+        else:
+            names[name.lower()] = index
+            result["status"] = "created"
+        results.append(result)
+
     try:
-        # Load the workbook and the active sheet using openpyxl
-        workbook = load_workbook(file_path)
-        sheet = workbook.active
+        existing = set()
+        for chunk in _chunks(names):
+            existing.update(n.lower() for n in db.session.execute(
+                select(Provider.name).where(Provider.name.in_(chunk))).scalars())
+        for result in results:
+            if result["status"] == "created" and result["name"].lower() in existing:
+                result.update(status="error", error="Provider already exists")
 
-        # Validate the structure of the sheet (check for required columns)
-        headers = [cell.value for cell in sheet[1]]  # Read headers (first row)
-        required_columns = {'Product', 'Rate', 'Scope'}
-        
-        if not required_columns.issubset(headers):
-            return jsonify({"error": "Excel file must contain Product, Rate, and Scope columns"}), 400
-
-        # Clear existing rates
-        Rate.query.delete()
-
-        # Process the rows (skip the header row, so start from row 2)
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            product = str(row[0]).strip()  # Ensure it's a string
-            rate = row[1]  # This will be handled directly as a number (no strip needed)
-            scope = str(row[2]).strip() if row[2] is not None else None  # Ensure it's a string, handle None
-            
-            if scope == 'ALL':
-                scope = None  # Handle 'ALL' as None
-            
-            # Create and add the new rate to the database
-            new_rate = Rate(product_id=product, rate=rate, scope=scope)
-            db.session.add(new_rate)
-
-        # Commit the changes to the database
+        new_names = [result["name"] for result in results if result["status"] == "created"]
+        for chunk in _chunks(new_names):
+            db.session.execute(Provider.__table__.insert().values([{"name": name} for name in chunk]))
         db.session.commit()
 
-        return jsonify({"message": "Rates uploaded successfully"}), 201
+        ids = {}
+        for chunk in _chunks(new_names):
+            ids.update((name.lower(), provider_id) for provider_id, name in db.session.execute(
+                select(Provider.id, Provider.name).where(Provider.name.in_(chunk))))
+        for result in results:
+            if result["status"] == "created":
+                result["id"] = ids.get(result["name"].lower())
     except Exception as e:
         db.session.rollback()
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": f"An error occurred while processing the request: {str(e)}"}), 500
+    return _bulk_response(results)
 
-    except Exception:
-        return "error_fetching_data"  # Generic error if connection fails
 
-def get_truck_details(truck_id, from_time_str, to_time_str):    
-    host = "host.docker.internal"
-    port = 5000
-    endpoint = f"/item/{truck_id}?from={from_time_str}&to={to_time_str}"
-    print(f"Requesting truck data from weight service: {host}:{port}{endpoint}")
+def add_trucks_bulk(items, default_provider_id=None):
+    """
+    Registers many trucks at once.
+
+    Provider ids and existing trucks are each checked in one query, and all
+    new trucks are inserted with multi-row INSERTs and a single commit.
+
+    Args:
+        items (list): Dicts with an "id" and a "provider_id" (other keys, such as
+            the weight and unit of resources/trucks.json, are ignored).
+        default_provider_id (int): Provider of items without a "provider_id".
+
+    Returns:
+        tuple: (response, status) with one result per item, in order:
+        {"index", "id", "provider_id", "status": "created"} or {..., "status": "error", "error"}.
+    """
+    results = []
+    truck_ids = {}  # lower-cased truck id -> index of the item creating it
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"index": index, "id": None, "provider_id": None,
+                            "status": "error", "error": "Item must be an object"})
+            continue
+        truck_id = item.get("id")
+        truck_id = str(truck_id).strip() if truck_id is not None else ""
+        provider_id = item.get("provider_id")
+        if provider_id in (None, ""):
+            provider_id = default_provider_id
+        result = {"index": index, "id": truck_id, "provider_id": provider_id}
+        try:
+            result["provider_id"] = provider_id = int(provider_id) if provider_id is not None else None
+        except (TypeError, ValueError):
+            provider_id = None
+        if not truck_id:
+            result.update(status="error", error="Truck license id is required")
+        elif len(truck_id) > 10:
+            result.update(status="error", error="Truck license id must be at most 10 characters")
+        elif provider_id is None:
+            result.update(status="error", error="A numeric provider_id is required")
+        elif truck_id.lower() in truck_ids:  # Trucks.id compares case-insensitively
+            result.update(status="error", error=f"Duplicate of item {truck_ids[truck_id.lower()]}")
+        else:
+            truck_ids[truck_id.lower()] = index
+            result["status"] = "created"
+        results.append(result)
+
     try:
-        conn = http.client.HTTPConnection(host, port)
-        conn.request("GET", endpoint)
-        response = conn.getresponse()
-
-        if response.status == 404:
-            return None  # Truck not found
-        elif response.status != 200:
-            return "error_fetching_data"  # Unexpected error from weight service
-        data = json.loads(response.read().decode("utf-8"))
-        conn.close()
-
-        return data # Return truck data as received from weight service
-        
+        pending = [result for result in results if result["status"] == "created"]
+        providers = set()
+        for chunk in _chunks({result["provider_id"] for result in pending}):
+            providers.update(db.session.execute(select(Provider.id).where(Provider.id.in_(chunk))).scalars())
+        existing = set()
+        for chunk in _chunks([result["id"] for result in pending]):
+            existing.update(i.lower() for i in db.session.execute(
+                select(Truck.id).where(Truck.id.in_(chunk))).scalars())
+        for result in pending:
+            if result["provider_id"] not in providers:
+                result.update(status="error", error=f"Provider with ID {result['provider_id']} not found")
+            elif result["id"].lower() in existing:
+                result.update(status="error", error=f"Truck with license ID {result['id']} already exists")
+
+        rows = [{"id": result["id"], "provider_id": result["provider_id"]}
+                for result in results if result["status"] == "created"]
+        for chunk in _chunks(rows):
+            db.session.execute(Truck.__table__.insert().values(chunk))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"An error occurred while processing the request: {str(e)}"}), 500
+    return _bulk_response(results)
+
+RATES_INSERT_CHUNK = 1000  # Rows per multi-row INSERT
+RATES_MAX_ERRORS = 100  # Validation errors reported per upload
+
+
+def parse_rate_value(value):
+    """Returns a rate cell as a non-negative int, or raises ValueError."""
+    if isinstance(value, bool) or value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError("Rate is required")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"Rate must be a whole number, got {value}")
+        value = int(value)
+    try:
+        rate = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"Rate must be a whole number, got {value!r}")
+    if rate < 0:
+        raise ValueError(f"Rate must not be negative, got {rate}")
+    return rate
+
+
+def parse_scope_value(value):
+    """Returns a scope cell as None (all providers) or a provider id string, or raises ValueError."""
+    if value is None or str(value).strip().lower() in ("", "all"):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    scope = str(value).strip()
+    if not scope.isdigit():
+        raise ValueError(f"Scope must be 'All' or a provider id, got {value!r}")
+    return scope
+
+
+def read_rates_sheet(file_path):
+    """
+    Streams and validates the rates of an Excel file without touching the database.
+
+    The sheet is read in read-only mode, one row at a time, and must have
+    Product, Rate and Scope headers in its first row (in any order).
+
+    Returns:
+        tuple: (rates, errors) with rates as (product, rate, scope) tuples and
+        errors as {"row": <Excel row number>, "error": <str>} dicts.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(cell).strip() if cell is not None else None for cell in next(rows, None) or ()]
+        if not {'Product', 'Rate', 'Scope'}.issubset(headers):
+            return [], [{"row": 1, "error": "Excel file must contain Product, Rate, and Scope columns"}]
+        columns = [headers.index(name) for name in ('Product', 'Rate', 'Scope')]
+
+        rates = []
+        errors = []
+        seen = {}  # (product, scope) -> row number
+        for number, row in enumerate(rows, start=2):
+            cells = [row[i] if i < len(row) else None for i in columns]
+            if all(cell is None for cell in cells):
+                continue  # Blank row
+            product, rate, scope = cells
+            try:
+                product = str(product).strip() if product is not None else ""
+                if not product:
+                    raise ValueError("Product is required")
+                if len(product) > 50:
+                    raise ValueError(f"Product must be at most 50 characters, got {len(product)}")
+                rate = parse_rate_value(rate)
+                scope = parse_scope_value(scope)
+                key = (product.lower(), scope)
+                if key in seen:
+                    raise ValueError(f"Duplicate rate for {product} and scope {scope or 'All'} (row {seen[key]})")
+                seen[key] = number
+                rates.append((product, rate, scope))
+            except ValueError as e:
+                errors.append({"row": number, "error": str(e)})
+        if not rates and not errors:
+            errors.append({"row": 2, "error": "File contains no rates"})
+        return rates, errors
+    finally:
+        workbook.close()  # Read-only workbooks keep the file open
+
+
+def store_rate_version(rates, effective_from, file_name=None):
+    """
+    Stores rates as a new, immutable rate version.
+
+    The version is created unpublished, its rates are bulk-inserted with
+    multi-row INSERTs, and only then is it published, so readers (which only
+    see published versions) get all of its rates or none. Earlier versions
+    are kept, so bills of past periods keep their prices.
+
+    Returns:
+        RateVersion: The published version.
+    """
+    version = RateVersion(effective_from=effective_from, uploaded_at=datetime.now(),
+                          file_name=file_name, row_count=len(rates), published=False)
+    db.session.add(version)
+    db.session.commit()
+    try:
+        rows = [{"version_id": version.id, "product_id": product, "rate": rate, "scope": scope}
+                for product, rate, scope in rates]
+        for i in range(0, len(rows), RATES_INSERT_CHUNK):
+            db.session.execute(Rate.__table__.insert().values(rows[i:i + RATES_INSERT_CHUNK]))
+        version.published = True
+        db.session.commit()
     except Exception:
-        return "error_fetching_data"  # Generic error if connection fails
\ No newline at end of file
+        # Rates is MyISAM (no rollback): remove whatever part of the version was written
+        db.session.rollback()
+        db.session.execute(Rate.__table__.delete().where(Rate.version_id == version.id))
+        db.session.execute(RateVersion.__table__.delete().where(RateVersion.id == version.id))
+        db.session.commit()
+        raise
+    return version
+
+
+def upload_rates_from_excel(file_path, effective_from=None):
+    """
+    Validates every row of a rates file, then stores it as a new rate version.
+
+    Args:
+        file_path (str): Excel file.
+        effective_from (datetime): First moment the rates apply to (default: now).
+
+    Returns:
+        201 with the version, the row count and rows per second, or 400 with
+        the validation errors and their Excel row numbers (nothing is stored).
+    """
+    from app.rates import rate_resolver  # app.rates imports this module
+
+    started = time.monotonic()
+    try:
+        rates, errors = read_rates_sheet(file_path)
+    except Exception as e:
+        return jsonify({"error": f"Could not read Excel file: {e}"}), 400
+    if errors:
+        return jsonify({
+            "error": "Invalid rates file, no rates were changed",
+            "error_count": len(errors),
+            "errors": errors[:RATES_MAX_ERRORS]
+        }), 400
+
+    try:
+        version = store_rate_version(rates, effective_from or datetime.now(), os.path.basename(file_path))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    rate_resolver.add_version(version.id, version.effective_from, rates)  # Serve bills from the new rates
+
+    elapsed = time.monotonic() - started
+    return jsonify({
+        "message": "Rates uploaded successfully",
+        "version": version.id,
+        "effective_from": version.effective_from.strftime('%Y%m%d%H%M%S'),
+        "rows": len(rates),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(rates) / elapsed, 1) if elapsed else None
+    }), 201
+
+
+def list_rate_versions():
+    """Returns the published rate versions, oldest effective first."""
+    versions = RateVersion.query.filter_by(published=True).order_by(RateVersion.effective_from, RateVersion.id)
+    return [{
+        "version": v.id,
+        "effective_from": v.effective_from.strftime('%Y%m%d%H%M%S'),
+        "uploaded_at": v.uploaded_at.strftime('%Y%m%d%H%M%S'),
+        "file_name": v.file_name,
+        "rows": v.row_count
+    } for v in versions]
+
+
+def find_rate_version(version=None):
+    """
+    Finds a published rate version by id, or the one in effect now when version is None.
+
+    Returns:
+        RateVersion or None
+    """
+    query = RateVersion.query.filter_by(published=True)
+    if version is not None:
+        return query.filter_by(id=version).first()
+    return (query.filter(RateVersion.effective_from <= datetime.now())
+            .order_by(RateVersion.effective_from.desc(), RateVersion.id.desc()).first())
+
+
+def iter_version_rates(version_id):
+    """Yields (product, rate, scope) rows of a version, scope 'All' for all providers."""
+    rows = db.session.execute(
+        select(Rate.product_id, Rate.rate, Rate.scope).where(Rate.version_id == version_id).order_by(Rate.id)
+    )
+    for product, rate, scope in rows:
+        yield product, rate, scope if scope is not None else 'All'
+
+def get_truck_details(truck_id, from_time_str, to_time_str):
+    """
+    Fetches a truck's tara and sessions from the weight service.
+
+    Returns:
+        dict: The weight service's /item data, None if the truck is unknown
+        there, or "error_fetching_data" if the weight service failed.
+    """
+    try:
+        return get_weight_client().get_item(truck_id, from_time_str, to_time_str)
+    except WeightServiceError as e:
+        print(f"Error fetching truck {truck_id} from the weight service: {e}")
+        return "error_fetching_data"
@@ -0,0 +1,129 @@
+import bisect
+import threading
+from sqlalchemy import func, select
+from app import db
+from app.controller import Rate, RateVersion
+
+"""
+In-memory rate lookup for bills.
+
+Rates are stored as immutable versions, each effective from a moment in
+time. Every worker keeps the list of published versions, and the rates of
+each version it has used as a dict keyed by (product, scope), so bills
+resolve rates without touching the database. Versions never change once
+published, so their RateIndex is cached for good; the version list is
+swapped as a whole, so a bill always reads consistent rates.
+
+The worker that commits an upload adds the version at once. Every
+versions() call counts the published versions (one small query): published
+versions are never deleted, so a count that differs from the list's means
+another worker published one, and the list is reloaded. An upload is thus
+visible to every worker's next bill.
+"""
+
+ALL_SCOPE = "all"  # Key of rates for every provider (scope NULL or 'All', in any case)
+
+
+def scope_key(scope):
+    """Normalizes a Rates.scope value: 'all' for every provider, else the provider id as a string."""
+    if scope is None or str(scope).strip().lower() in ("", ALL_SCOPE):
+        return ALL_SCOPE
+    return str(scope).strip()
+
+
+class RateIndex:
+    """Immutable (product, scope) -> rate map of one rate version."""
+
+    def __init__(self, rows, version_id=None):
+        """rows: (product, rate, scope) tuples; products match case-insensitively."""
+        self.version_id = version_id
+        self._rates = {(str(product).strip().lower(), scope_key(scope)): rate for product, rate, scope in rows}
+
+    def __len__(self):
+        return len(self._rates)
+
+    def rate(self, product, provider_id):
+        """The provider's rate for a product, else the rate for all providers, else None."""
+        product = product.lower()
+        rate = self._rates.get((product, str(provider_id)))
+        if rate is None:
+            rate = self._rates.get((product, ALL_SCOPE))
+        return rate
+
+
+EMPTY_INDEX = RateIndex([])  # Before the first upload
+
+
+class RateVersions:
+    """Immutable list of published versions, ordered by (effective_from, id)."""
+
+    def __init__(self, versions):
+        self._versions = sorted(versions)  # (effective_from, id)
+        self._starts = [effective_from for effective_from, _ in self._versions]
+
+    def __len__(self):
+        return len(self._versions)
+
+    def at(self, moment):
+        """Id of the version in effect at a moment, or None before the first one."""
+        position = bisect.bisect_right(self._starts, moment)
+        return self._versions[position - 1][1] if position else None
+
+    def added(self, version_id, effective_from):
+        return RateVersions(self._versions + [(effective_from, version_id)])
+
+
+class RateResolver:
+    """Holds the rate versions and cached rate indexes of this process."""
+
+    def __init__(self):
+        self._versions = None
+        self._indexes = {}  # version id -> RateIndex
+        self._lock = threading.Lock()
+
+    def versions(self):
+        """Returns the published versions, reloading them (one more query) when another process published one."""
+        published = db.session.execute(
+            select(func.count()).select_from(RateVersion).where(RateVersion.published.is_(True))
+        ).scalar()
+        versions = self._versions
+        if versions is None or len(versions) != published:
+            with self._lock:
+                versions = self._versions
+                if versions is None or len(versions) != published:
+                    rows = db.session.execute(
+                        select(RateVersion.effective_from, RateVersion.id).where(RateVersion.published.is_(True))
+                    ).all()
+                    versions = self._versions = RateVersions([tuple(row) for row in rows])
+        return versions
+
+    def index(self, version_id):
+        """Returns the rates of a version, loading them once with an indexed query."""
+        if version_id is None:
+            return EMPTY_INDEX
+        index = self._indexes.get(version_id)
+        if index is None:
+            rows = db.session.execute(
+                select(Rate.product_id, Rate.rate, Rate.scope).where(Rate.version_id == version_id)
+            ).all()
+            index = self._indexes[version_id] = RateIndex(rows, version_id)
+        return index
+
+    def index_at(self, moment):
+        """Returns the rates in effect at a moment (datetime)."""
+        return self.index(self.versions().at(moment))
+
+    def add_version(self, version_id, effective_from, rows):
+        """Adds a version this process just published."""
+        self._indexes[version_id] = RateIndex(rows, version_id)
+        with self._lock:
+            if self._versions is not None:  # Otherwise the next lookup loads it with the others
+                self._versions = self._versions.added(version_id, effective_from)
+
+    def invalidate(self):
+        """Forgets everything; the next lookup reloads from the database."""
+        self._versions = None
+        self._indexes = {}
+
+
+rate_resolver = RateResolver()
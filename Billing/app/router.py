@@ -1,7 +1,12 @@
-from flask import Blueprint, jsonify, request, send_file
-from app.controller import db,update_provider_controller,add_provider,health_check_controller,add_truck,update_truck_provider,upload_rates_from_excel, Provider, get_truck_details  # Import controllers
+from flask import Blueprint, Response, jsonify, request, send_file, stream_with_context
+from app.controller import db,update_provider_controller,add_provider,health_check_controller,add_truck,update_truck_provider,upload_rates_from_excel, Provider, get_truck_details, find_rate_version, iter_version_rates, list_rate_versions, add_providers_bulk, add_trucks_bulk, read_bulk_file, BULK_MAX_ITEMS  # Import controllers
+from app.bill import compute_bill
+from app.weight_client import WeightServiceError
+import csv
+import io
 import os
 from datetime import datetime
+from openpyxl import Workbook
 
 # Create a blueprint for provider-related routes
 provider_routes = Blueprint("provider_routes", __name__)
@@ -35,6 +40,48 @@ def post_provider():
     response = add_provider(provider_name)
     return response
 
+def bulk_items():
+    """Returns the items of a bulk request (JSON array body or uploaded 'file'), or an error response."""
+    file = request.files.get('file')
+    if file:
+        try:
+            items = read_bulk_file(file)
+        except ValueError as e:
+            return None, (jsonify({"error": str(e)}), 400)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return None, (jsonify({"error": "Body must be a JSON array, or upload a CSV or JSON file as 'file'"}), 400)
+    if not items:
+        return None, (jsonify({"error": "No items provided"}), 400)
+    if len(items) > BULK_MAX_ITEMS:
+        return None, (jsonify({"error": f"At most {BULK_MAX_ITEMS} items per request"}), 400)
+    return items, None
+
+@provider_routes.route("/providers/bulk", methods=["POST"])
+def post_providers_bulk():
+    """
+    Registers many providers: a JSON array of names or {"name"} objects, or a
+    CSV (name column) or JSON file uploaded as 'file'.
+    """
+    items, error = bulk_items()
+    if error:
+        return error
+    return add_providers_bulk(items)
+
+@provider_routes.route("/trucks/bulk", methods=["POST"])
+def post_trucks_bulk():
+    """
+    Registers many trucks: a JSON array of {"id", "provider_id"} objects, or a
+    CSV (id and provider_id columns) or JSON file uploaded as 'file', such as
+    resources/trucks.json. provider_id (query or form parameter) applies to
+    items without one.
+    """
+    items, error = bulk_items()
+    if error:
+        return error
+    return add_trucks_bulk(items, request.values.get("provider_id"))
+
 @provider_routes.route("/health", methods=["GET"])
 def health_check():
     status, http_status=health_check_controller()
@@ -65,30 +112,87 @@ def put_truck(id):
 
 @provider_routes.route('/rates', methods=['POST'])
 def upload_rates():
+    """
+    Uploads a rates file as a new rate version.
+
+    Form or query parameters:
+    - file: Excel file with Product, Rate and Scope columns
+    - effective_from (str): First moment the rates apply to, YYYYMMDDHHMMSS (default: now)
+    """
     file = request.files.get('file')
     if not file:
         return jsonify({"error": "No file provided"}), 400
 
+    effective_from = request.values.get('effective_from')
+    if effective_from:
+        try:
+            effective_from = datetime.strptime(effective_from, '%Y%m%d%H%M%S')
+        except ValueError:
+            return jsonify({"error": "Invalid effective_from. Use YYYYMMDDHHMMSS."}), 400
+
     # Save the file to /app/in folder inside the container
     file_path = os.path.join('/app/in', file.filename)
     file.save(file_path)
     
     # Call function to process the uploaded file
-    return upload_rates_from_excel(file_path)
+    return upload_rates_from_excel(file_path, effective_from or None)
 
 @provider_routes.route("/rates", methods=["GET"])
 def get_rate():
-    try:
-        # Excel file location
-        file_path = f"/app/in/rates.xlsx"
-        return send_file(
-            file_path,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'rates.xlsx'
-        )
-    except FileNotFoundError:
-        return jsonify({"error": "Excel file not found"}), 404
+    """
+    Downloads a rate version, generated from the database.
+
+    Query parameters:
+    - version (int): Rate version (default: the version in effect now, see /rates/versions)
+    - format (str): xlsx (default) or csv
+    """
+    version = request.args.get('version')
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({"error": "Unsupported format. Valid options are: xlsx, csv"}), 400
+    if version is not None and not version.isdigit():
+        return jsonify({"error": "version must be a rate version id"}), 400
+
+    rate_version = find_rate_version(int(version) if version is not None else None)
+    if rate_version is None:
+        return jsonify({"error": "Rate version not found"}), 404
+    download_name = f"rates_v{rate_version.id}.{export_format}"
+
+    if export_format == 'csv':
+        def rows():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(('Product', 'Rate', 'Scope'))
+            for row in iter_version_rates(rate_version.id):
+                writer.writerow(row)
+                if buffer.tell() > 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        return Response(stream_with_context(rows()), mimetype='text/csv',
+                        headers={"Content-Disposition": f"attachment; filename={download_name}"})
+
+    # xlsx is a zip archive written at the end, so it is built in memory with a write-only workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(('Product', 'Rate', 'Scope'))
+    for row in iter_version_rates(rate_version.id):
+        sheet.append(row)
+    content = io.BytesIO()
+    workbook.save(content)
+    content.seek(0)
+    return send_file(
+        content,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=download_name
+    )
+
+@provider_routes.route("/rates/versions", methods=["GET"])
+def get_rate_versions():
+    return jsonify(list_rate_versions()), 200
 
 @provider_routes.route('/truck/<id>', methods=['GET'])
 def get_truck(id):
@@ -102,17 +206,25 @@ def get_truck(id):
     return jsonify(result), 200
     # return jsonify({"message": "Success"}), 200 
 
+@provider_routes.route('/bill/<int:provider_id>', methods=['GET'])
+def get_bill(provider_id):
+    """
+    Bill of a provider for the sessions its trucks started between from and to
+    (YYYYMMDDHHMMSS, default: from the 1st of this month until now).
+    """
+    from_param = request.args.get('from') or datetime.now().replace(day=1).strftime('%Y%m%d000000')
+    to_param = request.args.get('to') or datetime.now().strftime('%Y%m%d%H%M%S')
+    try:
+        datetime.strptime(from_param, '%Y%m%d%H%M%S')
+        datetime.strptime(to_param, '%Y%m%d%H%M%S')
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYYMMDDHHMMSS."}), 400
 
-
-
-
-
-
-
-
-
-
-
-
-
-
+    try:
+        bill = compute_bill(provider_id, from_param, to_param)
+    except WeightServiceError as e:
+        print(f"Error fetching sessions for the bill of provider {provider_id}: {e}")
+        return jsonify({"error": "Failed to fetch truck data"}), 500
+    if bill is None:
+        return jsonify({"error": f"Provider with ID {provider_id} not found"}), 404
+    return jsonify(bill), 200
@@ -0,0 +1,134 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Weight service connection settings
+WEIGHT_SERVICE_URL = os.getenv("WEIGHT_SERVICE_URL", "http://host.docker.internal:5000")
+WEIGHT_CONNECT_TIMEOUT = float(os.getenv("WEIGHT_CONNECT_TIMEOUT", 2))
+WEIGHT_READ_TIMEOUT = float(os.getenv("WEIGHT_READ_TIMEOUT", 10))
+WEIGHT_RETRIES = int(os.getenv("WEIGHT_RETRIES", 3))
+WEIGHT_BACKOFF = float(os.getenv("WEIGHT_BACKOFF", 0.2))  # Retries wait 0.2s, 0.4s, 0.8s, ...
+WEIGHT_POOL_SIZE = int(os.getenv("WEIGHT_POOL_SIZE", 10))  # Keep-alive connections per process
+WEIGHT_BULK_CHUNK = int(os.getenv("WEIGHT_BULK_CHUNK", 1000))  # Ids per POST /items or /sessions request
+
+
+class WeightServiceError(Exception):
+    """Raised when the weight service cannot be reached or answers with an unexpected status."""
+
+
+class WeightClient:
+    """
+    Client for the weight service API.
+
+    Keeps a pool of keep-alive connections, applies connect and read timeouts
+    to every call, and retries connection errors and 502/503/504 answers with
+    exponential backoff. Lookups of many ids are split into bulk requests
+    that run in parallel on a thread pool. Safe to share between threads.
+    """
+
+    def __init__(self, base_url=WEIGHT_SERVICE_URL, connect_timeout=WEIGHT_CONNECT_TIMEOUT,
+                 read_timeout=WEIGHT_READ_TIMEOUT, retries=WEIGHT_RETRIES, backoff=WEIGHT_BACKOFF,
+                 pool_size=WEIGHT_POOL_SIZE, bulk_chunk=WEIGHT_BULK_CHUNK):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.bulk_chunk = bulk_chunk
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),  # Every call made here is a read
+            raise_on_status=False,  # The last answer is returned and reported by the caller
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="weight-client")
+
+    def _request(self, method, path, **kwargs):
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise WeightServiceError(f"Weight service unreachable: {e}") from e
+
+    def _json(self, response):
+        if response.status_code != 200:
+            raise WeightServiceError(f"Weight service answered {response.status_code} for {response.request.url}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise WeightServiceError(f"Weight service sent invalid JSON: {e}") from e
+
+    def get_item(self, item_id, from_time=None, to_time=None):
+        """
+        Fetches a truck or container from GET /item/<id>.
+
+        Returns:
+            dict: {"id", "tara", "sessions"}, or None if the weight service does not know the id.
+
+        Raises:
+            WeightServiceError: If the call failed.
+        """
+        params = {key: value for key, value in (("from", from_time), ("to", to_time)) if value}
+        # Ids are free text: "/", "?" or "#" must not change the path
+        response = self._request("GET", f"/item/{quote(str(item_id), safe='')}", params=params)
+        if response.status_code == 404:
+            return None
+        return self._json(response)
+
+    def _bulk(self, path, ids, payload):
+        """POSTs ids in chunks, in parallel, and merges the id -> details maps."""
+        ids = list(dict.fromkeys(str(i) for i in ids))
+        chunks = [ids[i:i + self.bulk_chunk] for i in range(0, len(ids), self.bulk_chunk)]
+
+        def fetch(chunk):
+            return self._json(self._request("POST", path, json={**payload, "ids": chunk}))
+
+        results = {}
+        for found in self.executor.map(fetch, chunks):
+            results.update(found)
+        return {i: results.get(i) for i in ids}
+
+    def get_items(self, item_ids, from_time=None, to_time=None):
+        """
+        Fetches many trucks or containers with POST /items.
+
+        Returns:
+            dict: id -> {"id", "tara", "sessions"}, or None for ids the weight service does not know.
+
+        Raises:
+            WeightServiceError: If any call failed.
+        """
+        payload = {key: value for key, value in (("from", from_time), ("to", to_time)) if value}
+        return self._bulk("/items", item_ids, payload)
+
+    def get_sessions(self, session_ids):
+        """
+        Fetches many weighing sessions with POST /sessions.
+
+        Returns:
+            dict: id (as a string) -> session details, or None for unknown ids and 'out' transactions.
+
+        Raises:
+            WeightServiceError: If any call failed.
+        """
+        return self._bulk("/sessions", session_ids, {})
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_weight_client():
+    """Returns the process-wide WeightClient, created on first use (so after gunicorn forks its workers)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WeightClient()
+    return _client
@@ -17,10 +17,26 @@ CREATE TABLE IF NOT EXISTS `Provider` (
   PRIMARY KEY (`id`)
 ) ENGINE=MyISAM  AUTO_INCREMENT=10001 ;
 
+CREATE TABLE IF NOT EXISTS `RateVersions` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `effective_from` datetime NOT NULL,
+  `uploaded_at` datetime NOT NULL,
+  `file_name` varchar(255) DEFAULT NULL,
+  `row_count` int(11) NOT NULL DEFAULT 0,
+  `published` tinyint(1) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`),
+  KEY `idx_effective_from` (`effective_from`)
+) ENGINE=MyISAM ;
+
 CREATE TABLE IF NOT EXISTS `Rates` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `version_id` int(11) NOT NULL,
   `product_id` varchar(50) NOT NULL,
   `rate` int(11) DEFAULT 0,
   `scope` varchar(50) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_version_product` (`version_id`, `product_id`),
+  FOREIGN KEY (`version_id`) REFERENCES `RateVersions`(`id`),
   FOREIGN KEY (scope) REFERENCES `Provider`(`id`)
 ) ENGINE=MyISAM ;
 
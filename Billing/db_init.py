@@ -1,7 +1,7 @@
 import os  # For environment variable handling and checking file existence
 import subprocess  # For executing shell commands (e.g., running MySQL dump)
 import time  # For retry logic with sleep
-from sqlalchemy import text  # For handling raw SQL queries
+from sqlalchemy import text, inspect  # For handling raw SQL queries and reading the schema
 from sqlalchemy.exc import OperationalError  # For catching database connection errors
 from flask_sqlalchemy import SQLAlchemy  # For SQLAlchemy integration with Flask
 
@@ -40,6 +40,7 @@ def initialize_database(app, db, dump_file="billingdb.sql", max_retries=5):
                         print(f"Error: {dump_file} not found.")
                 else:
                     print("Database already initialized.")
+                upgrade_rates_schema(db)
                 break
         except OperationalError as e:
             retry_count += 1
@@ -49,3 +50,48 @@ def initialize_database(app, db, dump_file="billingdb.sql", max_retries=5):
 
     if retry_count == max_retries:
         raise Exception("Failed to connect to the database after multiple retries.")
+
+
+CREATE_RATE_VERSIONS = """
+    CREATE TABLE IF NOT EXISTS `RateVersions` (
+      `id` int(11) NOT NULL AUTO_INCREMENT,
+      `effective_from` datetime NOT NULL,
+      `uploaded_at` datetime NOT NULL,
+      `file_name` varchar(255) DEFAULT NULL,
+      `row_count` int(11) NOT NULL DEFAULT 0,
+      `published` tinyint(1) NOT NULL DEFAULT 0,
+      PRIMARY KEY (`id`),
+      KEY `idx_effective_from` (`effective_from`)
+    ) ENGINE=MyISAM
+"""
+
+
+def upgrade_rates_schema(db):
+    """
+    Adds rate versions to databases created before them; safe to re-run.
+
+    The rates already stored become version 1, effective since 1970, so
+    past bills keep their prices.
+    """
+    if db.engine.dialect.name != "mysql":
+        return  # Other databases (tests) are created from the models
+    with db.engine.begin() as conn:
+        conn.execute(text(CREATE_RATE_VERSIONS))
+        columns = {column["name"] for column in inspect(conn).get_columns("Rates")}
+        if "version_id" in columns:
+            return
+        print("Upgrading Rates to versioned rate sets...")
+        conn.execute(text("""
+            ALTER TABLE `Rates`
+            ADD COLUMN `id` int(11) NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST,
+            ADD COLUMN `version_id` int(11) NOT NULL DEFAULT 0 AFTER `id`,
+            ADD INDEX `idx_version_product` (`version_id`, `product_id`)
+        """))
+        count = conn.execute(text("SELECT COUNT(*) FROM `Rates`")).scalar()
+        if count:
+            version_id = conn.execute(text("""
+                INSERT INTO `RateVersions` (effective_from, uploaded_at, file_name, row_count, published)
+                VALUES ('1970-01-01 00:00:00', NOW(), 'rates before versioning', :count, 1)
+            """), {"count": count}).lastrowid
+            conn.execute(text("UPDATE `Rates` SET version_id = :version"), {"version": version_id})
+        print(f"Rates upgraded: {count} existing rates kept as the first version")
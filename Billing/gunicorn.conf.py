@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+
+"""
+Gunicorn configuration for the Billing API:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker is a separate process with its own SQLAlchemy pool. Unless
+DB_POOL_SIZE is set explicitly, the pool holds one connection per request
+thread, so the service opens at most WEB_WORKERS x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+connections to MySQL.
+
+Environment:
+- WEB_BIND: Address to listen on (default: 0.0.0.0:5001)
+- WEB_WORKERS: Worker processes (default: 2 x CPUs + 1, at most 8)
+- WEB_THREADS: Request threads per worker (default: 4)
+- WEB_KEEPALIVE: Seconds to keep idle client connections open (default: 5)
+- WEB_TIMEOUT: Seconds before a silent worker is restarted (default: 120)
+"""
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.getenv("WEB_THREADS", 4))
+worker_class = "gthread"
+keepalive = int(os.getenv("WEB_KEEPALIVE", 5))
+timeout = int(os.getenv("WEB_TIMEOUT", 120))  # Rate uploads and bills can take a while
+accesslog = "-"
+errorlog = "-"
+
+# Read by create_app() when the workers import wsgi.py
+os.environ.setdefault("DB_POOL_SIZE", str(threads))
+
+
+def on_starting(server):
+    """Creates the schema once, in the master, before any worker starts."""
+    from app import create_app
+    from db_init import initialize_database
+
+    app = create_app(
+        db_uri=f"mysql+pymysql://{os.getenv('DB_USER', 'root')}:{os.getenv('DB_PASSWORD', 'password')}"
+               f"@{os.getenv('DB_HOST', 'db')}/{os.getenv('DB_NAME', 'billdb')}"
+    )
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        initialize_database(app, db)
+        db.engine.dispose()  # Workers open their own connections after the fork
+    server.log.info(f"{workers} workers x {threads} threads")
@@ -216,5 +216,231 @@ def test_update_nonexistent_truck(api_url):
     data = response.json()
     assert 'error' in data
 
+@responses.activate
+def test_weight_client_item_lookup():
+    from app.weight_client import WeightClient, WeightServiceError
+    client = WeightClient(base_url="http://weight.test")
+    responses.add(responses.GET, "http://weight.test/item/ABC123",
+                  json={"id": "ABC123", "tara": 1000, "sessions": [1234]}, status=200)
+    responses.add(responses.GET, "http://weight.test/item/UNKNOWN", json={"error": "Item not found"}, status=404)
+    responses.add(responses.GET, "http://weight.test/item/BROKEN", json={"error": "boom"}, status=500)
+
+    assert client.get_item("ABC123", "20240101000000", "20240131235959")["tara"] == 1000
+    assert "from=20240101000000" in responses.calls[0].request.url
+    assert client.get_item("UNKNOWN") is None
+    with pytest.raises(WeightServiceError):
+        client.get_item("BROKEN")
+
+@responses.activate
+def test_weight_client_quotes_item_id():
+    from app.weight_client import WeightClient
+    client = WeightClient(base_url="http://weight.test")
+    responses.add(responses.GET, "http://weight.test/item/a%2Fb%3Fc%23d",
+                  json={"id": "a/b?c#d", "tara": 1000, "sessions": []}, status=200)
+    assert client.get_item("a/b?c#d", "20240101000000")["id"] == "a/b?c#d"
+    assert responses.calls[0].request.url == "http://weight.test/item/a%2Fb%3Fc%23d?from=20240101000000"
+
+@responses.activate
+def test_weight_client_bulk_lookup_in_chunks():
+    from app.weight_client import WeightClient
+
+    def items(request):
+        ids = json.loads(request.body)["ids"]
+        return 200, {}, json.dumps({i: ({"id": i, "tara": 1000, "sessions": []} if i != "T-3" else None) for i in ids})
+
+    responses.add_callback(responses.POST, "http://weight.test/items", callback=items)
+    client = WeightClient(base_url="http://weight.test", bulk_chunk=2)
+    result = client.get_items(["T-1", "T-2", "T-3", "T-1"])
+    assert len(responses.calls) == 2
+    assert list(result) == ["T-1", "T-2", "T-3"]
+    assert result["T-1"]["tara"] == 1000 and result["T-3"] is None
+
+@responses.activate
+def test_compute_bill(monkeypatch):
+    from app import create_app, db
+    from app.controller import Provider, Truck, store_rate_version
+    from app.weight_client import WeightClient
+    import app.bill as bill
+    from app.rates import rate_resolver
+
+    sessions = {
+        "1": {"id": 1, "truck": "T-1", "bruto": 9000, "produce": "navel", "truckTara": 5000, "neto": 3000,
+              "datetime": "20240105080000"},
+        "2": {"id": 2, "truck": "T-1", "bruto": 9000, "produce": "mandarin", "truckTara": 5000, "neto": 2000,
+              "datetime": "20240110080000"},
+        "3": {"id": 3, "truck": "T-2", "bruto": 9000, "produce": "navel", "truckTara": 5000, "neto": 1000,
+              "datetime": "20240125080000"},
+        "4": {"id": 4, "truck": "T-2", "bruto": 9000, "produce": "navel", "datetime": "20240126080000"},
+    }
+    responses.add(responses.POST, "http://weight.test/items", json={
+        "T-1": {"id": "T-1", "tara": 5000, "sessions": [1, 2]},
+        "T-2": {"id": "T-2", "tara": 5000, "sessions": [3, 4]},
+        "T-3": None,
+    })
+    responses.add(responses.POST, "http://weight.test/sessions", json=sessions)
+    monkeypatch.setattr(bill, "get_weight_client", lambda: WeightClient(base_url="http://weight.test"))
+
+    flask_app = create_app()
+    with flask_app.app_context():
+        db.create_all()
+        rate_resolver.invalidate()
+        db.session.add_all([Provider(id=1, name="pro1"), Provider(id=2, name="pro2")])
+        db.session.add_all([Truck(id="T-1", provider_id=1), Truck(id="T-2", provider_id=1),
+                            Truck(id="T-3", provider_id=1), Truck(id="T-9", provider_id=2)])
+        db.session.commit()
+        store_rate_version([("Navel", 93, None), ("Mandarin", 104, None), ("Mandarin", 120, "1")],
+                           datetime(2024, 1, 1))
+        store_rate_version([("Navel", 100, None)], datetime(2024, 1, 20))  # Price change mid-month
+
+        result = bill.compute_bill(1, "20240101000000", "20240131235959")
+        assert bill.compute_bill(3, "20240101000000", "20240131235959") is None
+
+    assert sorted(json.loads(responses.calls[0].request.body)["ids"]) == ["T-1", "T-2", "T-3"]
+    assert result["truckCount"] == 2 and result["sessionCount"] == 4
+    assert result["products"] == [
+        {"product": "mandarin", "count": "1", "amount": 2000, "rate": 120, "pay": 240000},
+        {"product": "navel", "count": "1", "amount": 3000, "rate": 93, "pay": 279000},
+        {"product": "navel", "count": "2", "amount": 1000, "rate": 100, "pay": 100000},
+    ]
+    assert result["total"] == 619000
+
+def test_rate_index_prefers_provider_scope():
+    from app.rates import RateIndex
+    index = RateIndex([("Mandarin", 104, "All"), ("Mandarin", 120, "45"), ("Navel", 93, None), ("Tangerine", 85, 12)])
+    assert index.rate("mandarin", 45) == 120
+    assert index.rate("Mandarin", 43) == 104
+    assert index.rate("navel", 45) == 93
+    assert index.rate("tangerine", 45) is None
+    assert index.rate("tangerine", "12") == 85
+
+def test_upload_adds_rate_version(temp_upload_dir):
+    from app import create_app, db
+    from app.controller import upload_rates_from_excel
+    from app.rates import rate_resolver
+
+    def save(rows):
+        workbook = Workbook()
+        for row in (("Product", "Rate", "Scope"), *rows):
+            workbook.active.append(row)
+        path = temp_upload_dir / "rates.xlsx"
+        workbook.save(path)
+        return str(path)
+
+    flask_app = create_app()
+    with flask_app.app_context():
+        db.create_all()
+        rate_resolver.invalidate()
+        assert rate_resolver.index_at(datetime(2024, 1, 1)).rate("navel", 7) is None
+
+        response, status = upload_rates_from_excel(save([("Navel", 93, "All"), ("Blood", 112, 7)]),
+                                                   datetime(2024, 1, 1))
+        assert status == 201
+        first = response.get_json()["version"]
+        response, status = upload_rates_from_excel(save([("Navel", 95, "All")]), datetime(2024, 2, 1))
+        assert status == 201
+
+        january = rate_resolver.index_at(datetime(2024, 1, 15))
+        assert january.version_id == first
+        assert january.rate("navel", 7) == 93 and january.rate("blood", 7) == 112 and january.rate("blood", 8) is None
+        assert rate_resolver.index_at(datetime(2024, 2, 1)).rate("navel", 7) == 95
+        assert rate_resolver.index_at(datetime(2023, 12, 31)).rate("navel", 7) is None
+
+        client = flask_app.test_client()
+        assert [v["effective_from"] for v in client.get("/rates/versions").get_json()] == ["20240101000000",
+                                                                                         "20240201000000"]
+        response = client.get(f"/rates?version={first}&format=csv")
+        assert response.status_code == 200
+        assert response.get_data(as_text=True).splitlines() == ["Product,Rate,Scope", "Navel,93,All", "Blood,112,7"]
+        response = client.get("/rates")  # The version in effect now
+        assert response.status_code == 200
+        from openpyxl import load_workbook
+        rows = list(load_workbook(BytesIO(response.data)).active.iter_rows(values_only=True))
+        assert rows == [("Product", "Rate", "Scope"), ("Navel", 95, "All")]
+        assert client.get("/rates?version=999").status_code == 404
+
+def test_other_workers_see_new_rate_version_at_once():
+    from app import create_app, db
+    from app.controller import store_rate_version
+    from app.rates import RateResolver
+
+    flask_app = create_app()
+    with flask_app.app_context():
+        db.create_all()
+        other_worker = RateResolver()
+        before = len(other_worker.versions())
+        version = store_rate_version([("Navel", 97, None)], datetime(2030, 1, 1))  # Published by this worker
+        assert len(other_worker.versions()) == before + 1
+        index = other_worker.index_at(datetime(2030, 1, 2))
+        assert index.version_id == version.id and index.rate("navel", 7) == 97
+
+def test_upload_rates_reports_invalid_rows(temp_upload_dir):
+    from app import create_app, db
+    from app.controller import Rate, RateVersion, upload_rates_from_excel
+
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in (("Scope", "Product", "Rate"), ("All", "Navel", 93), (7, "Blood", "abc"), (None, None, None),
+                ("x", "Mandarin", 104), ("ALL", "navel", 90), ("All", "Valencia", 87.0)):
+        sheet.append(row)
+    path = temp_upload_dir / "rates.xlsx"
+    workbook.save(path)
+
+    flask_app = create_app()
+    with flask_app.app_context():
+        db.create_all()
+
+        response, status = upload_rates_from_excel(str(path))
+        assert status == 400
+        assert [error["row"] for error in response.get_json()["errors"]] == [3, 5, 6]
+        assert Rate.query.count() == 0 and RateVersion.query.count() == 0  # Nothing stored
+
+        sheet.delete_rows(3, 4)  # Leaves the header, Navel and Valencia
+        workbook.save(path)
+        response, status = upload_rates_from_excel(str(path))
+        assert status == 201 and response.get_json()["rows"] == 2
+        assert sorted((rate.product_id, rate.rate) for rate in Rate.query.all()) == [("Navel", 93), ("Valencia", 87)]
+
+def test_bulk_registration():
+    from app import create_app, db
+    from app.controller import Provider, Truck
+
+    flask_app = create_app()
+    with flask_app.app_context():
+        db.create_all()
+        db.session.add(Provider(id=1, name="pro1"))
+        db.session.commit()
+        client = flask_app.test_client()
+
+        response = client.post("/providers/bulk", json=["pro2", {"name": "pro3"}, "pro1", "pro2", ""])
+        assert response.status_code == 207
+        data = response.get_json()
+        assert [r["status"] for r in data["results"]] == ["created", "created", "error", "error", "error"]
+        assert data["created"] == 2 and data["results"][0]["id"] == Provider.query.filter_by(name="pro2").one().id
+
+        csv_file = BytesIO(b"id,provider_id\nT-1,1\nT-2,999\nT-3,\n")
+        response = client.post("/trucks/bulk?provider_id=1", data={"file": (csv_file, "trucks.csv")},
+                               content_type="multipart/form-data")
+        assert response.status_code == 207
+        assert [(r["id"], r["status"]) for r in response.get_json()["results"]] == [
+            ("T-1", "created"), ("T-2", "error"), ("T-3", "created")]
+
+        with open(Path(__file__).parent.parent / "resources" / "trucks.json", "rb") as f:
+            fleet = json.load(f)
+            f.seek(0)
+            response = client.post("/trucks/bulk", data={"file": (f, "trucks.json"), "provider_id": "1"},
+                                   content_type="multipart/form-data")
+        assert response.status_code == 201
+        assert response.get_json()["created"] == len(fleet)
+        assert Truck.query.count() == len(fleet) + 2
+
+        assert client.post("/trucks/bulk", json=[{"id": "T-1", "provider_id": 1}]).status_code == 400
+        # Truck ids compare case-insensitively, in the batch as in the Trucks table
+        response = client.post("/trucks/bulk", json=[{"id": "T-5", "provider_id": 1}, {"id": "t-5", "provider_id": 1},
+                                                     {"id": "T-1", "provider_id": 1}])
+        assert response.status_code == 207
+        assert [(r["status"], r.get("error")) for r in response.get_json()["results"]] == [
+            ("created", None), ("error", "Duplicate of item 0"), ("error", "Truck with license ID T-1 already exists")]
+        assert client.post("/trucks/bulk", json={"id": "T-4"}).status_code == 400
+
 if __name__ == '__main__':
-    pytest.main(['-v'])
\ No newline at end of file
+    pytest.main(['-v'])
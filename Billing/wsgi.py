@@ -0,0 +1,14 @@
+import os  # For environment variables
+from app import create_app  # Import the factory function
+
+# Environment variables for database configuration
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+DB_HOST = os.getenv("DB_HOST", "db")
+DB_NAME = os.getenv("DB_NAME", "billdb")
+
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# The database is initialized once by the gunicorn master (see gunicorn.conf.py), not per worker
+app = create_app(
+    db_uri=f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+)
@@ -1,11 +1,22 @@
 from flask import Flask, request, Response, jsonify, render_template
 from datetime import datetime
-import mysql.connector
 import json
 import os
-import csv
 from mysql.connector import Error
 import time
+from db import get_db_connection, pool_stats, get_named_lock, release_named_lock
+from containers import (record_transaction_containers, delete_transaction_containers,
+                        backfill_transaction_containers, resolve_container_weights,
+                        container_cache, check_unknown_containers, SQL_CONTAINER_GENERATION_COLUMN)
+from migrations import migrate
+from backfill import backfill_neto_history
+from batch import process_container_file, submit_job, get_job, fail_interrupted_jobs
+from export import EXPORT_FORMATS
+from rollups import RollupDelta, rebuild_rollups, summarize, SUMMARY_GROUPS
+from sessions import resolve_items, resolve_sessions
+import metrics
+import uuid
+import click
 
 """
 Weight Station API
@@ -20,18 +31,52 @@ This Flask application manages a weighing station system that handles:
 Database Schema:
 - transactions: Stores weight records
 - containers_registered: Container reference data
+- transaction_containers: One row per (transaction, container) pair, used for container lookups
 """
 
 app = Flask(__name__)
 
-# Database configuration
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'user': os.getenv('DB_USER', 'user_weight'),
-    'password': os.getenv('DB_PASSWORD', 'bashisthebest'),
-    'database': os.getenv('DB_NAME', 'weight'),
-    'port': int(os.getenv('DB_PORT', 3306))
-}
+# Rows per multi-row INSERT when registering containers from /batch-weight
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', 1000))
+# Largest page GET /weight returns for ?limit=, and rows fetched per step when streaming
+WEIGHT_PAGE_MAX = int(os.getenv('WEIGHT_PAGE_MAX', 10000))
+WEIGHT_STREAM_CHUNK = int(os.getenv('WEIGHT_STREAM_CHUNK', 500))
+# Most ids accepted by POST /items and POST /sessions
+BULK_MAX_IDS = int(os.getenv('BULK_MAX_IDS', 5000))
+
+# Hot queries, kept as constants so that the test suite can EXPLAIN them
+SQL_LAST_TRUCK_RECORD = '''
+    SELECT id, direction 
+    FROM transactions 
+    WHERE truck = %s 
+    ORDER BY datetime DESC, id DESC 
+    LIMIT 1
+'''
+SQL_LAST_TRUCK_SESSION = f'''
+    SELECT id, containers, bruto, produce, direction, {SQL_CONTAINER_GENERATION_COLUMN}
+    FROM transactions 
+    WHERE truck = %s 
+    ORDER BY datetime DESC, id DESC 
+    LIMIT 1
+'''
+SQL_LAST_RECORD = f'''
+    SELECT direction, {SQL_CONTAINER_GENERATION_COLUMN}
+    FROM transactions 
+    ORDER BY id DESC 
+    LIMIT 1
+'''
+SQL_WEIGHT_RANGE = '''
+    SELECT id, datetime, direction, bruto, neto, produce, containers 
+    FROM transactions 
+    WHERE datetime BETWEEN %s AND %s 
+    AND direction IN ({placeholders}){after}
+    ORDER BY datetime ASC, id ASC{limit}
+'''
+# Keyset condition and page size appended to SQL_WEIGHT_RANGE for ?cursor= and ?limit=
+SQL_WEIGHT_AFTER = '''
+    AND (datetime > %s OR (datetime = %s AND id > %s))'''
+SQL_WEIGHT_LIMIT = '''
+    LIMIT %s'''
 def wait_for_db(max_retries=30, delay_seconds=2):
     """Wait for database to become available"""
     for i in range(max_retries):
@@ -45,24 +90,64 @@ def wait_for_db(max_retries=30, delay_seconds=2):
             time.sleep(delay_seconds)
     raise Exception("Could not connect to database after maximum retries")
 
+@app.before_request
+def start_request_metrics():
+    metrics.start_request(request.url_rule.rule if request.url_rule else 'unmatched')
 
-def get_db_connection():
-    """Establishes and returns a MySQL database connection"""
-    return mysql.connector.connect(**DB_CONFIG)
+@app.after_request
+def finish_request_metrics(response):
+    # Streamed bodies are sent after this point: their queries are still timed, the request is not
+    metrics.finish_request(request.method, response.status_code)
+    return response
 
 @app.route('/', methods=['GET'])
 def main_form():
     return render_template('index.html')
 
+def encode_weight_cursor(row):
+    """Returns the opaque keyset cursor pointing right after a transactions row."""
+    return f"{row[1].strftime('%Y%m%d%H%M%S')}-{row[0]}"
+
+def decode_weight_cursor(token):
+    """
+    Parses a cursor produced by encode_weight_cursor.
+
+    Returns:
+        tuple: (datetime, id)
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    stamp, _, last_id = token.partition('-')
+    return datetime.strptime(stamp, '%Y%m%d%H%M%S'), int(last_id)
+
+def fetch_batches(cursor):
+    """Yields the rows of an executed query WEIGHT_STREAM_CHUNK at a time."""
+    while True:
+        rows = cursor.fetchmany(WEIGHT_STREAM_CHUNK)
+        if not rows:
+            return
+        yield rows
+
 @app.route('/weight', methods=['GET'])
 def get_weight():
     """
     Retrieves weight records based on time range and direction filters.
     
+    Records are ordered by (datetime, id). Large ranges can be read page by
+    page with limit/cursor, or in one streamed response with stream=true.
+
     Query Parameters:
     - t1 (str): Start time in YYYYMMDDHHMMSS format (default: start of today)
     - t2 (str): End time in YYYYMMDDHHMMSS format (default: current time)
     - filter (str): Comma-separated list of directions (in,out,none)
+    - limit (int): Maximum records to return (1 to WEIGHT_PAGE_MAX). When more
+      records follow, the X-Next-Cursor response header is set.
+    - cursor (str): Value of a previous X-Next-Cursor header; returns the records after it
+    - stream (bool): Stream the records from a server-side cursor instead of building the response in memory
+      (default: true for every format but json, unless limit is given)
+    - format (str): json (default), ndjson, csv or arrow (Arrow IPC stream, when pyarrow is installed).
+      ndjson, csv and arrow records also carry the datetime, and list containers as a real array.
     
     Returns:
         JSON array of weight records containing:
@@ -81,6 +166,16 @@ def get_weight():
     from_param = data.get('t1', datetime.now().strftime('%Y%m%d000000'))
     to_param = data.get('t2', datetime.now().strftime('%Y%m%d%H%M%S'))
     filter_param = data.get('filter', 'in,out,none')
+    limit = data.get('limit')
+    cursor_param = data.get('cursor')
+    export_format = data.get('format', 'json').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format. Valid options are: {', '.join(EXPORT_FORMATS)}"}), 400
+    stream = data.get('stream')
+    if stream is None:
+        stream = export_format != 'json' and limit is None
+    else:
+        stream = str(stream).lower() == 'true'
 
     # Convert date parameters to datetime
     try:
@@ -101,38 +196,127 @@ def get_weight():
             "message": f"Invalid directions in filter: {', '.join(invalid_directions)}. Valid options are 'in', 'out', 'none'."
         }), 400
 
+    # Validate pagination parameters
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if not 1 <= limit <= WEIGHT_PAGE_MAX:
+            return jsonify({"error": f"limit must be an integer between 1 and {WEIGHT_PAGE_MAX}"}), 400
+        if stream:
+            # The next cursor is only known once the page is read, after the headers were sent
+            return jsonify({"error": "stream cannot be combined with limit"}), 400
+    after = None
+    if cursor_param:
+        try:
+            after = decode_weight_cursor(cursor_param)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
     # Prepare filters for SQL IN clause
     placeholders = ', '.join(['%s'] * len(filter_values))
+    query = SQL_WEIGHT_RANGE.format(placeholders=placeholders,
+                                    after=SQL_WEIGHT_AFTER if after else '',
+                                    limit=SQL_WEIGHT_LIMIT if limit else '')
+    params = [from_param, to_param, *filter_values]
+    if after:
+        params += [after[0], after[0], after[1]]
+    if limit:
+        params.append(limit + 1)  # One extra row tells whether there is a next page
 
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+
+        mimetype, render = EXPORT_FORMATS[export_format]
+        if stream:
+            response = Response(render(fetch_batches(cursor)), mimetype=mimetype)
+            # The connection is held until the whole body is sent (or the client goes away)
+            response.call_on_close(lambda c=conn, cur=cursor: _close_stream(c, cur))
+            conn = cursor = None
+            return response, 201
 
-        query = f"""
-            SELECT * FROM transactions 
-            WHERE datetime BETWEEN %s AND %s 
-            AND direction IN ({placeholders})
-        """
-        cursor.execute(query, (from_param, to_param, *filter_values))
         results = cursor.fetchall()
+        next_cursor = None
+        if limit and len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_weight_cursor(results[-1])
+
+        chunks = list(render([results]))
+        body = b''.join(chunks) if chunks and isinstance(chunks[0], bytes) else ''.join(chunks)
+        response = Response(body, mimetype=mimetype)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 201
 
-        # Format results according to API specification
-        formatted_results = []
-        for row in results:
-            formatted_results.append({
-                "id": row["id"],
-                "direction": row["direction"],
-                "bruto": row["bruto"],  # in kg
-                "neto": row["neto"] if row["neto"] is not None else "na",
-                "produce": row["produce"],
-                "containers": f"[{','.join(row['containers'].split(','))}]" if row["containers"] else "[]"
-            })
-
-        response_json = json.dumps(formatted_results, separators=(',', ':'))
-        return Response(response_json, mimetype='application/json'), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def _close_stream(conn, cursor):
+    """Releases the connection of a streamed response, discarding rows the client did not read."""
+    try:
+        if conn.unread_result:
+            conn.consume_results()
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.route('/weight/summary', methods=['GET'])
+def get_weight_summary():
+    """
+    Aggregates weighings per day from the daily rollups, without scanning transactions.
 
+    Query Parameters:
+    - t1 (str): First day, YYYYMMDD or YYYYMMDDHHMMSS (default: today)
+    - t2 (str): Last day, included, same format (default: today)
+    - filter (str): Comma-separated list of directions (in,out,none)
+    - group (str): Comma-separated columns to group by: day, direction, produce, truck
+      (default: day,produce,direction)
+
+    Returns:
+        JSON array, one object per group, with the group columns and:
+        - transactions: Number of weighings
+        - bruto, truckTara, neto: Sums in kg
+        - netoUnknown: Weighings whose neto is "na" (not included in neto)
+    """
+    today = datetime.now().strftime('%Y%m%d')
+    from_param = request.args.get('t1', today)
+    to_param = request.args.get('t2', today)
+    filter_values = request.args.get('filter', 'in,out,none').split(',')
+    group_by = request.args.get('group', 'day,produce,direction').split(',')
+
+    try:
+        from_day = datetime.strptime(from_param[:8], '%Y%m%d').date()
+        to_day = datetime.strptime(to_param[:8], '%Y%m%d').date()
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYYMMDD or YYYYMMDDHHMMSS."}), 400
+
+    invalid_directions = [f for f in filter_values if f not in ('in', 'out', 'none')]
+    if invalid_directions:
+        return jsonify({
+            "status": "Failure",
+            "message": f"Invalid directions in filter: {', '.join(invalid_directions)}. Valid options are 'in', 'out', 'none'."
+        }), 400
+
+    invalid_groups = [g for g in group_by if g not in SUMMARY_GROUPS]
+    if invalid_groups or len(set(group_by)) != len(group_by):
+        return jsonify({"error": f"Invalid group. Valid options are: {', '.join(SUMMARY_GROUPS)}"}), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        return jsonify(summarize(cursor, from_day, to_day, filter_values, group_by)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
@@ -161,6 +345,37 @@ def check_mysql():
         if conn:
             conn.close()
 
+@app.route('/health/pool', methods=['GET'])
+def get_pool_stats():
+    """
+    Reports database connection pool metrics.
+
+    Returns:
+        JSON object with pool size, connections in use, checkout count,
+        exhausted checkouts and checkout wait times (seconds).
+    """
+    return jsonify(pool_stats()), 200
+
+@app.route('/health/cache', methods=['GET'])
+def get_cache_stats():
+    """
+    Reports container weight cache metrics.
+
+    Returns:
+        JSON object with cache size, capacity, hits, misses and evictions.
+    """
+    return jsonify(container_cache.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Reports request latencies and database query timings (see metrics.py).
+
+    Returns:
+        Prometheus text exposition format (version 0.0.4).
+    """
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/weight', methods=['POST'])
 def weight_post():
     """
@@ -266,51 +481,49 @@ def weight_post():
         }), 400
 
     # Helper functions
-    def cont_weight(containers, lb_to_kg):
+    def cont_weight(containers, generation):
         """
-        Calculate total weight of containers.
+        Calculate total weight of containers in kg, or None if any container is unknown.
+        `generation` is the container registration generation read in this transaction
+        (None bypasses the cache).
         """
-        containers_weight = []
-        sql_select = 'SELECT weight, unit FROM containers_registered WHERE container_id = %s'
-        for cont in containers:
-            cursor.execute(sql_select, (cont,))
-            result = cursor.fetchone()
-            if result:
-                container_weight, unit = result
-                if unit.lower() == 'lbs':
-                    containers_weight.append(round(container_weight * lb_to_kg))
-                elif unit.lower() == 'kg':
-                    containers_weight.append(container_weight)
-            else:
-                return 0
-        return containers_weight
+        weights, unknown = resolve_container_weights(cursor, containers, use_cache=generation is not None,
+                                                     generation=generation)
+        if unknown:
+            return None
+        return sum(weights[cont] for cont in containers)
 
     def neto_weight(bruto, truckTara, containers_weight):
         """
-        Calculate net weight.
+        Calculate net weight ("na" is stored as NULL when a container weight is unknown).
         """
-        if containers_weight and isinstance(containers_weight, list):
-            return int(bruto) - int(truckTara) - sum(containers_weight)
-        elif containers_weight and isinstance(containers_weight, int):
-            return int(bruto) - int(truckTara) - containers_weight
-        return None
-
+        if containers_weight is None:
+            return None
+        return int(bruto) - int(truckTara) - containers_weight
+
+    # Every check-then-write sequence runs under a per-truck lock (one shared lock for
+    # standalone weighings) and inside a single transaction, so concurrent gates cannot
+    # interleave and a failure leaves nothing half-written.
+    lock_name = f"weight:{truck}" if direction in ('in', 'out') else "weight:none"
+    rollup = RollupDelta()  # Daily rollup changes, written in the same transaction
+    conn = None
+    cursor = None
+    locked = False
     try:
-        conn = None
-        cursor = None
         conn = get_db_connection()
         cursor = conn.cursor()
 
+        locked = get_named_lock(cursor, lock_name)
+        if not locked:
+            return jsonify({
+                "status": "Failure",
+                "message": "Another weighing for this truck is in progress, try again."
+            }), 503
+        conn.commit()  # Start a fresh transaction that sees everything committed before the lock
+
         if direction == 'in':
             # Handle incoming truck
-            sql_check = '''
-                SELECT id, direction 
-                FROM transactions 
-                WHERE truck = %s 
-                ORDER BY datetime DESC 
-                LIMIT 1
-            '''
-            cursor.execute(sql_check, (truck,))
+            cursor.execute(SQL_LAST_TRUCK_RECORD, (truck,))
             last_record = cursor.fetchone()
 
             if last_record and last_record[1] == 'in' and not force:
@@ -319,31 +532,27 @@ def weight_post():
                     "message": f"Conflict: Last record for this truck (ID: {last_record[0]}) is already 'in'. Use force=true to overwrite."
                 }), 409
             elif last_record and last_record[1] == 'in' and force:
+                rollup.remove_ids(cursor, [last_record[0]])
                 sql_delete = 'DELETE FROM transactions WHERE id = %s'
                 cursor.execute(sql_delete, (last_record[0],))
-                conn.commit()
+                delete_transaction_containers(cursor, last_record[0])
 
             bruto = weight
+            now = datetime.now()
             sql = "INSERT INTO transactions (datetime, direction, truck, containers, bruto, produce) VALUES (%s, %s, %s, %s, %s, %s)"
-            values = (datetime.now(), direction, truck, ','.join(containers), bruto, produce)
+            values = (now, direction, truck, ','.join(containers), bruto, produce)
             cursor.execute(sql, values)
+            session_id = cursor.lastrowid
+            record_transaction_containers(cursor, session_id, containers)
+            rollup.add((now, direction, produce, truck, bruto, None, None))
+            rollup.apply(cursor)
             conn.commit()
 
-            sql_select = 'SELECT id FROM transactions WHERE truck = %s ORDER BY datetime DESC LIMIT 1'
-            cursor.execute(sql_select, (truck,))
-            session_id = cursor.fetchone()[0]
             result = {"id": session_id, "truck": truck, "bruto": bruto}
 
         elif direction == 'out':
             # Handle outgoing truck
-            sql_check = '''
-                SELECT id, containers, bruto, produce, direction 
-                FROM transactions 
-                WHERE truck = %s 
-                ORDER BY datetime DESC 
-                LIMIT 1
-            '''
-            cursor.execute(sql_check, (truck,))
+            cursor.execute(SQL_LAST_TRUCK_SESSION, (truck,))
             last_record = cursor.fetchone()
 
             if not last_record:
@@ -352,9 +561,30 @@ def weight_post():
                     "message": "No 'in' transaction found for this truck."
                 }), 400
 
-            session_id, containers_in, bruto, produce, last_direction = last_record
+            if last_record[4] == 'out' and not force:
+                return jsonify({
+                    "status": "Failure",
+                    "message": "Conflict: Last record is already 'out'. Use force=true to overwrite."
+                }), 409
+            elif last_record[4] == 'out' and force:
+                # Replace the previous 'out' and close the 'in' session before it again
+                rollup.remove_ids(cursor, [last_record[0]])
+                sql_delete = 'DELETE FROM transactions WHERE id = %s'
+                cursor.execute(sql_delete, (last_record[0],))
+                delete_transaction_containers(cursor, last_record[0])
+                cursor.execute(SQL_LAST_TRUCK_SESSION, (truck,))
+                last_record = cursor.fetchone()
+                if not last_record or last_record[4] != 'in':
+                    conn.rollback()
+                    return jsonify({
+                        "status": "Failure",
+                        "message": "No 'in' transaction found for this truck."
+                    }), 400
+
+            session_id, containers_in, bruto, produce, last_direction, generation = last_record
 
             if containers and ','.join(containers) != containers_in:
+                conn.rollback()
                 return jsonify({
                     "status": "Failure",
                     "message": "Containers mismatch: manual check required."
@@ -362,30 +592,25 @@ def weight_post():
             elif not containers:
                 containers = containers_in.split(',')
 
-            if last_direction == 'out' and not force:
-                return jsonify({
-                    "status": "Failure",
-                    "message": "Conflict: Last record is already 'out'. Use force=true to overwrite."
-                }), 409
-            elif last_direction == 'out' and force:
-                sql_delete = 'DELETE FROM transactions WHERE id = %s'
-                cursor.execute(sql_delete, (session_id,))
-                conn.commit()
-
             truckTara = weight
-            containers_weight = cont_weight(containers, lb_to_kg)
+            containers_weight = cont_weight(containers, generation)
             neto = neto_weight(bruto, truckTara, containers_weight)
 
+            rollup.remove_ids(cursor, [session_id])
             sql_update = 'UPDATE transactions SET truckTara = %s, neto = %s WHERE id = %s'
             cursor.execute(sql_update, (truckTara, neto, session_id))
-            conn.commit()
+            rollup.add_ids(cursor, [session_id])
 
             sql_insert = '''
-                INSERT INTO transactions (datetime, direction, truck, containers, bruto, truckTara, neto, produce)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO transactions (datetime, direction, truck, containers, bruto, truckTara, neto, produce, session_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             '''
+            now = datetime.now()
             cursor.execute(sql_insert,
-                           (datetime.now(), direction, truck, ','.join(containers), bruto, truckTara, neto, produce))
+                           (now, direction, truck, ','.join(containers), bruto, truckTara, neto, produce, session_id))
+            record_transaction_containers(cursor, cursor.lastrowid, containers)
+            rollup.add((now, direction, produce, truck, bruto, truckTara, neto))
+            rollup.apply(cursor)
             conn.commit()
 
             result = {
@@ -398,13 +623,7 @@ def weight_post():
 
         elif direction == 'none':
             # Handle standalone container weighing
-            sql_check = '''
-                SELECT direction 
-                FROM transactions 
-                ORDER BY datetime DESC 
-                LIMIT 1
-            '''
-            cursor.execute(sql_check)
+            cursor.execute(SQL_LAST_RECORD)
             last_record = cursor.fetchone()
 
             if last_record and last_record[0] == 'in':
@@ -415,11 +634,7 @@ def weight_post():
 
             bruto = weight
             truckTara = 0
-            containers_weight = cont_weight(containers, lb_to_kg)
-            if not containers_weight:
-                containers_weight = None
-            else:
-                containers_weight = sum(containers_weight)
+            containers_weight = cont_weight(containers, last_record[1] if last_record else None)
             neto = neto_weight(bruto, truckTara, containers_weight)
 
             sql = """
@@ -427,13 +642,15 @@ def weight_post():
                 (datetime, direction, truck, containers, bruto, truckTara, neto, produce) 
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
-            values = (datetime.now(), direction, None, ','.join(containers), bruto, None, neto, produce)
+            now = datetime.now()
+            values = (now, direction, None, ','.join(containers), bruto, None, neto, produce)
             cursor.execute(sql, values)
+            session_id = cursor.lastrowid
+            record_transaction_containers(cursor, session_id, containers)
+            rollup.add((now, direction, produce, None, bruto, None, neto))
+            rollup.apply(cursor)
             conn.commit()
 
-            sql_select = 'SELECT id FROM transactions ORDER BY datetime DESC LIMIT 1'
-            cursor.execute(sql_select)
-            session_id = cursor.fetchone()[0]
             result = {"id": session_id, "container": ','.join(containers), "bruto": bruto,
                       "containerTara": containers_weight, "neto": neto}
 
@@ -444,161 +661,142 @@ def weight_post():
         return jsonify({"status": "Failure", "message": str(e)}), 500
     finally:
         if conn:
-            conn.close()
+            try:
+                conn.rollback()  # No-op after a commit; discards anything left half-written
+                if locked:
+                    release_named_lock(cursor, lock_name)
+            except Exception:
+                pass  # The pool resets the session (and its locks) when the connection is returned
         if cursor:
             cursor.close()
+        if conn:
+            conn.close()
 
 
 @app.route('/batch-weight', methods=['POST'])
 def weight_batch_post():
+    """
+    Registers container weights from a CSV or JSON file.
+
+    The file is either uploaded as multipart form data (field 'file') or named
+    with ?file= and read from the 'in' folder. It is streamed row by row into
+    fixed-size batches, and all containers are upserted in one database
+    transaction using multi-row INSERTs, so a failing file leaves nothing
+    half-applied. Malformed rows are reported with their line number.
+
+    Query Parameters:
+    - file (str): File name inside the 'in' folder (.csv or .json), when not uploading
+    - chunk_size (int): Rows per INSERT statement (default: BATCH_CHUNK_SIZE)
+    - async (str): 'true' to process the file in the background and return a job id
+
+    Returns:
+        JSON object with stats:
+        - parsed: Rows read from the file
+        - inserted: Newly registered containers
+        - updated: Already registered containers whose weight was replaced
+        - neto_backfilled: Waiting transactions whose neto could now be computed
+        - elapsed_seconds: Processing time
+        On malformed rows, 400 with "errors": [{"line": <int>, "error": <str>}, ...]
+        In async mode, 202 with "job_id" and "status_url" (see /batch-weight/jobs/<id>)
+    """
     # Allowed file extensions
     ALLOWED_EXTENSIONS = {'csv', 'json'}
     def allowed_file(filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-    def process_csv(csv_file):
-        """Process CSV file and extract container weight"""
-        containers = []
-        containers_check = []
-        with open(csv_file, 'r') as file:
-            reader = list(csv.reader(file))
-            headers = reader[0]
-        
-        is_unit = False
-        
-        for unit in headers: # checks if there is 'unit' in file
-            if unit.lower() in ['lbs', 'kg']:
-                unit = unit.lower()
-                is_unit = True
-        if not is_unit:
-            raise Exception("Invalid CSV format or data")
-        
-        try:
-            for row in reader[1:]:
-                container_id = row[0].capitalize()
-                containers_check.append(container_id)
-                weight = row[1]
-                containers.append({"id": container_id, "weight": int(weight), "unit": unit})
-        except Exception:
-            raise Exception("Invalid CSV format or data")
-        return containers, containers_check
-
-    def process_json(json_file):
-        """Process JSON file and extract container weight"""
-        try:
-            with open(json_file, 'r') as json_file:
-                data = json.load(json_file)
-                containers = []
-                containers_check = []
-                for item in data:
-                    weight = item["weight"]
-                    unit = item['unit'].lower()
-                    container_id = item['id'].capitalize()
-                    if unit not in ['kg', 'lbs']:
-                         raise Exception("Invalid JSON format or data")
-                    containers.append({"id": container_id, "weight": int(weight), "unit": unit})
-                    containers_check.append(container_id)
-                return containers, containers_check
-        except Exception as e:
-            raise Exception("Invalid JSON format or data")
-
-    # Process the file based on its extension
     BASE_DIR = os.path.dirname(os.path.abspath(__file__)) # Get the absolute path of the current script
-    file_name = request.args.get('file')
-    file = f"{BASE_DIR}/in/{file_name}"
-    
-    if 'file' not in request.args:
+    uploaded = request.files.get('file')
+
+    if uploaded is None and 'file' not in request.args:
         return jsonify({"error": "No file part in the request"}), 400
 
+    file_name = uploaded.filename if uploaded is not None else request.args.get('file')
+
     if file_name == '': # checks if the uploaded file has a name (i.e., the user actually selected a file to upload)
         return jsonify({"error": "No file selected for uploading"}), 400
 
     if not allowed_file(file_name): # checks if the uploaded file is allowed
         return jsonify({"error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
 
-    conn = None
-    cursor = None
+    try:
+        chunk_size = int(request.args.get('chunk_size', BATCH_CHUNK_SIZE))
+        if chunk_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "chunk_size must be a positive integer"}), 400
+
+    async_mode = request.args.get('async', 'false').lower() == 'true'
+
+    if uploaded is not None:
+        # Uploads are copied to disk in chunks under a unique name, and removed once processed
+        upload_dir = os.path.join(BASE_DIR, 'in', 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        file = os.path.join(upload_dir, f"{uuid.uuid4()}.{file_name.rsplit('.', 1)[1].lower()}")
+        uploaded.save(file)
+    else:
+        file = f"{BASE_DIR}/in/{file_name}"
+        if not os.path.isfile(file):
+            return jsonify({"error": f"File '{file_name}' not found"}), 400
 
     try:
-        if file_name.endswith('.csv'):
-            containers, containers_check = process_csv(file)
-        elif file_name.endswith('.json'):
-            containers, containers_check = process_json(file)
-        else:
-            return jsonify({"error": "Unsupported file format."}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        if async_mode:
+            try:
+                job_id = submit_job(file, file_name, chunk_size, remove_after=uploaded is not None)
+            except Exception:
+                if uploaded is not None:
+                    os.remove(file)
+                raise
+            return jsonify({
+                "message": "File queued for processing",
+                "job_id": job_id,
+                "status_url": f"/batch-weight/jobs/{job_id}"
+            }), 202
 
-        # Writing data into database
-        for cont in containers:
-            sql = "INSERT INTO containers_registered (container_id, weight, unit) VALUES (%s, %s, %s)"
-            values = (cont["id"], cont["weight"], cont["unit"])
-            cursor.execute(sql, values)
-            conn.commit()
-        
-        # Fetching containers data from 'transactions' db to check for 'neto' nulls due to lack of container info
-        sql_select = """SELECT containers, bruto, truckTara
-                        FROM transactions 
-                        WHERE neto IS NULL 
-                        AND direction IN ('out', 'none')"""
-        
-        cursor.execute(sql_select)
-        fetched_transactions = cursor.fetchall()
-
-        for transaction in fetched_transactions:
-            containers_str, bruto, truckTara = transaction
-            container_ids = containers_str.split(",")  # Splitting string into containers list
-            total_weight = 0
-
-            for container_id in container_ids:
-                if container_id in containers_check:
-                    # Getting container's weight from 'containers_registered'
-                    sql_select = """
-                        SELECT weight, unit
-                        FROM containers_registered 
-                        WHERE container_id = %s
-                    """
-                    cursor.execute(sql_select, (container_id,))
-                    fetched_data = cursor.fetchall()
-                    if fetched_data:
-                        weight, unit = fetched_data[0]
-                        if unit == "lbs":
-                            lb_to_kg = 0.454  # Converting into kg
-                            weight = round(weight * lb_to_kg)
-                        total_weight += weight
-
-                    # Counting 'neto' for 'transactions'
-                    if total_weight > 0:
-                        if truckTara:
-                            neto = bruto - truckTara - total_weight
-                        else:
-                            neto = bruto - total_weight
-
-                        # Updating 'transactions'
-                        sql_update = """
-                            UPDATE transactions 
-                            SET neto = %s 
-                            WHERE containers = %s
-                        """
-                        cursor.execute(sql_update, (neto, containers_str))
-                        conn.commit()
-
-        return jsonify({"message": "File processed successfully", "data": containers}), 200
+        try:
+            result = process_container_file(file, chunk_size)
+        finally:
+            if uploaded is not None:
+                os.remove(file)
+
+        if "errors" in result:
+            return jsonify({
+                "error": f"Invalid {file_name.rsplit('.', 1)[1].upper()} format or data",
+                "errors": result["errors"]
+            }), 400
+        return jsonify({"message": "File processed successfully", "stats": result["stats"]}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        # Ensure database connections are properly closed
-        if conn:
-            conn.close()
-        if cursor:
-            cursor.close()
+
+@app.route('/batch-weight/jobs/<job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """
+    Reports the status of a background /batch-weight job.
+
+    Returns:
+        JSON object containing:
+        - id, file: Job id and file name
+        - status: queued / running / done / failed
+        - rows_parsed: Rows read so far
+        - elapsed_seconds, rows_per_second: Processing time and throughput
+        - created_at, started_at, finished_at: YYYYMMDDHHMMSS timestamps
+        - result: Final stats, row errors or error message, once finished
+    """
+    try:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/unknown', methods=['GET'])
 def get_unknown_containers():
     """
     Returns a list of all recorded containers that have unknown weight
+
+    Reads the materialized `unknown_containers` set, which weighings and
+    container registrations keep up to date.
     
     Returns:
         List of container IDs: ["id1","id2",...]
@@ -609,41 +807,9 @@ def get_unknown_containers():
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        # Get all unique containers from transactions
-        cursor.execute("""
-            SELECT DISTINCT 
-                TRIM(SUBSTRING_INDEX(SUBSTRING_INDEX(t.containers, ',', numbers.n), ',', -1)) as container_id
-            FROM transactions t
-            CROSS JOIN (
-                SELECT 1 + numbers.n AS n
-                FROM (
-                    SELECT 0 AS n UNION ALL
-                    SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL
-                    SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL
-                    SELECT 9
-                ) numbers
-            ) numbers
-            WHERE numbers.n <= LENGTH(t.containers) - LENGTH(REPLACE(t.containers, ',', '')) + 1
-            AND t.containers IS NOT NULL 
-            AND t.containers != ''
-            HAVING container_id != ''
-        """)
-        transaction_containers = cursor.fetchall()
-        
-        # Get all known containers
-        cursor.execute("SELECT container_id FROM containers_registered")
-        registered_containers = cursor.fetchall()
-        
-        # Create sets for comparison
-        transaction_set = {row['container_id'] for row in transaction_containers}
-        registered_set = {row['container_id'] for row in registered_containers}
-        
-        # Find unknown containers (in transactions but not registered)
-        unknown_containers = sorted(list(transaction_set - registered_set))
-        print("testing reload")
-        #print("HI")
-        #to see changes ,docker-compose logs flask_app
-        
+        cursor.execute("SELECT container_id FROM unknown_containers ORDER BY container_id")
+        unknown_containers = [row['container_id'] for row in cursor.fetchall()]
+
         # Format response as plain text
         response = '[' + ','.join(f'"{x}"' for x in unknown_containers) + ']'
         return Response(response, mimetype='text/plain'), 200
@@ -656,91 +822,103 @@ def get_unknown_containers():
         if conn:
             conn.close()
             
+def parse_period(data, default_from, default_to):
+    """
+    Reads the from/to parameters of /item and /items.
+
+    Returns:
+        tuple: (from datetime, to datetime)
+
+    Raises:
+        ValueError: If a date is not in YYYYMMDDHHMMSS format.
+    """
+    from_param = data.get('from') or default_from
+    to_param = data.get('to') or default_to
+    return datetime.strptime(from_param, '%Y%m%d%H%M%S'), datetime.strptime(to_param, '%Y%m%d%H%M%S')
+
+def parse_bulk_ids(data):
+    """Returns the "ids" list of a bulk request, or an error message."""
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return None, "Body must contain a non-empty 'ids' list"
+    if len(ids) > BULK_MAX_IDS:
+        return None, f"At most {BULK_MAX_IDS} ids per request"
+    if not all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in ids):
+        return None, "ids must be strings or integers"
+    return ids, None
+
 @app.route('/item/<id>', methods=['GET'])
 def get_item_details(id):
-    # Parse query parameters
-    from_param = request.args.get('from', datetime.now().replace(day=1).strftime('%Y%m%d000000'))
-    to_param = request.args.get('to', datetime.now().strftime('%Y%m%d%H%M%S'))
+    """
+    Fetch the tara and sessions of a truck or container.
+
+    Query Parameters:
+    - from (str): Start time in YYYYMMDDHHMMSS format (default: first of the month)
+    - to (str): End time in YYYYMMDDHHMMSS format (default: now)
+
+    Returns:
+        JSON object with the item id, its tara ("na" if unknown) and the ids of its sessions.
+    """
+    try:
+        from_datetime, to_datetime = parse_period(request.args,
+                                                  datetime.now().replace(day=1).strftime('%Y%m%d000000'),
+                                                  datetime.now().strftime('%Y%m%d%H%M%S'))
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYYMMDDHHMMSS."}), 400
 
     conn = None
     cursor = None
     try:
-        # Convert date parameters to datetime
-        try:
-            from_datetime = datetime.strptime(from_param, '%Y%m%d%H%M%S')
-            to_datetime = datetime.strptime(to_param, '%Y%m%d%H%M%S')
-        except ValueError:
-            return jsonify({"error": "Invalid date format. Use YYYYMMDDHHMMSS."}), 400
-
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor()
+        item = resolve_items(cursor, [id], from_datetime, to_datetime).get(id)
+        if item is None:
+            return jsonify({"error": "Item not found"}), 404
 
-        # Check if item exists as truck
-        cursor.execute("SELECT COUNT(*) as truck_count FROM transactions WHERE truck = %s", (id,))
-        truck_exists = cursor.fetchone()['truck_count'] > 0
+        response_json = json.dumps(item, separators=(',', ':'))
+        return Response(response_json, mimetype='application/json')
 
-        # Check if item exists as container
-        cursor.execute("SELECT COUNT(*) as container_count FROM transactions WHERE FIND_IN_SET(%s, containers) > 0", (id,))
-        container_exists = cursor.fetchone()['container_count'] > 0
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
 
-        if not (truck_exists or container_exists):
-            return jsonify({"error": "Item not found"}), 404
+@app.route('/items', methods=['POST'])
+def post_items():
+    """
+    Bulk version of GET /item/<id>.
 
-        # Fetch sessions for the item
-        if truck_exists:
-            # For trucks, fetch transaction sessions with 'in' direction
-            cursor.execute("""
-                SELECT id FROM transactions 
-                WHERE truck = %s 
-                AND datetime BETWEEN %s AND %s
-                AND direction = 'in'
-                ORDER BY datetime
-            """, (id, from_datetime, to_datetime))
-            sessions = [row['id'] for row in cursor.fetchall()]
-
-            # Get last known tara (truck empty weight)
-            cursor.execute("""
-                SELECT truckTara FROM transactions 
-                WHERE truck = %s AND truckTara IS NOT NULL
-                ORDER BY datetime DESC
-                LIMIT 1
-            """, (id,))
-            last_tara = cursor.fetchone()
-            tara = last_tara['truckTara'] if last_tara else "na"
-
-        else:  # container
-            # For containers, fetch transaction sessions with 'none' or 'in' direction
-            cursor.execute("""
-                SELECT id FROM transactions 
-                WHERE FIND_IN_SET(%s, containers) > 0
-                AND datetime BETWEEN %s AND %s
-                AND direction IN ('none', 'in')
-                ORDER BY datetime
-            """, (id, from_datetime, to_datetime))
-            sessions = [row['id'] for row in cursor.fetchall()]
-
-            # For containers, tara is the container's registered weight
-            cursor.execute("""
-                SELECT weight, unit FROM containers_registered 
-                WHERE container_id = %s
-            """, (id,))
-            container_weight = cursor.fetchone()
-
-            if container_weight:
-                # Convert to kg if in lbs
-                tara = round(container_weight['weight'] * 0.454) if container_weight['unit'] == 'lbs' else container_weight['weight']
-            else:
-                tara = "na"
-
-        # Prepare response
-        response = {
-            "id": id,
-            "tara": tara,
-            "sessions": sessions
-        }
-
-        response_json = json.dumps(response, separators=(',', ':'))
-        return Response(response_json, mimetype='application/json')
+    JSON Body:
+    - ids (list): Truck or container ids
+    - from (str): Start time in YYYYMMDDHHMMSS format (default: first of the month)
+    - to (str): End time in YYYYMMDDHHMMSS format (default: now)
+
+    Returns:
+        JSON object mapping every requested id to its /item response, or null if not found.
+    """
+    data = request.get_json(silent=True) or {}
+    data = {**data, **request.args}
+    ids, error = parse_bulk_ids(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        from_datetime, to_datetime = parse_period(data,
+                                                  datetime.now().replace(day=1).strftime('%Y%m%d000000'),
+                                                  datetime.now().strftime('%Y%m%d%H%M%S'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid date format. Use YYYYMMDDHHMMSS."}), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        items = resolve_items(cursor, [str(i) for i in ids], from_datetime, to_datetime)
+        response_json = json.dumps({str(i): items.get(str(i)) for i in ids}, separators=(',', ':'))
+        return Response(response_json, mimetype='application/json'), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -764,6 +942,8 @@ def get_session_details(id):
         - id: Transaction ID
         - truck: Truck ID or "na"
         - bruto: Gross weight
+        - produce: Type of produce
+        - datetime: When the session started (YYYYMMDDHHMMSS)
         - truckTara (if 'out'): Truck empty weight
         - neto (if 'out'): Net weight or "na" if containers are unknown
         For 'none':
@@ -772,80 +952,73 @@ def get_session_details(id):
         - bruto: Gross weight
         - containerTara: Container weight in kg
         - neto: Net weight or "na"
+        - produce: Type of produce
+        - datetime: When the weighing took place (YYYYMMDDHHMMSS)
     """
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Fetch the transaction details
-        cursor.execute("SELECT * FROM transactions WHERE id = %s", (id,))
-        transaction = cursor.fetchone()
+        cursor = conn.cursor()
+        sessions = resolve_sessions(cursor, [id])
 
-        if not transaction:
+        if not sessions:
             return jsonify({"error": "Session not found"}), 404
+        session_details = next(iter(sessions.values()))
+        if session_details is None:
+            return jsonify({"error": "Unsupported direction for this session"}), 400
 
-        # Check the direction and handle accordingly
-        if transaction["direction"] == "in":
-            # Handle 'in' direction
-            session_details = {
-                "id": transaction["id"],
-                "truck": transaction["truck"] if transaction["truck"] else "na",
-                "bruto": transaction["bruto"]
-            }
+        response_json = json.dumps(session_details, separators=(',', ':'))
+        return Response(response_json, mimetype='application/json')
 
-            # Fetch the corresponding 'out' transaction for the same truck after the 'in' transaction
-            cursor.execute("""
-                SELECT * FROM transactions 
-                WHERE truck = %s AND direction = 'out' AND datetime > %s
-                ORDER BY datetime ASC
-                LIMIT 1
-            """, (transaction["truck"], transaction["datetime"]))
-
-            out_transaction = cursor.fetchone()
-
-            if out_transaction:
-                session_details["truckTara"] = out_transaction["truckTara"]
-                session_details["neto"] = out_transaction["neto"] if out_transaction["neto"] is not None else "na"
-
-            response_json = json.dumps(session_details, separators=(',', ':'))
-            return Response(response_json, mimetype='application/json')
-
-        elif transaction["direction"] == "none":
-            # Handle 'none' direction
-            containers = transaction["containers"].split(",") if transaction["containers"] else []
-            container_id = containers[0] if containers else "na"
-
-            # Fetch container details from containers_registered
-            if container_id != "na":
-                cursor.execute("""
-                    SELECT weight, unit FROM containers_registered WHERE container_id = %s
-                """, (container_id,))
-                container_details = cursor.fetchone()
-
-                if container_details:
-                    weight = container_details["weight"]
-                    unit = container_details["unit"]
-                    container_tara = round(weight * 0.454) if unit == "lbs" else weight
-                else:
-                    container_tara = "na"
-            else:
-                container_tara = "na"
-
-            session_details = {
-                "id": transaction["id"],
-                "container": container_id,
-                "bruto": transaction["bruto"],
-                "containerTara": container_tara,
-                "neto": transaction["neto"] if transaction["neto"] is not None else "na"
-            }
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
 
-            response_json = json.dumps(session_details, separators=(',', ':'))
-            return Response(response_json, mimetype='application/json')
+@app.route('/sessions', methods=['POST'])
+def post_sessions():
+    """
+    Bulk version of GET /session/<id>.
 
-        else:
-            return jsonify({"error": "Unsupported direction for this session"}), 400
+    JSON Body:
+    - ids (list): Session (transaction) ids
+    - from (str), to (str): Only sessions started in this period, YYYYMMDDHHMMSS (optional, both or neither)
+
+    Returns:
+        JSON object mapping every requested id to its /session response, or null
+        if it is not a session (or outside the period).
+    """
+    data = request.get_json(silent=True) or {}
+    data = {**data, **request.args}
+    ids, error = parse_bulk_ids(data)
+    if error:
+        return jsonify({"error": error}), 400
+    from_datetime = to_datetime = None
+    if data.get('from') or data.get('to'):
+        try:
+            from_datetime, to_datetime = parse_period(data, None, None)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid date format. Use YYYYMMDDHHMMSS, and give both from and to."}), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        sessions = resolve_sessions(cursor, ids, from_datetime, to_datetime)
+
+        def lookup(session_id):
+            try:
+                return sessions.get(int(session_id))
+            except ValueError:
+                return None
+
+        response_json = json.dumps({str(i): lookup(i) for i in ids}, separators=(',', ':'))
+        return Response(response_json, mimetype='application/json'), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -855,15 +1028,88 @@ def get_session_details(id):
         if conn:
             conn.close()
 
+
+@app.cli.command('backfill-containers')
+@click.option('--batch-size', default=1000, show_default=True, help='Transactions processed per batch.')
+def backfill_containers_command(batch_size):
+    """Creates and fills transaction_containers from existing transactions."""
+    conn = get_db_connection()
+    try:
+        scanned, linked = backfill_transaction_containers(conn, batch_size=batch_size, progress=click.echo)
+        click.echo(f"Done: {scanned} transactions scanned, {linked} container links written")
+    finally:
+        conn.close()
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Applies pending schema migrations (see migrations.py)."""
+    conn = get_db_connection()
+    try:
+        applied = migrate(conn, progress=click.echo)
+        if applied:
+            click.echo(f"Applied migrations: {', '.join(map(str, applied))}")
+    finally:
+        conn.close()
+
+@app.cli.command('backfill-neto')
+@click.option('--batch-size', default=1000, show_default=True, help='Pending transactions processed per batch.')
+def backfill_neto_command(batch_size):
+    """Recomputes neto for all transactions still waiting for container weights."""
+    conn = get_db_connection()
+    try:
+        result = backfill_neto_history(conn, batch_size=batch_size, progress=click.echo)
+        click.echo(f"Done: {result['candidates']} pending transactions examined, {result['updated']} updated")
+    finally:
+        conn.close()
+
+@app.cli.command('rebuild-rollups')
+@click.option('--since', default=None, help='First day to rebuild (YYYYMMDD); default is the whole history.')
+def rebuild_rollups_command(since):
+    """Recomputes the daily rollups behind /weight/summary from transactions."""
+    if since:
+        try:
+            since = datetime.strptime(since, '%Y%m%d').date()
+        except ValueError:
+            raise click.BadParameter("Use YYYYMMDD", param_hint='--since')
+    conn = get_db_connection()
+    try:
+        written = rebuild_rollups(conn, since=since, progress=click.echo)
+        click.echo(f"Done: {written} rollup rows written")
+    finally:
+        conn.close()
+
+
+@app.cli.command('check-unknown')
+@click.option('--fix', is_flag=True, help='Correct the unknown container set when it differs.')
+def check_unknown_command(fix):
+    """Verifies the unknown container set behind /unknown against a full recompute."""
+    conn = get_db_connection()
+    try:
+        missing, extra = check_unknown_containers(conn, fix=fix)
+    finally:
+        conn.close()
+    if missing:
+        click.echo(f"Missing from the set ({len(missing)}): {', '.join(missing[:20])}")
+    if extra:
+        click.echo(f"Wrongly in the set ({len(extra)}): {', '.join(extra[:20])}")
+    if not missing and not extra:
+        click.echo("Unknown container set is consistent")
+    elif fix:
+        click.echo("Fixed")
+    else:
+        raise SystemExit(1)
+
             
 if __name__ == '__main__':
     """
-    Main entry point for the application.
-    Starts the Flask development server on port 5000.
+    Development entry point: starts the Flask development server on port 5000.
+    In production the app is served by gunicorn (see gunicorn.conf.py).
     
     Note:
-    - debug=True enables debug mode for development
+    - FLASK_DEBUG=1 enables the debugger and reloader
     - host='0.0.0.0' makes the server publicly available
     """
     wait_for_db()  # Wait for database before starting
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    fail_interrupted_jobs()  # Background jobs of a previous run can no longer finish
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
@@ -0,0 +1,176 @@
+from containers import split_containers, resolve_container_weights, IN_LIST_CHUNK
+from rollups import RollupDelta
+
+"""
+Neto Backfill
+-------------
+Recomputes `transactions.neto` for weighings that were recorded before all of
+their containers had a registered weight.
+
+neto = bruto - truckTara - sum(container weights), and stays NULL ("na") while
+any container of the transaction is still unknown.
+
+The engine works on sets: it finds the affected transactions through the
+indexed `transaction_containers` table, resolves every container weight it
+needs at once (containers.resolve_container_weights), and writes the results back with one CASE-keyed UPDATE per
+chunk of transactions. Daily rollups are adjusted in the same transaction.
+
+Only 'out' and 'none' rows are recomputed; an 'in' row gets the neto of the
+'out' row that closed its session (linked through `out.session_id`), exactly
+as weight_post stores it.
+"""
+
+UPDATE_CHUNK = 500  # Max transactions per batched UPDATE
+
+SQL_PENDING_FOR_CONTAINERS = """
+    SELECT DISTINCT t.id, t.containers, t.bruto, t.truckTara
+    FROM transaction_containers tc
+    JOIN transactions t ON t.id = tc.transaction_id
+    WHERE tc.container_id IN ({placeholders})
+    AND t.neto IS NULL
+    AND t.direction IN ('out', 'none')
+"""
+
+SQL_PENDING_NETO = """
+    SELECT id, containers, bruto, truckTara
+    FROM transactions
+    WHERE neto IS NULL
+    AND direction IN ('out', 'none')
+    AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+# 'in' rows of the sessions closed by the given 'out' rows
+SQL_LINKED_SESSIONS = """
+    SELECT id, session_id
+    FROM transactions
+    WHERE id IN ({placeholders})
+    AND direction = 'out'
+    AND session_id IS NOT NULL
+"""
+
+
+def _chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def compute_neto(bruto, truck_tara, containers, weights):
+    """Returns the neto weight, or None while any container weight is unknown."""
+    if not containers or any(c not in weights for c in containers):
+        return None
+    return int(bruto) - int(truck_tara or 0) - sum(weights[c] for c in containers)
+
+
+def apply_neto_updates(cursor, updates):
+    """
+    Writes neto values with one UPDATE per chunk of transactions, and the
+    matching daily rollup changes.
+
+    The 'in' row of every session closed by an updated 'out' row gets the
+    same neto.
+
+    Args:
+        cursor: Open cursor; the caller commits.
+        updates (dict): transaction id -> neto
+
+    Returns:
+        int: Transactions written, including linked 'in' rows.
+    """
+    updates = dict(updates)
+    for chunk in _chunks(list(updates), IN_LIST_CHUNK):
+        cursor.execute(SQL_LINKED_SESSIONS.format(placeholders=', '.join(['%s'] * len(chunk))), chunk)
+        for out_id, session_id in cursor.fetchall():
+            updates.setdefault(session_id, updates[out_id])
+
+    rollup = RollupDelta()
+    for chunk in _chunks(updates.items(), UPDATE_CHUNK):
+        ids = [transaction_id for transaction_id, _ in chunk]
+        cases = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+        placeholders = ', '.join(['%s'] * len(chunk))
+        params = [value for pair in chunk for value in pair] + ids
+        rollup.remove_ids(cursor, ids)
+        cursor.execute(
+            f"UPDATE transactions SET neto = CASE id {cases} END WHERE id IN ({placeholders})",
+            params
+        )
+        rollup.add_ids(cursor, ids)
+    rollup.apply(cursor)
+    return len(updates)
+
+
+def _recompute(cursor, rows):
+    """Computes neto for (id, containers, bruto, truckTara) rows; returns {id: neto} for the resolvable ones."""
+    parsed = [(transaction_id, split_containers(containers_str), bruto, truck_tara)
+              for transaction_id, containers_str, bruto, truck_tara in rows]
+    # Weights are read from the database, not the cache: the caller may be changing them right now
+    weights, _ = resolve_container_weights(cursor, (c for _, containers, _, _ in parsed for c in containers),
+                                           use_cache=False)
+    updates = {}
+    for transaction_id, containers, bruto, truck_tara in parsed:
+        neto = compute_neto(bruto, truck_tara, containers, weights)
+        if neto is not None:
+            updates[transaction_id] = neto
+    return updates
+
+
+def backfill_neto_chunk(cursor, container_ids):
+    """
+    Recomputes neto only for transactions that reference the given containers.
+
+    Used by /batch-weight after every chunk of registered containers, inside
+    the same database transaction; the caller commits.
+
+    Args:
+        cursor: Open cursor.
+        container_ids (iterable): Newly registered container IDs.
+
+    Returns:
+        dict: {"candidates": transactions examined, "updated": transactions given a neto}
+    """
+    rows = {}
+    for chunk in _chunks(dict.fromkeys(container_ids), IN_LIST_CHUNK):
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(SQL_PENDING_FOR_CONTAINERS.format(placeholders=placeholders), chunk)
+        for row in cursor.fetchall():
+            rows[row[0]] = row
+    updates = _recompute(cursor, rows.values())
+    return {"candidates": len(rows), "updated": apply_neto_updates(cursor, updates)}
+
+
+def backfill_neto_history(conn, batch_size=1000, progress=print):
+    """
+    Recomputes neto for every pending transaction in the table.
+
+    Walks pending transactions in primary-key order and commits after every
+    batch, so it can run alongside live traffic and be interrupted safely.
+
+    Args:
+        conn: Open database connection.
+        batch_size (int): Transactions per batch.
+        progress (callable): Receives a status line after every batch.
+
+    Returns:
+        dict: {"candidates": transactions examined, "updated": transactions given a neto}
+    """
+    cursor = conn.cursor()
+    try:
+        last_id = 0
+        candidates = 0
+        updated = 0
+        while True:
+            cursor.execute(SQL_PENDING_NETO, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            updated += apply_neto_updates(cursor, _recompute(cursor, rows))
+            conn.commit()
+
+            candidates += len(rows)
+            last_id = rows[-1][0]
+            progress(f"Examined {candidates} pending transactions (up to id {last_id}), {updated} updated")
+        return {"candidates": candidates, "updated": updated}
+    finally:
+        cursor.close()
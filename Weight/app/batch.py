@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from db import get_db_connection, PoolExhaustedError
+from containers import register_containers
+from backfill import backfill_neto_chunk
+from ingest import ContainerFile
+
+"""
+Batch Container Processing
+--------------------------
+Runs /batch-weight files, either inline in the request or as background jobs.
+
+Background jobs are executed by a small thread pool and their state is kept
+in the `batch_jobs` table, so GET /batch-weight/jobs/<id> answers the same
+whichever worker process receives it.
+
+A job only lives in the thread pool of the process that accepted it, which
+is recorded as its owner. When that process stops (a restarted worker, a
+restarted server), its queued and running jobs never finish:
+fail_interrupted_jobs() marks them as failed when a process starts.
+
+A running job holds two pooled connections: one for the transaction that
+registers the containers, and one that commits its progress, so that other
+workers can see it. A job waits for its status connection while the pool is
+busy, and retries BATCH_CHECKOUT_ATTEMPTS times with exponential backoff
+while the database is unreachable; a job that fails outside of its file
+processing is logged and marked as failed.
+
+Environment:
+- BATCH_WORKERS: Background jobs processed in parallel per process (default: 2)
+- BATCH_PROGRESS_INTERVAL: Minimum seconds between progress writes of a job (default: 1)
+- BATCH_CHECKOUT_ATTEMPTS: Attempts to reach the database before a job gives up (default: 5)
+- BATCH_RETRY_BACKOFF: Seconds before the first retry, doubled after every attempt (default: 1)
+- WEIGHT_SERVER_ID: Shared by the worker processes of one server, set by gunicorn.conf.py
+  (default: a new id per process)
+"""
+
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 2))
+BATCH_PROGRESS_INTERVAL = float(os.getenv('BATCH_PROGRESS_INTERVAL', 1))
+BATCH_CHECKOUT_ATTEMPTS = int(os.getenv('BATCH_CHECKOUT_ATTEMPTS', 5))
+BATCH_RETRY_BACKOFF = float(os.getenv('BATCH_RETRY_BACKOFF', 1))
+SERVER_ID = os.getenv('WEIGHT_SERVER_ID') or uuid.uuid4().hex
+
+CREATE_BATCH_JOBS = """
+    CREATE TABLE IF NOT EXISTS `batch_jobs` (
+      `id` varchar(36) NOT NULL,
+      `file` varchar(255) NOT NULL,
+      `status` varchar(10) NOT NULL,
+      `owner` varchar(64) DEFAULT NULL,
+      `rows_parsed` int(12) NOT NULL DEFAULT 0,
+      `result` text DEFAULT NULL,
+      `created_at` datetime NOT NULL,
+      `started_at` datetime(3) DEFAULT NULL,
+      `finished_at` datetime(3) DEFAULT NULL,
+      PRIMARY KEY (`id`)
+    ) ENGINE=InnoDB
+"""
+# Added after batch_jobs had shipped: "<server id>:<pid>" of the process running the job
+BATCH_JOBS_OWNER_COLUMN = {'owner': 'varchar(64) DEFAULT NULL AFTER `status`'}
+
+log = logging.getLogger('weight.batch')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def process_container_file(path, chunk_size, on_progress=None):
+    """
+    Registers the containers of a file and backfills the neto of waiting transactions.
+
+    Everything happens in one database transaction, which is rolled back if
+    the file has malformed rows.
+
+    Args:
+        path (str): CSV or JSON file.
+        chunk_size (int): Rows per INSERT statement.
+        on_progress (callable): Called with the number of rows parsed after every chunk.
+
+    Returns:
+        dict: {"stats": {...}} on success, {"errors": [...], "parsed": <int>} on malformed data
+    """
+    started = time.monotonic()
+    container_file = ContainerFile(path)
+    backfilled = 0
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        def after_chunk(container_ids):
+            # Recomputing 'neto' for transactions that were waiting for these containers
+            nonlocal backfilled
+            backfilled += backfill_neto_chunk(cursor, container_ids)["updated"]
+            if on_progress:
+                on_progress(container_file.parsed)
+
+        try:
+            inserted, updated = register_containers(cursor, container_file, chunk_size=chunk_size,
+                                                    on_chunk=after_chunk)
+            if container_file.errors:
+                conn.rollback()
+                return {"errors": container_file.errors, "parsed": container_file.parsed}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    return {"stats": {
+        "parsed": container_file.parsed,
+        "inserted": inserted,
+        "updated": updated,
+        "neto_backfilled": backfilled,
+        "elapsed_seconds": round(time.monotonic() - started, 3)
+    }}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch-job')
+    return _executor
+
+
+def _update_job(conn, job_id, **fields):
+    """Writes job fields and commits them, so every worker sees them."""
+    assignments = ', '.join(f"`{name}` = %s" for name in fields)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE batch_jobs SET {assignments} WHERE id = %s", (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def _job_connection(job_id):
+    """Checks out a job's status connection, waiting while the pool is busy and retrying database errors."""
+    failures = 0
+    while True:
+        try:
+            return get_db_connection()
+        except PoolExhaustedError:
+            continue  # The job stays queued until a connection is free
+        except Exception:
+            failures += 1
+            if failures >= BATCH_CHECKOUT_ATTEMPTS:
+                raise
+            log.warning("Batch job %s: database unavailable (attempt %d of %d), retrying",
+                        job_id, failures, BATCH_CHECKOUT_ATTEMPTS, exc_info=True)
+            time.sleep(BATCH_RETRY_BACKOFF * 2 ** (failures - 1))
+
+
+def _record_failure(job_id, error):
+    """Marks a job as failed on a fresh connection, after its own connection could not be used."""
+    try:
+        conn = get_db_connection()
+        try:
+            _update_job(conn, job_id, status='failed', result=json.dumps({"error": str(error)}),
+                        finished_at=datetime.now())
+        finally:
+            conn.close()
+    except Exception:
+        log.exception("Batch job %s: could not record its failure, it stays in its last status", job_id)
+
+
+def _run_job(job_id, path, chunk_size, remove_after):
+    try:
+        # The status connection is checked out first and kept for the whole job, so
+        # progress and the final status never wait for the pool in the middle of a job
+        conn = _job_connection(job_id)
+        try:
+            _update_job(conn, job_id, status='running', started_at=datetime.now())
+            last_write = time.monotonic()
+
+            def on_progress(parsed):
+                nonlocal last_write
+                if time.monotonic() - last_write >= BATCH_PROGRESS_INTERVAL:
+                    _update_job(conn, job_id, rows_parsed=parsed)
+                    last_write = time.monotonic()
+
+            try:
+                result = process_container_file(path, chunk_size, on_progress=on_progress)
+                status = 'failed' if 'errors' in result else 'done'
+                parsed = result['parsed'] if 'errors' in result else result['stats']['parsed']
+            except Exception as e:
+                result = {"error": str(e)}
+                status = 'failed'
+                parsed = 0
+            _update_job(conn, job_id, status=status, rows_parsed=parsed, result=json.dumps(result),
+                        finished_at=datetime.now())
+        finally:
+            conn.close()
+    except Exception as e:
+        # Nobody reads the executor's future: log the error and record it on the job
+        log.exception("Batch job %s failed", job_id)
+        _record_failure(job_id, e)
+    finally:
+        if remove_after and os.path.exists(path):
+            os.remove(path)
+
+
+def job_owner(pid=None):
+    """Returns the owner recorded for the jobs of a process of this server (default: this process)."""
+    return f"{SERVER_ID}:{pid or os.getpid()}"
+
+
+def _owner_running(owner):
+    """Tells whether the process that owns a job is still running."""
+    server_id, _, pid = (owner or '').rpartition(':')
+    if server_id != SERVER_ID or not pid.isdigit():
+        return False  # Owned by an earlier server, or by a version that did not record owners
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running, under another user
+    return True
+
+
+def fail_interrupted_jobs():
+    """
+    Marks as failed the queued and running jobs whose process has stopped.
+
+    Called when a process starts: the jobs of the process it replaces, or of
+    an earlier server, can no longer finish.
+
+    Returns:
+        int: Jobs marked as failed.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, owner FROM batch_jobs WHERE status IN ('queued', 'running')")
+        interrupted = [job_id for job_id, owner in cursor.fetchall() if not _owner_running(owner)]
+        if interrupted:
+            result = json.dumps({"error": "Interrupted: the worker process stopped before the job finished"})
+            placeholders = ', '.join(['%s'] * len(interrupted))
+            cursor.execute(f"""
+                UPDATE batch_jobs SET status = 'failed', result = %s, finished_at = %s
+                WHERE id IN ({placeholders}) AND status IN ('queued', 'running')
+            """, (result, datetime.now(), *interrupted))
+            conn.commit()
+        return len(interrupted)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def submit_job(path, file_name, chunk_size, remove_after=False):
+    """
+    Queues a file for background processing.
+
+    Args:
+        path (str): File to process.
+        file_name (str): Name reported in the job status.
+        chunk_size (int): Rows per INSERT statement.
+        remove_after (bool): Delete the file once processed (uploaded files).
+
+    Returns:
+        str: Job id
+    """
+    job_id = str(uuid.uuid4())
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO batch_jobs (id, file, status, owner, created_at) VALUES (%s, %s, 'queued', %s, %s)",
+            (job_id, file_name, job_owner(), datetime.now())
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    _get_executor().submit(_run_job, job_id, path, chunk_size, remove_after)
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Returns the status of a background job, or None if it does not exist.
+
+    The status includes rows parsed so far, throughput in rows/s and, once the
+    job has finished, its result (stats or errors).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT * FROM batch_jobs WHERE id = %s", (job_id,))
+        job = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+    if not job:
+        return None
+
+    result = json.loads(job['result']) if job['result'] else None
+    started_at = job['started_at']
+    if result and 'stats' in result:
+        elapsed = result['stats']['elapsed_seconds']
+    elif started_at:
+        elapsed = ((job['finished_at'] or datetime.now()) - started_at).total_seconds()
+    else:
+        elapsed = 0
+    status = {
+        "id": job['id'],
+        "file": job['file'],
+        "status": job['status'],
+        "rows_parsed": job['rows_parsed'],
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(job['rows_parsed'] / elapsed, 1) if elapsed > 0 else None,
+        "created_at": job['created_at'].strftime('%Y%m%d%H%M%S'),
+        "started_at": started_at.strftime('%Y%m%d%H%M%S') if started_at else None,
+        "finished_at": job['finished_at'].strftime('%Y%m%d%H%M%S') if job['finished_at'] else None,
+    }
+    if result:
+        status["result"] = result
+    return status
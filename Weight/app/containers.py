@@ -0,0 +1,467 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Containers
+----------
+Helpers for container data:
+
+1. The `transaction_containers` side table, which holds one row per
+   (transaction, container) pair. It replaces FIND_IN_SET / SUBSTRING_INDEX
+   scans over the comma-separated `transactions.containers` column with index
+   seeks on `container_id`. The comma-separated column is still written and
+   returned by the API; this table only serves lookups.
+2. Registration of container weights (`containers_registered`).
+3. An in-process cache of registered container weights (tares), in kg,
+   kept in step with registrations through `cache_generations`: every
+   registration bumps the 'containers' generation in the same transaction,
+   and a process drops its cache once it sees the generation move.
+   weight_post reads the generation as a column of the query it already
+   runs (SQL_CONTAINER_GENERATION_COLUMN), so a weighing never stores a
+   neto computed with a tare its own snapshot would not see, at no extra
+   round trip. Other lookups (/item, /session) re-read the generation at
+   most every CONTAINER_GENERATION_INTERVAL seconds, and make no database
+   call at all when every container is cached.
+4. The `unknown_containers` set: containers seen in a transaction without a
+   registered weight. Containers are added when a weighing is recorded and
+   removed when they are registered, so /unknown is a plain indexed read.
+
+Environment:
+- CONTAINER_CACHE_SIZE: Maximum cached container weights per process (default: 10000)
+- CONTAINER_CACHE_TTL: Seconds before a cached weight is re-read from the database (default: 300)
+- CONTAINER_GENERATION_INTERVAL: Seconds a lookup without a generation of its own trusts the
+  last one read, i.e. how long /item and /session may show a replaced tare (default: 1)
+"""
+
+LB_TO_KG = 0.454  # Conversion factor for pounds to kilograms.
+IN_LIST_CHUNK = 1000  # Max values per IN (...) list
+GENERATION_INTERVAL = float(os.getenv('CONTAINER_GENERATION_INTERVAL', 1))
+
+CREATE_TRANSACTION_CONTAINERS = """
+    CREATE TABLE IF NOT EXISTS `transaction_containers` (
+      `transaction_id` int(12) NOT NULL,
+      `container_id` varchar(50) NOT NULL,
+      PRIMARY KEY (`transaction_id`, `container_id`),
+      KEY `idx_container_transaction` (`container_id`, `transaction_id`)
+    ) ENGINE=InnoDB
+"""
+
+CREATE_UNKNOWN_CONTAINERS = """
+    CREATE TABLE IF NOT EXISTS `unknown_containers` (
+      `container_id` varchar(50) NOT NULL,
+      PRIMARY KEY (`container_id`)
+    ) ENGINE=InnoDB
+"""
+
+CREATE_CACHE_GENERATIONS = """
+    CREATE TABLE IF NOT EXISTS `cache_generations` (
+      `name` varchar(50) NOT NULL,
+      `generation` bigint NOT NULL DEFAULT 0,
+      PRIMARY KEY (`name`)
+    ) ENGINE=InnoDB
+"""
+
+SQL_CONTAINER_GENERATION = "SELECT generation FROM cache_generations WHERE name = 'containers'"
+# Selected along with the rows a weighing reads anyway, as `container_generation`
+SQL_CONTAINER_GENERATION_COLUMN = f"COALESCE(({SQL_CONTAINER_GENERATION}), 0) AS container_generation"
+# Row-locked until the registering transaction commits, so generations follow commit order
+SQL_BUMP_CONTAINER_GENERATION = """
+    INSERT INTO cache_generations (name, generation) VALUES ('containers', 1)
+    ON DUPLICATE KEY UPDATE generation = generation + 1
+"""
+
+# Full recompute of the unknown set, used to fill and to check `unknown_containers`
+SQL_COMPUTE_UNKNOWN = """
+    SELECT DISTINCT tc.container_id
+    FROM transaction_containers tc
+    LEFT JOIN containers_registered cr ON cr.container_id = tc.container_id
+    WHERE cr.container_id IS NULL
+"""
+
+
+def split_containers(containers_str):
+    """
+    Splits a comma-separated container string into a list of container IDs.
+
+    Blank entries are dropped and surrounding whitespace is trimmed.
+    """
+    if not containers_str:
+        return []
+    return [c.strip() for c in containers_str.split(',') if c.strip()]
+
+
+def record_transaction_containers(cursor, transaction_id, containers):
+    """
+    Links a transaction to each of its containers.
+
+    Args:
+        cursor: Open cursor; the caller commits.
+        transaction_id (int): ID of the transaction row.
+        containers (list): Container IDs carried by the transaction.
+    """
+    rows = [(transaction_id, c) for c in dict.fromkeys(c.strip() for c in containers if c.strip())]
+    if rows:
+        cursor.executemany(
+            "INSERT IGNORE INTO transaction_containers (transaction_id, container_id) VALUES (%s, %s)",
+            rows
+        )
+        # Containers of this transaction without a registered weight join the unknown set
+        cursor.execute("""
+            INSERT IGNORE INTO unknown_containers (container_id)
+            SELECT tc.container_id
+            FROM transaction_containers tc
+            LEFT JOIN containers_registered cr ON cr.container_id = tc.container_id
+            WHERE tc.transaction_id = %s AND cr.container_id IS NULL
+        """, (transaction_id,))
+
+
+def delete_transaction_containers(cursor, transaction_id):
+    """
+    Removes the container links of a deleted transaction.
+
+    Containers that no other transaction carries also leave the unknown set.
+    """
+    cursor.execute("SELECT container_id FROM transaction_containers WHERE transaction_id = %s", (transaction_id,))
+    container_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM transaction_containers WHERE transaction_id = %s", (transaction_id,))
+    if container_ids:
+        placeholders = ', '.join(['%s'] * len(container_ids))
+        cursor.execute(f"""
+            DELETE FROM unknown_containers
+            WHERE container_id IN ({placeholders})
+            AND NOT EXISTS (
+                SELECT 1 FROM transaction_containers tc WHERE tc.container_id = unknown_containers.container_id
+            )
+        """, container_ids)
+
+
+def backfill_transaction_containers(conn, batch_size=1000, progress=print):
+    """
+    Creates `transaction_containers` if needed and fills it from existing transactions.
+
+    Walks `transactions` in primary-key order, batch_size rows at a time, and
+    commits after every batch. Safe to re-run: existing links are ignored.
+
+    Args:
+        conn: Open database connection.
+        batch_size (int): Transactions read per batch.
+        progress (callable): Receives a status line after every batch.
+
+    Returns:
+        tuple: (transactions scanned, links written)
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_TRANSACTION_CONTAINERS)
+        last_id = 0
+        scanned = 0
+        linked = 0
+        while True:
+            cursor.execute("""
+                SELECT id, containers FROM transactions
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            links = []
+            for transaction_id, containers_str in rows:
+                links.extend((transaction_id, c) for c in dict.fromkeys(split_containers(containers_str)))
+            if links:
+                cursor.executemany(
+                    "INSERT IGNORE INTO transaction_containers (transaction_id, container_id) VALUES (%s, %s)",
+                    links
+                )
+                linked += cursor.rowcount
+            conn.commit()
+
+            scanned += len(rows)
+            last_id = rows[-1][0]
+            progress(f"Scanned {scanned} transactions (up to id {last_id}), {linked} container links written")
+        return scanned, linked
+    finally:
+        cursor.close()
+
+
+def register_containers(cursor, containers, chunk_size=1000, on_chunk=None):
+    """
+    Upserts container weights into `containers_registered` in multi-row chunks.
+
+    Rows whose container is already registered get their weight and unit
+    replaced; if a container appears more than once the last row wins.
+    Registered containers leave the unknown set, and the container weight
+    caches of every process are invalidated on commit. The caller owns the
+    transaction: nothing is committed here.
+
+    Args:
+        cursor: Open cursor.
+        containers (iterable): Dicts with "id", "weight" and "unit".
+        chunk_size (int): Rows per INSERT statement.
+        on_chunk (callable): Called with the container IDs of every chunk once it is written.
+
+    Returns:
+        tuple: (inserted, updated) container counts
+    """
+    inserted = 0
+    updated = 0
+    chunk = {}
+
+    def flush():
+        nonlocal inserted, updated
+        ids = list(chunk)
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f"SELECT container_id FROM containers_registered WHERE container_id IN ({placeholders})",
+            ids
+        )
+        existing = len(cursor.fetchall())
+        cursor.executemany("""
+            INSERT INTO containers_registered (container_id, weight, unit) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE weight = VALUES(weight), unit = VALUES(unit)
+        """, [(cont["id"], cont["weight"], cont["unit"]) for cont in chunk.values()])
+        cursor.execute(f"DELETE FROM unknown_containers WHERE container_id IN ({placeholders})", ids)
+        inserted += len(ids) - existing
+        updated += existing
+        chunk.clear()
+        if on_chunk:
+            on_chunk(ids)
+
+    for cont in containers:
+        chunk[cont["id"]] = cont
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    if inserted or updated:
+        cursor.execute(SQL_BUMP_CONTAINER_GENERATION)
+    return inserted, updated
+
+
+def fill_unknown_containers(conn):
+    """
+    Creates `unknown_containers` if needed and fills it from a full recompute.
+
+    Returns:
+        int: Containers added to the set.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_UNKNOWN_CONTAINERS)
+        cursor.execute("INSERT IGNORE INTO unknown_containers (container_id) " + SQL_COMPUTE_UNKNOWN)
+        added = cursor.rowcount
+        conn.commit()
+        return added
+    finally:
+        cursor.close()
+
+
+def check_unknown_containers(conn, fix=False):
+    """
+    Compares `unknown_containers` with a full recompute of the unknown set.
+
+    Args:
+        conn: Open database connection.
+        fix (bool): Bring the table in line with the recompute.
+
+    Returns:
+        tuple: (missing, extra) sorted lists - containers the table lacks, and
+        containers it holds that are registered or no longer in any transaction
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_COMPUTE_UNKNOWN)
+        expected = {row[0] for row in cursor.fetchall()}
+        cursor.execute("SELECT container_id FROM unknown_containers")
+        actual = {row[0] for row in cursor.fetchall()}
+        missing = sorted(expected - actual)
+        extra = sorted(actual - expected)
+        if fix:
+            if missing:
+                cursor.executemany("INSERT IGNORE INTO unknown_containers (container_id) VALUES (%s)",
+                                   [(c,) for c in missing])
+            for chunk in (extra[i:i + IN_LIST_CHUNK] for i in range(0, len(extra), IN_LIST_CHUNK)):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f"DELETE FROM unknown_containers WHERE container_id IN ({placeholders})", chunk)
+            conn.commit()
+        return missing, extra
+    finally:
+        cursor.close()
+
+
+def to_kg(weight, unit):
+    """Converts a registered container weight to kg."""
+    if unit and unit.lower() == 'lbs':
+        return round(weight * LB_TO_KG)
+    return weight
+
+
+class ContainerWeightCache:
+    """
+    Size-bounded LRU cache of container weights in kg.
+
+    The entries belong to one registration generation (see sync()); only
+    registered containers are cached, so a container registered by another
+    worker process is picked up on its next lookup. Entries expire after
+    `ttl` seconds as a safety net for weights changed outside of
+    register_containers().
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # container_id -> (weight_kg, expires_at)
+        self._lock = threading.Lock()
+        self.generation = None  # Registration generation of the entries
+        self.synced_at = None  # When a generation was last read from the database
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, container_id):
+        """Returns the cached weight in kg, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(container_id)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[container_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(container_id)
+            self.hits += 1
+            return entry[0]
+
+    def sync(self, generation):
+        """
+        Moves the cache to the registration generation a caller read from the database.
+
+        Entries of an older generation are dropped. Returns False when the
+        caller's snapshot is older than the cache, which it must then bypass.
+        """
+        with self._lock:
+            self.synced_at = time.monotonic()
+            if self.generation is None or generation > self.generation:
+                self._entries.clear()
+                self.generation = generation
+            return generation == self.generation
+
+    def recent_generation(self, interval):
+        """Returns the generation if one was read from the database in the last `interval` seconds, else None."""
+        with self._lock:
+            if self.synced_at is not None and time.monotonic() - self.synced_at < interval:
+                return self.generation
+            return None
+
+    def put(self, container_id, weight_kg, generation=None):
+        """Caches a weight; a weight read in another generation than the cache's is ignored."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[container_id] = (weight_kg, time.monotonic() + self.ttl)
+            self._entries.move_to_end(container_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, container_ids=None):
+        """Drops the given containers, or everything when called without arguments."""
+        with self._lock:
+            if container_ids is None:
+                self._entries.clear()
+            else:
+                for container_id in container_ids:
+                    self._entries.pop(container_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "generation": self.generation,
+                    "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+container_cache = ContainerWeightCache(
+    max_size=int(os.getenv('CONTAINER_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('CONTAINER_CACHE_TTL', 300))
+)
+
+
+def read_container_generation(cursor):
+    """Reads the registration generation of container weights (0 before the first registration)."""
+    cursor.execute(SQL_CONTAINER_GENERATION)
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    return rows[0]['generation'] if isinstance(rows[0], dict) else rows[0][0]
+
+
+def resolve_container_weights(cursor, container_ids, use_cache=True, generation=None):
+    """
+    Resolves the registered weights (in kg) of many containers at once.
+
+    Cached weights are used first, as long as the registration generation
+    matches the cache; all remaining containers are fetched with a single
+    `WHERE container_id IN (...)` query per IN_LIST_CHUNK ids. Works with
+    both tuple and dictionary cursors.
+
+    Args:
+        cursor: Open cursor.
+        container_ids (iterable): Container IDs, duplicates allowed.
+        use_cache (bool): Set to False to read the database only (e.g. inside a
+            transaction that is changing container weights).
+        generation (int): Registration generation read in the cursor's transaction
+            (SQL_CONTAINER_GENERATION_COLUMN); callers that write a result must pass
+            it. Otherwise the last generation read in this process is trusted for
+            GENERATION_INTERVAL seconds, and re-read after that.
+
+    Returns:
+        tuple: (weights, unknown)
+        - weights (dict): container_id -> weight in kg, for registered containers
+        - unknown (list): Requested container IDs without a registered weight, in request order
+    """
+    ids = list(dict.fromkeys(container_ids))
+    if use_cache and ids:
+        if generation is None:
+            generation = container_cache.recent_generation(GENERATION_INTERVAL)
+            if generation is None:
+                generation = read_container_generation(cursor)
+                use_cache = container_cache.sync(generation)
+        else:
+            use_cache = container_cache.sync(generation)
+    weights = {}
+    missing = []
+    for container_id in ids:
+        weight = container_cache.get(container_id) if use_cache else None
+        if weight is None:
+            missing.append(container_id)
+        else:
+            weights[container_id] = weight
+
+    for i in range(0, len(missing), IN_LIST_CHUNK):
+        chunk = missing[i:i + IN_LIST_CHUNK]
+        requested = {c.lower(): c for c in chunk}  # The column collation is case-insensitive
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(
+            f"SELECT container_id, weight, unit FROM containers_registered WHERE container_id IN ({placeholders})",
+            chunk
+        )
+        for row in cursor.fetchall():
+            container_id, weight, unit = (row['container_id'], row['weight'], row['unit']) if isinstance(row, dict) else row
+            container_id = requested.get(container_id.lower(), container_id)
+            if weight is None:
+                continue
+            weights[container_id] = to_kg(weight, unit)
+            if use_cache:
+                container_cache.put(container_id, weights[container_id], generation)
+
+    unknown = [c for c in ids if c not in weights]
+    return weights, unknown
+
+
+def get_container_weight(cursor, container_id):
+    """Returns the registered weight of a container in kg, or None if it is unknown."""
+    weights, _ = resolve_container_weights(cursor, [container_id])
+    return weights.get(container_id)
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+import metrics
+
+"""
+Database Connection Pool
+------------------------
+Shared, bounded pool of MySQL connections for the Weight service.
+
+Every request used to open a fresh connection (TCP handshake + auth) and
+close it at the end. Routes now check a connection out of this pool with
+get_db_connection() and give it back with conn.close(), exactly as before.
+
+Environment:
+- DB_POOL_SIZE: Maximum number of open connections per process (default: 10, max: 32)
+- DB_POOL_TIMEOUT: Seconds to wait for a free connection before failing (default: 5)
+- DB_LOCK_TIMEOUT: Seconds to wait for a named (advisory) lock (default: 10)
+
+Health checks: the pool pings each connection on checkout and transparently
+reconnects ones the server has dropped (e.g. after wait_timeout), and resets
+the session state when a connection is returned.
+
+Checkout times and every statement run through a pooled connection's
+cursors are recorded by metrics.py.
+"""
+
+# Database configuration
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': os.getenv('DB_USER', 'user_weight'),
+    'password': os.getenv('DB_PASSWORD', 'bashisthebest'),
+    'database': os.getenv('DB_NAME', 'weight'),
+    'port': int(os.getenv('DB_PORT', 3306))
+}
+
+# Pool configuration
+POOL_NAME = 'weight_pool'
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+LOCK_TIMEOUT = int(os.getenv('DB_LOCK_TIMEOUT', 10))
+
+if not 1 <= POOL_SIZE <= pooling.CNX_POOL_MAXSIZE:
+    raise ValueError(f"DB_POOL_SIZE must be between 1 and {pooling.CNX_POOL_MAXSIZE}, got {POOL_SIZE}")
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_SIZE)  # One slot per pooled connection
+
+_stats_lock = threading.Lock()
+_stats = {
+    'checkouts': 0,          # Successful checkouts
+    'in_use': 0,             # Connections currently checked out
+    'exhausted': 0,          # Checkouts that timed out waiting for a slot
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+}
+
+
+class PoolExhaustedError(PoolError):
+    """Raised when no pooled connection becomes free within DB_POOL_TIMEOUT."""
+
+
+class PooledConnection:
+    """
+    Wrapper around a pooled MySQL connection.
+
+    Behaves like a regular connection; close() hands the connection back to
+    the pool and frees its slot instead of tearing down the socket, and its
+    cursors are timed (metrics.InstrumentedCursor).
+    """
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._cnx.cursor(*args, **kwargs)
+        return metrics.InstrumentedCursor(cursor) if metrics.ENABLED else cursor
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._cnx.close()  # Returns the connection to the pool
+        finally:
+            with _stats_lock:
+                _stats['in_use'] -= 1
+            _slots.release()
+
+
+def _get_pool():
+    """Creates the pool on first use so that importing the app never needs a database."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=POOL_NAME,
+                    pool_size=POOL_SIZE,
+                    pool_reset_session=True,
+                    **DB_CONFIG
+                )
+    return _pool
+
+
+def get_db_connection():
+    """
+    Checks a connection out of the pool.
+
+    Blocks up to DB_POOL_TIMEOUT seconds when every connection is in use.
+
+    Returns:
+        PooledConnection: Call close() to return it to the pool.
+
+    Raises:
+        PoolExhaustedError: If no connection became free in time.
+        mysql.connector.Error: If the database is unreachable.
+    """
+    started = time.monotonic()
+    if not _slots.acquire(timeout=POOL_TIMEOUT):
+        with _stats_lock:
+            _stats['exhausted'] += 1
+        raise PoolExhaustedError(
+            f"Database connection pool exhausted: all {POOL_SIZE} connections in use "
+            f"for more than {POOL_TIMEOUT:g}s (raise DB_POOL_SIZE or DB_POOL_TIMEOUT)"
+        )
+    try:
+        cnx = _get_pool().get_connection()  # Pings and reconnects stale connections
+    except Exception:
+        _slots.release()
+        raise
+
+    waited = time.monotonic() - started
+    with _stats_lock:
+        _stats['checkouts'] += 1
+        _stats['in_use'] += 1
+        _stats['wait_seconds_total'] += waited
+        _stats['wait_seconds_max'] = max(_stats['wait_seconds_max'], waited)
+    metrics.observe_checkout(waited)
+    return PooledConnection(cnx)
+
+
+def pool_stats():
+    """Returns a snapshot of pool configuration and checkout metrics."""
+    with _stats_lock:
+        stats = dict(_stats)
+    checkouts = stats['checkouts']
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / checkouts if checkouts else 0.0
+    stats['size'] = POOL_SIZE
+    stats['timeout'] = POOL_TIMEOUT
+    return stats
+
+
+def get_named_lock(cursor, name, timeout=LOCK_TIMEOUT):
+    """
+    Takes a MySQL named (advisory) lock, waiting up to `timeout` seconds.
+
+    The lock belongs to the connection, not to a transaction, so it survives
+    commits; release it with release_named_lock() before closing.
+
+    Returns:
+        bool: True if the lock was acquired.
+    """
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+    return cursor.fetchone()[0] == 1
+
+
+def release_named_lock(cursor, name):
+    """Releases a lock taken with get_named_lock()."""
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+    cursor.fetchone()
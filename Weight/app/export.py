@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+from containers import split_containers
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow export is optional
+    pa = None
+
+"""
+Weight Record Export
+--------------------
+Renders GET /weight results in the requested format, one batch of database
+rows at a time, so a response can be streamed without holding the whole
+result in memory.
+
+Rows are tuples in the column order of app.SQL_WEIGHT_RANGE:
+    (id, datetime, direction, bruto, neto, produce, containers)
+
+Formats:
+- json: The API specification array; containers rendered as "[a,b]", neto "na" when unknown
+- ndjson: One JSON object per line, with datetime and containers as a real array
+- csv: Header row, then one line per record; containers comma-separated in one field
+- arrow: Arrow IPC stream, one record batch per fetched chunk (requires pyarrow)
+"""
+
+EXPORT_COLUMNS = ('id', 'datetime', 'direction', 'bruto', 'neto', 'produce', 'containers')
+
+
+def format_weight_record(row):
+    """Formats a row according to the GET /weight API specification."""
+    transaction_id, _, direction, bruto, neto, produce, containers = row
+    return {
+        "id": transaction_id,
+        "direction": direction,
+        "bruto": bruto,  # in kg
+        "neto": neto if neto is not None else "na",
+        "produce": produce,
+        "containers": f"[{','.join(containers.split(','))}]" if containers else "[]"
+    }
+
+
+def _export_record(row):
+    transaction_id, stamp, direction, bruto, neto, produce, containers = row
+    return {
+        "id": transaction_id,
+        "datetime": stamp.strftime('%Y%m%d%H%M%S'),
+        "direction": direction,
+        "bruto": bruto,
+        "neto": neto if neto is not None else "na",
+        "produce": produce,
+        "containers": split_containers(containers)
+    }
+
+
+def json_chunks(batches):
+    """Yields one JSON array of API records."""
+    yield '['
+    separator = ''
+    for rows in batches:
+        if rows:
+            yield separator + ','.join(json.dumps(format_weight_record(row), separators=(',', ':'))
+                                       for row in rows)
+            separator = ','
+    yield ']'
+
+
+def ndjson_chunks(batches):
+    """Yields newline-delimited JSON records."""
+    for rows in batches:
+        if rows:
+            yield ''.join(json.dumps(_export_record(row), separators=(',', ':')) + '\n' for row in rows)
+
+
+def csv_chunks(batches):
+    """Yields CSV text, starting with a header row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        for transaction_id, stamp, direction, bruto, neto, produce, containers in rows:
+            writer.writerow((transaction_id, stamp.strftime('%Y%m%d%H%M%S'), direction, bruto,
+                             neto if neto is not None else 'na', produce, ','.join(split_containers(containers))))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """Write-only file object collecting what the Arrow writer produces between two yields."""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_chunks(batches):
+    """Yields an Arrow IPC stream with one record batch per batch of rows."""
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('datetime', pa.timestamp('s')),
+        ('direction', pa.string()),
+        ('bruto', pa.int64()),
+        ('neto', pa.int64()),
+        ('produce', pa.string()),
+        ('containers', pa.list_(pa.string())),
+    ])
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+    yield sink.take()
+    for rows in batches:
+        if not rows:
+            continue
+        ids, stamps, directions, brutos, netos, produces, containers = zip(*rows)
+        writer.write_batch(pa.record_batch([
+            pa.array(ids, pa.int64()),
+            pa.array(stamps, pa.timestamp('s')),
+            pa.array(directions, pa.string()),
+            pa.array(brutos, pa.int64()),
+            pa.array(netos, pa.int64()),
+            pa.array(produces, pa.string()),
+            pa.array([split_containers(c) for c in containers], pa.list_(pa.string())),
+        ], schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+# format -> (mimetype, chunk generator)
+EXPORT_FORMATS = {
+    'json': ('application/json', json_chunks),
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+    'csv': ('text/csv', csv_chunks),
+}
+if pa is not None:
+    EXPORT_FORMATS['arrow'] = ('application/vnd.apache.arrow.stream', arrow_chunks)
@@ -0,0 +1,89 @@
+import glob
+import multiprocessing
+import os
+import tempfile
+import uuid
+
+"""
+Gunicorn Configuration
+----------------------
+Production server for the Weight API:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Every worker is a separate process with its own connection pool (db.py), and
+serves WEB_THREADS requests at a time. Unless DB_POOL_SIZE is set explicitly,
+each worker's pool gets one connection per request thread plus two per
+background batch job (its registering transaction and its progress
+updates, see batch.py), so a busy worker never waits on its own pool.
+Across the service that is WEB_WORKERS x DB_POOL_SIZE connections, which must
+stay below MySQL's max_connections (151 by default).
+
+Workers share their /metrics counters through METRICS_DIR (default: a
+directory under the system temp dir), which is emptied when the server starts.
+The snapshot of a worker that exits is merged into a single file of retired
+workers (metrics.retire), so the directory does not grow with max_requests.
+
+When a worker starts it marks the background batch jobs of stopped workers,
+and of earlier servers (WEIGHT_SERVER_ID), as failed (batch.py).
+
+Environment:
+- WEB_BIND: Address to listen on (default: 0.0.0.0:5000)
+- WEB_WORKERS: Worker processes (default: 2 x CPUs + 1, at most 8)
+- WEB_THREADS: Request threads per worker (default: 4)
+- WEB_KEEPALIVE: Seconds to keep idle client connections open (default: 5)
+- WEB_TIMEOUT: Seconds before a silent worker is restarted (default: 120)
+- WEB_RELOAD: Set to 1 to restart workers when the code changes (development only)
+"""
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = 'gthread'
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+timeout = int(os.getenv('WEB_TIMEOUT', 120))  # /batch-weight runs inline unless async=true
+reload = os.getenv('WEB_RELOAD') == '1'
+accesslog = '-'
+errorlog = '-'
+
+# Read by db.py when the workers import the app
+os.environ.setdefault('DB_POOL_SIZE', str(min(threads + 2 * int(os.getenv('BATCH_WORKERS', 2)), 32)))
+# Read by metrics.py
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'weight-metrics'))
+# Read by batch.py: tells the jobs of this server's workers from those of an earlier one
+os.environ.setdefault('WEIGHT_SERVER_ID', uuid.uuid4().hex)
+
+
+def on_starting(server):
+    # Snapshots of a previous server would be added to this one's counters
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+    for snapshot in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(snapshot)
+
+    pool_size = int(os.environ['DB_POOL_SIZE'])
+    needed = threads + 2 * int(os.getenv('BATCH_WORKERS', 2))
+    if pool_size < needed:
+        server.log.warning(f"DB_POOL_SIZE={pool_size} is below WEB_THREADS + 2 x BATCH_WORKERS={needed}: "
+                           f"requests will queue for database connections")
+    server.log.info(f"{workers} workers x {threads} threads, up to {workers * pool_size} database connections")
+
+
+def post_worker_init(worker):
+    # Jobs queued or running in a worker that stopped (or in an earlier server) never finish otherwise
+    from batch import fail_interrupted_jobs
+    try:
+        failed = fail_interrupted_jobs()
+    except Exception as e:
+        worker.log.warning(f"Could not check for interrupted batch jobs: {e}")
+        return
+    if failed:
+        worker.log.warning(f"Marked {failed} interrupted batch jobs as failed")
+
+
+def child_exit(server, worker):
+    # Runs in the master once the worker is gone; its last snapshot becomes part of the retired totals
+    from metrics import retire
+    try:
+        retire(worker.pid, os.environ['METRICS_DIR'])
+    except Exception as e:
+        server.log.warning(f"Could not merge the metrics of worker {worker.pid}: {e}")
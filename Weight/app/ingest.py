@@ -0,0 +1,171 @@
+import csv
+import json
+
+"""
+Container File Ingestion
+------------------------
+Streams container weights out of /batch-weight CSV and JSON files one row at
+a time, so memory stays flat regardless of file size.
+
+CSV files have a header whose weight column is named 'kg' or 'lbs':
+    "id","kg"
+    C-35434,296
+
+JSON files hold one array of objects, parsed incrementally:
+    [{"id": "T-14409", "weight": 528, "unit": "lbs"}, ...]
+
+Malformed rows are reported with their line number instead of failing the
+whole file with a generic message.
+"""
+
+VALID_UNITS = ('kg', 'lbs')
+READ_SIZE = 64 * 1024  # Bytes read from JSON files per step
+MAX_RECORD_SIZE = 1024 * 1024  # Give up on a JSON value that is still incomplete after this many characters
+
+
+class ContainerFile:
+    """
+    Iterable over the containers of a CSV or JSON file.
+
+    Yields dicts with "id", "weight" (int) and "unit". Bad rows are collected in
+    `errors` as {"line": <int>, "error": <str>}; once the first error is found no
+    more rows are yielded, but scanning continues (up to max_errors) so the
+    caller can report every problem at once.
+
+    Attributes:
+        parsed (int): Rows read so far, valid or not.
+        errors (list): Problems found so far.
+    """
+
+    def __init__(self, path, max_errors=20):
+        self.path = path
+        self.max_errors = max_errors
+        self.parsed = 0
+        self.errors = []
+
+    def __iter__(self):
+        rows = self._csv_rows() if self.path.lower().endswith('.csv') else self._json_rows()
+        for line, row in rows:
+            self.parsed += 1
+            try:
+                container = self._validate(row)
+            except ValueError as e:
+                self.errors.append({"line": line, "error": str(e)})
+                if len(self.errors) >= self.max_errors:
+                    return
+                continue
+            if not self.errors:
+                yield container
+
+    @staticmethod
+    def _validate(row):
+        container_id, weight, unit = row
+        if not isinstance(container_id, str) or not container_id.strip():
+            raise ValueError("Container id is missing")
+        try:
+            weight = int(weight)
+        except (TypeError, ValueError):
+            raise ValueError(f"Weight must be an integer, got {weight!r}")
+        if not isinstance(unit, str) or unit.lower() not in VALID_UNITS:
+            raise ValueError(f"Unit must be 'kg' or 'lbs', got {unit!r}")
+        return {"id": container_id.strip().capitalize(), "weight": weight, "unit": unit.lower()}
+
+    def _csv_rows(self):
+        """Yields (line number, (id, weight, unit)) for every data row of a CSV file."""
+        with open(self.path, 'r', newline='') as file:
+            reader = csv.reader(file)
+            headers = next(reader, [])
+            units = [h.strip().lower() for h in headers if h.strip().lower() in VALID_UNITS]
+            if not units:
+                self.errors.append({"line": 1, "error": "Header must contain a 'kg' or 'lbs' column"})
+                return
+            unit = units[0]
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) < 2:
+                    yield reader.line_num, (row[0], None, unit)
+                else:
+                    yield reader.line_num, (row[0], row[1], unit)
+
+    def _json_rows(self):
+        """Yields (line number, (id, weight, unit)) for every object of a JSON array."""
+        with open(self.path, 'r') as file:
+            for line, item in _iter_json_array(file, self.errors):
+                if not isinstance(item, dict):
+                    yield line, (None, None, None)
+                else:
+                    yield line, (item.get('id'), item.get('weight'), item.get('unit'))
+
+
+def _iter_json_array(file, errors):
+    """
+    Incrementally parses a top-level JSON array, yielding (line number, value).
+
+    Syntax errors are appended to `errors` and end the iteration, since the
+    parser cannot resynchronise after them.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    line = 1
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = file.read(READ_SIZE)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos, line
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                if buf[pos] == '\n':
+                    line += 1
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def syntax_error(message):
+        errors.append({"line": line, "error": f"Invalid JSON: {message}"})
+
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != '[':
+        syntax_error("expected a list of containers")
+        return
+    pos += 1
+
+    expect_value = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buf):
+            syntax_error("unexpected end of file")
+            return
+        if buf[pos] == ']':
+            return
+        if not expect_value:
+            if buf[pos] != ',':
+                syntax_error(f"expected ',' or ']', got {buf[pos]!r}")
+                return
+            pos += 1
+            expect_value = True
+            continue
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError as e:
+                if eof or len(buf) - pos > MAX_RECORD_SIZE:
+                    line += buf.count('\n', pos, e.pos)
+                    syntax_error(e.msg)
+                    return
+                fill()
+        yield line, value
+        line += buf.count('\n', pos, end)
+        pos = end
+        expect_value = False
@@ -0,0 +1,386 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+"""
+Request and Query Metrics
+-------------------------
+In-process instrumentation for the Weight API, exposed on /metrics in the
+Prometheus text format:
+
+- weight_http_request_duration_seconds: Latency histogram per method, route and status
+- weight_http_request_db_seconds_total / weight_http_request_queries_total:
+  Time spent in, and number of, database calls made while serving each route
+- weight_db_checkout_duration_seconds: Connection pool checkout time per route
+- weight_db_query_duration_seconds: Histogram per route and statement
+- weight_db_query_rows_total / weight_db_query_errors_total: Rows fetched and failed calls per statement
+- weight_db_slow_queries_total: Statements slower than DB_SLOW_QUERY_MS
+
+Every cursor handed out by db.py is an InstrumentedCursor: a statement's
+duration is its execute() plus the fetch calls that read its result, so
+streamed results are measured without the time spent between fetches.
+Statements are labelled by their SQL with whitespace collapsed and IN lists
+and multi-row VALUES reduced to one placeholder, which keeps the label set
+as small as the number of distinct statements in the code. Observations
+cost a few microseconds (two clock reads and a dict update under a lock).
+
+Under gunicorn every worker has its own counters. When METRICS_DIR is set,
+workers write a snapshot there every METRICS_FLUSH_SECONDS and /metrics
+serves the sum of all snapshots, so a scrape sees the whole service no
+matter which worker answers it. When a worker exits, the gunicorn master
+merges its snapshot into RETIRED_SNAPSHOT (retire()), so the directory
+holds one file per live worker however often workers are replaced.
+
+Environment:
+- METRICS_ENABLED: 0 hands out plain cursors and records nothing (default: 1)
+- METRICS_DIR: Directory shared by the workers of one server (default: unset, this process only)
+- METRICS_FLUSH_SECONDS: Seconds between snapshots of a worker (default: 5)
+- DB_SLOW_QUERY_MS: Log statements slower than this to the weight.slow_queries logger (default: 0, off)
+"""
+
+ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 0))
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# name -> (type, help, buckets)
+FAMILIES = {
+    'weight_http_request_duration_seconds': ('histogram', 'Request latency', REQUEST_BUCKETS),
+    'weight_http_request_db_seconds_total': ('counter', 'Time spent in database calls while serving requests', None),
+    'weight_http_request_queries_total': ('counter', 'Database calls made while serving requests', None),
+    'weight_db_checkout_duration_seconds': ('histogram', 'Connection pool checkout time', QUERY_BUCKETS),
+    'weight_db_query_duration_seconds': ('histogram', 'Statement execution and fetch time', QUERY_BUCKETS),
+    'weight_db_query_rows_total': ('counter', 'Rows fetched per statement', None),
+    'weight_db_query_errors_total': ('counter', 'Statements that raised an error', None),
+    'weight_db_slow_queries_total': ('counter', 'Statements slower than DB_SLOW_QUERY_MS', None),
+}
+
+QUERY_LABEL_MAX = 160
+QUERY_LABEL_CACHE = 1024
+
+slow_query_log = logging.getLogger('weight.slow_queries')
+
+_lock = threading.Lock()
+_values = {}  # (name, labels) -> [count per bucket..., count above the last bucket, sum] or [value]
+_local = threading.local()  # route and database totals of the request served by this thread
+_query_labels = {}
+_snapshot_pid = None  # Process the snapshot name belongs to: a forked worker picks its own
+_snapshot_name = None
+_next_flush = 0.0
+RETIRED_SNAPSHOT = 'retired.json'
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'%s(?:, ?%s)+')
+_VALUES_LIST = re.compile(r'\(%s(?:, \.\.\.)?\)(?:, ?\(%s(?:, \.\.\.)?\))+')
+
+
+def query_label(sql):
+    """Returns the label of a statement: its SQL with whitespace and placeholder lists collapsed."""
+    label = _query_labels.get(sql)
+    if label is None:
+        label = _WHITESPACE.sub(' ', sql if isinstance(sql, str) else sql.decode()).strip()
+        label = _VALUES_LIST.sub('(%s, ...), ...', _PLACEHOLDER_LIST.sub('%s, ...', label))
+        if len(label) > QUERY_LABEL_MAX:
+            label = label[:QUERY_LABEL_MAX - 3] + '...'
+        if len(_query_labels) < QUERY_LABEL_CACHE:  # IN lists of any length share a few raw texts
+            _query_labels[sql] = label
+    return label
+
+
+def _observe(name, labels, value):
+    buckets = FAMILIES[name][2]
+    with _lock:
+        entry = _values.get((name, labels))
+        if entry is None:
+            entry = _values[(name, labels)] = [0] * (len(buckets) + 2)
+        entry[bisect.bisect_left(buckets, value)] += 1
+        entry[-1] += value
+
+
+def _increment(name, labels, value=1):
+    with _lock:
+        entry = _values.get((name, labels))
+        if entry is None:
+            entry = _values[(name, labels)] = [0]
+        entry[0] += value
+
+
+def current_route():
+    """Route of the request served by this thread, 'background' outside requests (batch jobs, CLI)."""
+    return getattr(_local, 'route', None) or 'background'
+
+
+def start_request(route):
+    """Marks the start of a request; route is the URL rule (e.g. /item/<id>)."""
+    if not ENABLED:
+        return
+    _local.route = route
+    _local.started = time.perf_counter()
+    _local.db_seconds = 0.0
+    _local.queries = 0
+
+
+def finish_request(method, status):
+    """Records the latency of the request started by start_request()."""
+    if not ENABLED:
+        return
+    started = getattr(_local, 'started', None)
+    if started is None:
+        return
+    route = _local.route
+    _observe('weight_http_request_duration_seconds', (('method', method), ('route', route), ('status', str(status))),
+             time.perf_counter() - started)
+    _increment('weight_http_request_db_seconds_total', (('method', method), ('route', route)), _local.db_seconds)
+    _increment('weight_http_request_queries_total', (('method', method), ('route', route)), _local.queries)
+    _local.route = _local.started = None
+    flush_if_due()
+
+
+def observe_checkout(seconds):
+    """Records a connection pool checkout."""
+    if ENABLED:
+        _observe('weight_db_checkout_duration_seconds', (('route', current_route()),), seconds)
+
+
+def observe_query(route, sql, seconds, rows, failed=False):
+    """Records one statement run through an InstrumentedCursor."""
+    label = query_label(sql)
+    labels = (('route', route), ('query', label))
+    _observe('weight_db_query_duration_seconds', labels, seconds)
+    if rows:
+        _increment('weight_db_query_rows_total', labels, rows)
+    if failed:
+        _increment('weight_db_query_errors_total', labels)
+    if getattr(_local, 'started', None) is not None and _local.route == route:
+        _local.db_seconds += seconds
+        _local.queries += 1
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        _increment('weight_db_slow_queries_total', labels)
+        slow_query_log.warning("Slow query (%.1f ms, %d rows, route %s): %s", seconds * 1000, rows, route, label)
+
+
+class InstrumentedCursor:
+    """
+    Wrapper around a MySQL cursor that times every statement.
+
+    A statement is recorded once its result is read (fetchall(), or a fetch
+    that returns no more rows), or when the next statement runs or the
+    cursor is closed.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._route = current_route()
+        self._sql = None
+        self._seconds = 0.0
+        self._rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _run(self, method, sql, *args, **kwargs):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            result = method(sql, *args, **kwargs)
+        except Exception:
+            observe_query(self._route, sql, time.perf_counter() - started, 0, failed=True)
+            raise
+        self._sql = sql
+        self._seconds = time.perf_counter() - started
+        return result
+
+    def execute(self, operation, *args, **kwargs):
+        return self._run(self._cursor.execute, operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        return self._run(self._cursor.executemany, operation, *args, **kwargs)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        self._seconds += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._fetch(lambda: self._cursor.fetchmany(*args, **kwargs))
+        if rows:
+            self._rows += len(rows)
+        else:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        observe_query(self._route, self._sql, self._seconds, self._rows)
+        self._sql = None
+        self._seconds = 0.0
+        self._rows = 0
+
+
+def _snapshot():
+    with _lock:
+        return [[name, [list(label) for label in labels], list(entry)] for (name, labels), entry in _values.items()]
+
+
+def _write_json(path, data):
+    """Writes a file atomically, readers never see half of it."""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def flush():
+    """Writes this process's metrics to METRICS_DIR."""
+    global _next_flush, _snapshot_pid, _snapshot_name
+    if not METRICS_DIR:
+        return
+    _next_flush = time.monotonic() + FLUSH_SECONDS
+    if _snapshot_pid != os.getpid():
+        _snapshot_pid = os.getpid()
+        _snapshot_name = f"{_snapshot_pid}-{time.time_ns()}.json"
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(os.path.join(METRICS_DIR, _snapshot_name), _snapshot())
+
+
+def flush_if_due():
+    if METRICS_DIR and time.monotonic() >= _next_flush:
+        try:
+            flush()
+        except OSError:
+            pass  # Metrics never fail a request
+
+
+def _add(totals, snapshot):
+    """Adds a snapshot to (name, labels) -> values totals."""
+    for name, labels, entry in snapshot:
+        if name not in FAMILIES:
+            continue
+        key = (name, tuple(tuple(label) for label in labels))
+        total = totals.setdefault(key, [0] * len(entry))
+        if len(total) == len(entry):
+            for i, value in enumerate(entry):
+                total[i] += value
+
+
+def _collect():
+    """Returns (name, labels) -> values, summed over the snapshots of every worker in METRICS_DIR."""
+    flush()
+    totals = {}
+    # Read first: it lists the worker snapshots it already includes, which stay until the next retire()
+    retired = _read_json(os.path.join(METRICS_DIR, RETIRED_SNAPSHOT), {'merged': [], 'snapshot': []})
+    _add(totals, retired['snapshot'])
+    skip = {RETIRED_SNAPSHOT, *retired['merged']}
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        if os.path.basename(path) not in skip:
+            _add(totals, _read_json(path, []))
+    return totals
+
+
+def retire(pid, metrics_dir=None):
+    """
+    Merges the snapshot of an exited worker into RETIRED_SNAPSHOT, so that its
+    counters never go backwards while METRICS_DIR keeps one file per live worker.
+
+    Called by the gunicorn master (child_exit), one worker at a time. The
+    merged file is only removed on the next call, so a reader that loaded the
+    previous RETIRED_SNAPSHOT can still read it.
+    """
+    metrics_dir = metrics_dir or METRICS_DIR
+    retired_path = os.path.join(metrics_dir, RETIRED_SNAPSHOT)
+    retired = _read_json(retired_path, {'merged': [], 'snapshot': []})
+    snapshots = [path for path in glob.glob(os.path.join(metrics_dir, f"{pid}-*.json"))
+                 if os.path.basename(path) not in retired['merged']]  # The pid may be reused
+    if not snapshots:
+        return
+    totals = {}
+    _add(totals, retired['snapshot'])
+    for path in snapshots:
+        _add(totals, _read_json(path, []))
+    _write_json(retired_path, {
+        'merged': [os.path.basename(path) for path in snapshots],
+        'snapshot': [[name, [list(label) for label in labels], entry] for (name, labels), entry in totals.items()],
+    })
+    for name in retired['merged']:
+        try:
+            os.remove(os.path.join(metrics_dir, name))
+        except OSError:
+            pass
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        values = None if METRICS_DIR else {key: list(entry) for key, entry in _values.items()}
+    if values is None:
+        values = _collect()
+    lines = []
+    for name, (kind, help_text, buckets) in FAMILIES.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (family, labels), entry in sorted(values.items()):
+            if family != name:
+                continue
+            if kind == 'counter':
+                lines.append(f"{name}{_format_labels(labels)} {entry[0]:g}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), entry[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {entry[-1]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forgets every observation of this process (used by tests)."""
+    with _lock:
+        _values.clear()
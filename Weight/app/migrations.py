@@ -0,0 +1,185 @@
+from containers import (CREATE_TRANSACTION_CONTAINERS, CREATE_CACHE_GENERATIONS, backfill_transaction_containers,
+                        fill_unknown_containers)
+from batch import CREATE_BATCH_JOBS, BATCH_JOBS_OWNER_COLUMN
+from rollups import CREATE_DAILY_ROLLUPS, rebuild_rollups
+from sessions import SESSION_ID_COLUMN, SESSION_ID_INDEX, link_sessions
+
+"""
+Schema Migrations
+-----------------
+Versioned, idempotent schema changes for the weight database.
+
+Applied versions are recorded in `schema_migrations`. Each migration also
+checks the live schema (information_schema) before changing anything, so it
+is safe to run against a database created from an up-to-date weightdb.sql,
+or one that was migrated by hand.
+
+Run with:
+    flask migrate
+"""
+
+CREATE_SCHEMA_MIGRATIONS = """
+    CREATE TABLE IF NOT EXISTS `schema_migrations` (
+      `version` int(12) NOT NULL,
+      `name` varchar(100) NOT NULL,
+      `applied_at` datetime NOT NULL,
+      PRIMARY KEY (`version`)
+    ) ENGINE=InnoDB
+"""
+
+# Secondary indexes backing the hot queries of the API (table -> {index name: columns})
+TRANSACTION_INDEXES = {
+    'idx_truck_datetime': '(`truck`, `datetime`)',        # Last record for a truck, /item sessions
+    'idx_datetime_direction': '(`datetime`, `direction`)',  # GET /weight time range, out-after-in lookup
+    'idx_direction_neto': '(`direction`, `neto`)',        # Transactions waiting for a neto backfill
+}
+# Added after innodb_and_indexes had shipped, so applied by its own migration
+KEYSET_INDEXES = {
+    'idx_datetime_id': '(`datetime`, `id`)',  # GET /weight pages, read in (datetime, id) order
+}
+
+
+def _table_engine(cursor, table):
+    cursor.execute("""
+        SELECT ENGINE FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _existing_indexes(cursor, table):
+    cursor.execute("""
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _existing_columns(cursor, table):
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _alter_table(cursor, table, engine=None, indexes=None, columns=None):
+    """
+    Brings a table to the given engine, columns and index set with a single ALTER TABLE.
+
+    Only missing pieces are added, so the table is rebuilt at most once and
+    not at all when it is already up to date.
+    """
+    clauses = []
+    if engine and (_table_engine(cursor, table) or '').lower() != engine.lower():
+        clauses.append(f"ENGINE={engine}")
+    existing_columns = _existing_columns(cursor, table) if columns else set()
+    for name, definition in (columns or {}).items():
+        if name not in existing_columns:
+            clauses.append(f"ADD COLUMN `{name}` {definition}")
+    existing = _existing_indexes(cursor, table)
+    for name, columns in (indexes or {}).items():
+        if name not in existing:
+            clauses.append(f"ADD INDEX `{name}` {columns}")
+    if clauses:
+        cursor.execute(f"ALTER TABLE `{table}` " + ', '.join(clauses))
+    return clauses
+
+
+def _migration_transaction_containers(conn, cursor, progress):
+    cursor.execute(CREATE_TRANSACTION_CONTAINERS)
+    backfill_transaction_containers(conn, progress=progress)
+
+
+def _migration_innodb_and_indexes(conn, cursor, progress):
+    for table, indexes in (('transactions', TRANSACTION_INDEXES), ('containers_registered', None)):
+        clauses = _alter_table(cursor, table, engine='InnoDB', indexes=indexes)
+        progress(f"{table}: {', '.join(clauses) if clauses else 'already up to date'}")
+
+
+def _migration_batch_jobs(conn, cursor, progress):
+    cursor.execute(CREATE_BATCH_JOBS)
+
+
+def _migration_keyset_index(conn, cursor, progress):
+    clauses = _alter_table(cursor, 'transactions', indexes=KEYSET_INDEXES)
+    progress(f"transactions: {', '.join(clauses) if clauses else 'already up to date'}")
+
+
+def _migration_daily_rollups(conn, cursor, progress):
+    cursor.execute(CREATE_DAILY_ROLLUPS)
+    rebuild_rollups(conn, progress=progress)
+
+
+def _migration_unknown_containers(conn, cursor, progress):
+    progress(f"unknown_containers: {fill_unknown_containers(conn)} containers added")
+
+
+def _migration_session_links(conn, cursor, progress):
+    clauses = _alter_table(cursor, 'transactions', columns=SESSION_ID_COLUMN, indexes=SESSION_ID_INDEX)
+    progress(f"transactions: {', '.join(clauses) if clauses else 'already up to date'}")
+    link_sessions(conn, progress=progress)
+
+
+def _migration_batch_job_owner(conn, cursor, progress):
+    clauses = _alter_table(cursor, 'batch_jobs', columns=BATCH_JOBS_OWNER_COLUMN)
+    progress(f"batch_jobs: {', '.join(clauses) if clauses else 'already up to date'}")
+
+
+def _migration_cache_generations(conn, cursor, progress):
+    cursor.execute(CREATE_CACHE_GENERATIONS)
+
+
+# (version, name, function) - append new migrations, never reorder or edit applied ones
+MIGRATIONS = [
+    (1, 'transaction_containers', _migration_transaction_containers),
+    (2, 'innodb_and_indexes', _migration_innodb_and_indexes),
+    (3, 'batch_jobs', _migration_batch_jobs),
+    (4, 'keyset_index', _migration_keyset_index),
+    (5, 'daily_rollups', _migration_daily_rollups),
+    (6, 'unknown_containers', _migration_unknown_containers),
+    (7, 'session_links', _migration_session_links),
+    (8, 'batch_job_owner', _migration_batch_job_owner),
+    (9, 'cache_generations', _migration_cache_generations),
+]
+
+
+def applied_versions(cursor):
+    """Returns the set of migration versions recorded in schema_migrations."""
+    cursor.execute(CREATE_SCHEMA_MIGRATIONS)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, progress=print):
+    """
+    Applies every pending migration in version order.
+
+    Args:
+        conn: Open database connection.
+        progress (callable): Receives a status line per step.
+
+    Returns:
+        list: Versions applied by this run.
+    """
+    cursor = conn.cursor()
+    try:
+        done = applied_versions(cursor)
+        applied = []
+        for version, name, migration in MIGRATIONS:
+            if version in done:
+                continue
+            progress(f"Applying migration {version}: {name}")
+            migration(conn, cursor, progress)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, NOW())",
+                (version, name)
+            )
+            conn.commit()
+            applied.append(version)
+        if not applied:
+            progress("Schema is up to date")
+        return applied
+    finally:
+        cursor.close()
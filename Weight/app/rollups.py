@@ -0,0 +1,200 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+"""
+Daily Rollups
+-------------
+Per-day aggregates of `transactions`, so reports over long ranges read one
+row per (day, direction, produce, truck) instead of every weighing.
+
+The table is maintained incrementally: every write to `transactions` reads
+the affected rows before and after the change and applies the difference
+(RollupDelta), in the same database transaction as the write itself.
+`flask rebuild-rollups` recomputes it from history.
+"""
+
+CREATE_DAILY_ROLLUPS = """
+    CREATE TABLE IF NOT EXISTS `daily_rollups` (
+      `day` date NOT NULL,
+      `direction` varchar(10) NOT NULL,
+      `produce` varchar(50) NOT NULL,
+      `truck` varchar(50) NOT NULL,
+      `transactions` int(12) NOT NULL DEFAULT 0,
+      `bruto_sum` bigint NOT NULL DEFAULT 0,
+      `truck_tara_sum` bigint NOT NULL DEFAULT 0,
+      `neto_sum` bigint NOT NULL DEFAULT 0,
+      `neto_known` int(12) NOT NULL DEFAULT 0,
+      PRIMARY KEY (`day`, `direction`, `produce`, `truck`)
+    ) ENGINE=InnoDB
+"""
+
+# Locking read, so the "before" image matches what the following write changes
+SQL_ROLLUP_ROWS = """
+    SELECT datetime, direction, produce, truck, bruto, truckTara, neto
+    FROM transactions
+    WHERE id IN ({placeholders})
+    FOR UPDATE
+"""
+
+SQL_UPSERT_ROLLUP = """
+    INSERT INTO daily_rollups
+    (day, direction, produce, truck, transactions, bruto_sum, truck_tara_sum, neto_sum, neto_known)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+    transactions = transactions + VALUES(transactions),
+    bruto_sum = bruto_sum + VALUES(bruto_sum),
+    truck_tara_sum = truck_tara_sum + VALUES(truck_tara_sum),
+    neto_sum = neto_sum + VALUES(neto_sum),
+    neto_known = neto_known + VALUES(neto_known)
+"""
+
+SQL_REBUILD_ROLLUPS = """
+    INSERT INTO daily_rollups
+    (day, direction, produce, truck, transactions, bruto_sum, truck_tara_sum, neto_sum, neto_known)
+    SELECT DATE(datetime), direction, COALESCE(produce, 'na'), COALESCE(truck, 'na'),
+           COUNT(*), COALESCE(SUM(bruto), 0), COALESCE(SUM(truckTara), 0), COALESCE(SUM(neto), 0), COUNT(neto)
+    FROM transactions
+    WHERE datetime >= %s AND datetime < %s
+    GROUP BY DATE(datetime), direction, COALESCE(produce, 'na'), COALESCE(truck, 'na')
+"""
+
+# Columns /weight/summary can group by
+SUMMARY_GROUPS = ('day', 'direction', 'produce', 'truck')
+
+SQL_SUMMARY = """
+    SELECT {columns},
+           SUM(transactions), SUM(bruto_sum), SUM(truck_tara_sum), SUM(neto_sum), SUM(neto_known)
+    FROM daily_rollups
+    WHERE day BETWEEN %s AND %s
+    AND direction IN ({placeholders})
+    GROUP BY {columns}
+    HAVING SUM(transactions) > 0
+    ORDER BY {columns}
+"""
+
+
+class RollupDelta:
+    """
+    Accumulates the rollup changes caused by writes to `transactions`.
+
+    Call remove_ids() before rows are updated or deleted and add_ids() after
+    they are inserted or updated, then apply() once; unchanged columns cancel
+    out, so only real differences reach the table.
+    """
+
+    def __init__(self):
+        self._totals = defaultdict(lambda: [0, 0, 0, 0, 0])
+
+    def add(self, row, sign=1):
+        """Counts a (datetime, direction, produce, truck, bruto, truckTara, neto) row, or discounts it with sign=-1."""
+        stamp, direction, produce, truck, bruto, truck_tara, neto = row
+        if stamp is None or direction is None:
+            return
+        totals = self._totals[(stamp.date(), direction, produce or 'na', truck or 'na')]
+        totals[0] += sign
+        totals[1] += sign * (bruto or 0)
+        totals[2] += sign * (truck_tara or 0)
+        totals[3] += sign * (neto or 0)
+        totals[4] += sign * (neto is not None)
+
+    def add_ids(self, cursor, ids, sign=1):
+        """Counts the current state of the given transactions."""
+        ids = list(ids)
+        if not ids:
+            return
+        cursor.execute(SQL_ROLLUP_ROWS.format(placeholders=', '.join(['%s'] * len(ids))), ids)
+        for row in cursor.fetchall():
+            self.add(row, sign)
+
+    def remove_ids(self, cursor, ids):
+        """Discounts the current state of the given transactions."""
+        self.add_ids(cursor, ids, sign=-1)
+
+    def apply(self, cursor):
+        """Writes the accumulated differences; the caller commits."""
+        rows = [(*key, *totals) for key, totals in self._totals.items() if any(totals)]
+        if rows:
+            cursor.executemany(SQL_UPSERT_ROLLUP, rows)
+        self._totals.clear()
+        return len(rows)
+
+
+def rebuild_rollups(conn, since=None, progress=print):
+    """
+    Recomputes daily rollups from `transactions`.
+
+    Works one month per database transaction (delete, then re-aggregate), so
+    readers never see a month half rebuilt and live weighings can go on.
+
+    Args:
+        conn: Open database connection.
+        since (date): First day to rebuild (default: the whole history).
+        progress (callable): Receives a status line per month.
+
+    Returns:
+        int: Rollup rows written.
+    """
+    lower = since or date(1000, 1, 1)  # Smallest MySQL DATE
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_DAILY_ROLLUPS)
+        cursor.execute("SELECT DATE(MIN(datetime)), DATE(MAX(datetime)) FROM transactions WHERE datetime >= %s",
+                       (lower,))
+        first, last = cursor.fetchone()
+        if first is None:
+            cursor.execute("DELETE FROM daily_rollups WHERE day >= %s", (lower,))
+            conn.commit()
+            progress("No transactions to roll up")
+            return 0
+        # Days outside the rebuilt months can only hold stale rollups
+        cursor.execute("DELETE FROM daily_rollups WHERE (day >= %s AND day < %s) OR day > %s", (lower, first, last))
+        conn.commit()
+
+        written = 0
+        month = first.replace(day=1)
+        while month <= last:
+            next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+            start = max(month, first)
+            cursor.execute("DELETE FROM daily_rollups WHERE day >= %s AND day < %s", (start, next_month))
+            cursor.execute(SQL_REBUILD_ROLLUPS, (start, next_month))
+            written += cursor.rowcount
+            conn.commit()
+            progress(f"Rolled up {month:%Y-%m}: {written} rollup rows so far")
+            month = next_month
+        return written
+    finally:
+        cursor.close()
+
+
+def summarize(cursor, from_day, to_day, directions, group_by):
+    """
+    Aggregates rollups between two days (inclusive).
+
+    Args:
+        cursor: Open cursor.
+        from_day (date), to_day (date): Day range.
+        directions (list): Directions to include.
+        group_by (list): Subset of SUMMARY_GROUPS.
+
+    Returns:
+        list: One dict per group with the group columns and the sums.
+    """
+    columns = ', '.join(f"`{column}`" for column in group_by)
+    placeholders = ', '.join(['%s'] * len(directions))
+    cursor.execute(SQL_SUMMARY.format(columns=columns, placeholders=placeholders),
+                   (from_day, to_day, *directions))
+    summary = []
+    for row in cursor.fetchall():
+        keys = row[:len(group_by)]
+        transactions, bruto, truck_tara, neto, neto_known = (int(value) for value in row[len(group_by):])
+        entry = {column: (value.strftime('%Y%m%d') if column == 'day' else value)
+                 for column, value in zip(group_by, keys)}
+        entry.update({
+            "transactions": transactions,
+            "bruto": bruto,
+            "truckTara": truck_tara,
+            "neto": neto,
+            "netoUnknown": transactions - neto_known
+        })
+        summary.append(entry)
+    return summary
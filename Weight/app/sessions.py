@@ -0,0 +1,239 @@
+from containers import split_containers, resolve_container_weights, IN_LIST_CHUNK
+
+"""
+Sessions and Items
+------------------
+A weighing session starts with an 'in' transaction and is closed by an 'out'
+transaction of the same truck. weight_post stores the id of the 'in' row in
+`transactions.session_id` of the 'out' row, so a session and its exit are
+joined on an index instead of searched for by truck and time.
+
+link_sessions() fills `session_id` for 'out' rows recorded before the column
+existed, pairing every 'out' with the latest 'in' of its truck before it.
+
+resolve_sessions() and resolve_items() answer /session and /item for any
+number of ids with one set-based query per IN_LIST_CHUNK ids (plus one
+container weight lookup), for the single and the bulk endpoints alike.
+"""
+
+SESSION_ID_COLUMN = {'session_id': 'int(12) DEFAULT NULL AFTER `produce`'}
+SESSION_ID_INDEX = {'idx_session_id': '(`session_id`)'}
+
+SQL_UNLINKED_TRUCKS = """
+    SELECT DISTINCT truck FROM transactions
+    WHERE direction = 'out' AND session_id IS NULL AND truck IS NOT NULL
+"""
+
+SQL_TRUCK_HISTORY = """
+    SELECT id, direction, session_id FROM transactions
+    WHERE truck = %s AND direction IN ('in', 'out')
+    ORDER BY datetime, id
+"""
+
+
+def pair_sessions(history):
+    """
+    Pairs the unlinked 'out' rows of one truck with their 'in' session.
+
+    Args:
+        history: (id, direction, session_id) rows of one truck in time order.
+
+    Returns:
+        list: (session id, out id) pairs; an 'out' with no earlier 'in' stays unlinked.
+    """
+    links = []
+    current_in = None
+    for transaction_id, direction, session_id in history:
+        if direction == 'in':
+            current_in = transaction_id
+        elif session_id is None and current_in is not None:
+            links.append((current_in, transaction_id))
+    return links
+
+
+def link_sessions(conn, trucks_per_commit=100, progress=print):
+    """
+    Links historical 'out' rows to their 'in' session, one truck at a time.
+
+    Args:
+        conn: Open database connection.
+        trucks_per_commit (int): Trucks processed per database transaction.
+        progress (callable): Receives a status line after every commit.
+
+    Returns:
+        int: 'out' rows linked.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_UNLINKED_TRUCKS)
+        trucks = [row[0] for row in cursor.fetchall()]
+        linked = 0
+        for done, truck in enumerate(trucks, start=1):
+            cursor.execute(SQL_TRUCK_HISTORY, (truck,))
+            links = pair_sessions(cursor.fetchall())
+            if links:
+                cursor.executemany("UPDATE transactions SET session_id = %s WHERE id = %s", links)
+                linked += len(links)
+            if done % trucks_per_commit == 0 or done == len(trucks):
+                conn.commit()
+                progress(f"Linked {linked} 'out' transactions ({done}/{len(trucks)} trucks)")
+        return linked
+    finally:
+        cursor.close()
+
+
+# Sessions with their 'out' weighing, linked through out.session_id
+SQL_SESSIONS = """
+    SELECT t.id, t.direction, t.truck, t.bruto, t.neto, t.containers, t.produce,
+           o.id, o.truckTara, o.neto, t.datetime
+    FROM transactions t
+    LEFT JOIN transactions o ON o.session_id = t.id AND o.direction = 'out'
+    WHERE t.id IN ({ids}){period}
+    ORDER BY t.id, o.id
+"""
+SQL_SESSIONS_PERIOD = """
+    AND t.datetime BETWEEN %s AND %s"""
+
+# Everything /item needs as (kind, item, value, datetime, id) rows: which ids are
+# trucks, their last tara and sessions, which are containers and their sessions
+SQL_ITEMS = """
+    (SELECT 'truck' AS kind, truck AS item, NULL AS value, NULL AS at, NULL AS seq
+     FROM transactions WHERE truck IN ({ids}) GROUP BY truck)
+    UNION ALL
+    (SELECT 'tara', t.truck, t.truckTara, t.datetime, t.id
+     FROM transactions t
+     JOIN (SELECT truck, MAX(datetime) AS last FROM transactions
+           WHERE truck IN ({ids}) AND truckTara IS NOT NULL GROUP BY truck) m
+       ON m.truck = t.truck AND m.last = t.datetime
+     WHERE t.truckTara IS NOT NULL)
+    UNION ALL
+    (SELECT 'truck_session', truck, id, datetime, id
+     FROM transactions WHERE truck IN ({ids}) AND direction = 'in' AND datetime BETWEEN %s AND %s)
+    UNION ALL
+    (SELECT 'container', container_id, NULL, NULL, NULL
+     FROM transaction_containers WHERE container_id IN ({ids}) GROUP BY container_id)
+    UNION ALL
+    (SELECT 'container_session', tc.container_id, t.id, t.datetime, t.id
+     FROM transaction_containers tc
+     JOIN transactions t ON t.id = tc.transaction_id
+     WHERE tc.container_id IN ({ids}) AND t.direction IN ('none', 'in') AND t.datetime BETWEEN %s AND %s)
+"""
+
+
+def _chunks(items, size=IN_LIST_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def resolve_sessions(cursor, session_ids, from_datetime=None, to_datetime=None):
+    """
+    Fetches the details of weighing sessions.
+
+    Args:
+        cursor: Open cursor.
+        session_ids (iterable): Transaction ids; ids that are not integers are never found.
+        from_datetime, to_datetime (datetime): Only sessions that started in this period (optional).
+
+    Returns:
+        dict: id -> details for every session found. 'in' sessions have id,
+        truck, bruto, produce, datetime and, once closed, truckTara and neto;
+        'none' sessions have id, container, bruto, containerTara, neto, produce
+        and datetime (YYYYMMDDHHMMSS, when the session started).
+        'out' transactions map to None, as they are not sessions.
+    """
+    ids = []
+    for session_id in session_ids:
+        try:
+            ids.append(int(session_id))
+        except (TypeError, ValueError):
+            continue
+    period = SQL_SESSIONS_PERIOD if from_datetime and to_datetime else ''
+
+    rows = {}
+    for chunk in _chunks(dict.fromkeys(ids)):
+        params = chunk + ([from_datetime, to_datetime] if period else [])
+        cursor.execute(SQL_SESSIONS.format(ids=', '.join(['%s'] * len(chunk)), period=period), params)
+        for row in cursor.fetchall():
+            rows[row[0]] = row  # Ordered by out id: the latest 'out' wins
+
+    containers = {session_id: split_containers(row[5]) for session_id, row in rows.items() if row[1] == 'none'}
+    weights, _ = resolve_container_weights(cursor, (c for conts in containers.values() for c in conts))
+
+    sessions = {}
+    for session_id, row in rows.items():
+        _, direction, truck, bruto, neto, _, produce, out_id, out_truck_tara, out_neto, started = row
+        if direction == 'in':
+            details = {"id": session_id, "truck": truck if truck else "na", "bruto": bruto, "produce": produce,
+                       "datetime": started.strftime('%Y%m%d%H%M%S')}
+            if out_id is not None:
+                details["truckTara"] = out_truck_tara
+                details["neto"] = out_neto if out_neto is not None else "na"
+        elif direction == 'none':
+            conts = containers[session_id]
+            # Total registered weight of the containers, "na" if any of them is unknown
+            known = conts and all(c in weights for c in conts)
+            details = {
+                "id": session_id,
+                "container": ','.join(conts) if conts else "na",
+                "bruto": bruto,
+                "containerTara": sum(weights[c] for c in conts) if known else "na",
+                "neto": neto if neto is not None else "na",
+                "produce": produce,
+                "datetime": started.strftime('%Y%m%d%H%M%S')
+            }
+        else:
+            details = None
+        sessions[session_id] = details
+    return sessions
+
+
+def resolve_items(cursor, item_ids, from_datetime, to_datetime):
+    """
+    Fetches the tara and sessions of trucks and containers.
+
+    An id used by both a truck and a container is reported as the truck.
+    Ids are matched like the database does, case-insensitively.
+
+    Args:
+        cursor: Open cursor.
+        item_ids (iterable): Truck or container ids.
+        from_datetime, to_datetime (datetime): Period of the sessions to list.
+
+    Returns:
+        dict: id -> {"id", "tara" (kg or "na"), "sessions" (ids in time order)}
+        for every id found.
+    """
+    requested = {}
+    for item_id in dict.fromkeys(item_ids):
+        requested.setdefault(str(item_id).lower(), []).append(item_id)
+
+    found = {}  # lower-cased id -> kind -> [(datetime, id, value)]
+    stored = {}  # lower-cased id -> id as stored in the database
+    for chunk in _chunks(requested):
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(SQL_ITEMS.format(ids=placeholders),
+                       chunk + chunk + chunk + [from_datetime, to_datetime] + chunk + chunk + [from_datetime, to_datetime])
+        for kind, item, value, at, seq in cursor.fetchall():
+            found.setdefault(item.lower(), {}).setdefault(kind, []).append((at, seq, value))
+            stored.setdefault(item.lower(), item)
+
+    containers = [stored[key] for key, kinds in found.items() if 'truck' not in kinds and 'container' in kinds]
+    weights, _ = resolve_container_weights(cursor, containers)
+    weights = {c.lower(): w for c, w in weights.items()}
+
+    items = {}
+    for key, kinds in found.items():
+        if 'truck' in kinds:
+            tara = max(kinds['tara'])[2] if 'tara' in kinds else "na"
+            sessions = kinds.get('truck_session', [])
+        elif 'container' in kinds:
+            # For containers, tara is the container's registered weight (in kg)
+            tara = weights.get(key, "na")
+            sessions = kinds.get('container_session', [])
+        else:
+            continue
+        session_ids = [session_id for _, _, session_id in sorted(sessions)]
+        for item_id in requested.get(key, []):
+            items[item_id] = {"id": item_id, "tara": tara, "sessions": session_ids}
+    return items
@@ -1,3 +1,7 @@
+import csv
+import io
+import json
+import re
 import pytest
 from app import app
 from datetime import datetime
@@ -16,6 +20,23 @@ def validate_date(date_string):
     except ValueError:
         return False
 
+def query_db(sql, params=()):
+    from db import get_db_connection
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.with_rows else []
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        conn.close()
+
+def transaction_links(transaction_id):
+    rows = query_db("SELECT container_id FROM transaction_containers WHERE transaction_id = %s", (transaction_id,))
+    return {row[0] for row in rows}
+
 def test_get_unknown_success(client):
     response = client.get("/unknown")
     assert response.status_code == 200
@@ -159,3 +180,567 @@ def test_get_health_success(client):
     assert response.is_json
     data = response.get_json()
     assert data == {"status": "200 OK"}
+
+def test_get_pool_stats(client):
+    response = client.get("/health/pool")
+    assert response.status_code == 200
+    data = response.get_json()
+    for key in ("size", "in_use", "checkouts", "exhausted", "wait_seconds_max"):
+        assert key in data
+    assert data["in_use"] <= data["size"]
+
+def test_transaction_containers_follow_weighings(client):
+    import uuid
+    run = uuid.uuid4().hex[:8]
+    truck = f"tc-{run}"
+    first, second, third = (f"TC-{run}-{i}" for i in range(3))
+
+    weighing = {"direction": "in", "truck": truck, "containers": f"{first},{second}",
+                "weight": 10000, "unit": "kg", "produce": "orange"}
+    replaced_in = client.post("/weight", json=weighing).get_json()["id"]
+    assert transaction_links(replaced_in) == {first, second}
+
+    # Forcing a new 'in' deletes the previous one together with its links
+    session_id = client.post("/weight", json={**weighing, "containers": third, "force": "true"}).get_json()["id"]
+    assert transaction_links(replaced_in) == set()
+    assert transaction_links(session_id) == {third}
+
+    out = {"direction": "out", "truck": truck, "weight": 4000, "unit": "kg"}
+    assert client.post("/weight", json=out).status_code == 201
+    [(replaced_out,)] = query_db("SELECT id FROM transactions WHERE session_id = %s", (session_id,))
+    assert transaction_links(replaced_out) == {third}
+
+    assert client.post("/weight", json={**out, "force": "true"}).status_code == 201
+    [(out_id,)] = query_db("SELECT id FROM transactions WHERE session_id = %s", (session_id,))
+    assert out_id != replaced_out
+    assert transaction_links(replaced_out) == set()
+    assert transaction_links(out_id) == {third}
+
+def test_backfill_transaction_containers():
+    import uuid
+    from db import get_db_connection
+    from containers import backfill_transaction_containers
+    run = uuid.uuid4().hex[:8]
+    first, second = f"BF-{run}-1", f"BF-{run}-2"
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # A weighing recorded before the side table existed: no links, blanks and a repeated container
+        cursor.execute("INSERT INTO transactions (datetime, direction, containers, bruto) VALUES (%s, 'none', %s, %s)",
+                       (datetime(2001, 1, 1), f"{first}, {second},,{first}", 500))
+        transaction_id = cursor.lastrowid
+        conn.commit()
+        try:
+            scanned, linked = backfill_transaction_containers(conn, batch_size=100, progress=lambda line: None)
+            assert scanned >= 1 and linked >= 2
+            assert transaction_links(transaction_id) == {first, second}
+            # Re-running finds every link already in place
+            assert backfill_transaction_containers(conn, batch_size=100, progress=lambda line: None)[1] == 0
+        finally:
+            cursor.execute("DELETE FROM transaction_containers WHERE transaction_id = %s", (transaction_id,))
+            cursor.execute("DELETE FROM transactions WHERE id = %s", (transaction_id,))
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def test_hot_queries_use_indexes():
+    import uuid
+    from datetime import timedelta
+    import app as weight_api
+    import backfill
+    import sessions
+    run = uuid.uuid4().hex[:8]
+    start = datetime(2001, 1, 1)
+    trucks = [f"idx-{run}-{i}" for i in range(200)]
+    containers = [f"IDX-{run}-{i}" for i in range(100)]
+
+    conn = weight_api.get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Enough rows, spread over trucks, days and directions, for the optimizer to prefer an index
+        cursor.executemany(
+            "INSERT INTO transactions (datetime, direction, truck, containers, bruto, truckTara, neto) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            [(start + timedelta(hours=i), ("in", "out", "none")[i % 3], trucks[i % len(trucks)],
+              containers[i % len(containers)], 10000, 4000, None if i % 10 == 0 else 5000) for i in range(3000)]
+        )
+        cursor.execute("SELECT id, containers FROM transactions WHERE truck LIKE %s", (f"idx-{run}-%",))
+        seeded = [(row["id"], row["containers"]) for row in cursor.fetchall()]
+        cursor.executemany("INSERT INTO transaction_containers (transaction_id, container_id) VALUES (%s, %s)", seeded)
+        conn.commit()
+        for table in ("transactions", "transaction_containers"):
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+
+        day = (start + timedelta(days=30), start + timedelta(days=31))
+        truck, container, session_ids = trucks[7], containers[7], [seeded[0][0], seeded[3][0]]
+        # name -> (query, params, {table or alias: indexes the optimizer may choose})
+        hot_queries = {
+            "last record for truck": (weight_api.SQL_LAST_TRUCK_RECORD, (truck,),
+                                      {"transactions": {"idx_truck_datetime"}}),
+            "last session for truck": (weight_api.SQL_LAST_TRUCK_SESSION, (truck,),
+                                       {"transactions": {"idx_truck_datetime"}, "cache_generations": {"PRIMARY"}}),
+            "last record": (weight_api.SQL_LAST_RECORD, (),
+                            {"transactions": {"PRIMARY"}, "cache_generations": {"PRIMARY"}}),
+            "weight time range": (weight_api.SQL_WEIGHT_RANGE.format(placeholders="%s, %s", after="", limit=""),
+                                  (*day, "in", "out"),
+                                  {"transactions": {"idx_datetime_direction", "idx_datetime_id"}}),
+            "weight page": (weight_api.SQL_WEIGHT_RANGE.format(placeholders="%s, %s",
+                                                              after=weight_api.SQL_WEIGHT_AFTER,
+                                                              limit=weight_api.SQL_WEIGHT_LIMIT),
+                            (*day, "in", "out", day[0], day[0], 1, 101),
+                            {"transactions": {"idx_datetime_id", "idx_datetime_direction"}}),
+            "sessions": (sessions.SQL_SESSIONS.format(ids="%s, %s", period=""), session_ids,
+                         {"t": {"PRIMARY"}, "o": {"idx_session_id"}}),
+            "items": (sessions.SQL_ITEMS.format(ids="%s"), (truck, truck, truck, *day, container, container, *day),
+                      {"transactions": {"idx_truck_datetime"}, "t": {"idx_truck_datetime", "PRIMARY"},
+                       "tc": {"idx_container_transaction"}}),
+            "pending neto": (backfill.SQL_PENDING_NETO, (0, 1000),
+                             {"transactions": {"idx_direction_neto", "PRIMARY"}}),
+            "pending neto for containers": (backfill.SQL_PENDING_FOR_CONTAINERS.format(placeholders="%s"), (container,),
+                                            {"tc": {"idx_container_transaction"}, "t": {"PRIMARY"}}),
+        }
+        for name, (query, params, expected) in hot_queries.items():
+            cursor.execute("EXPLAIN " + query, params)
+            plan = [row for row in cursor.fetchall() if row["table"] in expected]
+            assert plan, f"{name}: no access to {sorted(expected)} in the plan"
+            for row in plan:
+                assert row["key"] in expected[row["table"]], \
+                    f"{name} reads {row['table']} with {row['key'] or 'a full table scan'}"
+    finally:
+        cursor.execute("DELETE FROM transaction_containers WHERE container_id LIKE %s", (f"IDX-{run}-%",))
+        cursor.execute("DELETE FROM transactions WHERE truck LIKE %s", (f"idx-{run}-%",))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+def test_post_batch_weight_invalid_chunk_size(client):
+    response = client.post("/batch-weight?file=containers1.csv&chunk_size=0")
+    assert response.status_code == 400
+    assert "chunk_size" in response.get_json()["error"]
+
+def test_post_batch_weight_missing_file(client):
+    response = client.post("/batch-weight?file=does_not_exist.csv")
+    assert response.status_code == 400
+    assert "not found" in response.get_json()["error"]
+
+def test_neto_backfill_fills_both_sides_of_session(client):
+    import uuid
+    run = uuid.uuid4().hex[:8]
+    truck, container = f"nb-{run}", f"NB-{run}"
+    session_id = client.post("/weight", json={"direction": "in", "truck": truck, "containers": container,
+                                              "weight": 10000, "unit": "kg", "produce": "orange"}).get_json()["id"]
+    out = client.post("/weight", json={"direction": "out", "truck": truck, "weight": 4000, "unit": "kg"})
+    assert out.get_json()["neto"] is None  # The container is unknown
+
+    upload = io.BytesIO(f'"id","kg"\n{container},300\n'.encode())
+    response = client.post("/batch-weight", data={"file": (upload, "containers.csv")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 200
+    assert response.get_json()["stats"]["neto_backfilled"] == 2
+
+    rows = query_db("SELECT direction, neto FROM transactions WHERE truck = %s", (truck,))
+    assert sorted(rows) == [("in", 5700), ("out", 5700)]
+    assert client.get(f"/session/{session_id}").get_json()["neto"] == 5700
+    summary = client.get("/weight/summary?group=truck,direction&filter=in,out").get_json()
+    for direction in ("in", "out"):
+        [totals] = [r for r in summary if r["truck"] == truck and r["direction"] == direction]
+        assert totals["neto"] == 5700 and totals["netoUnknown"] == 0
+
+def test_get_batch_job_not_found(client):
+    response = client.get("/batch-weight/jobs/00000000-0000-0000-0000-000000000000")
+    assert response.status_code == 404
+
+def test_fail_interrupted_jobs():
+    import uuid
+    from batch import fail_interrupted_jobs, job_owner
+    jobs = {"earlier server": (str(uuid.uuid4()), "0123456789abcdef:42"),
+            "before owners": (str(uuid.uuid4()), None),
+            "this process": (str(uuid.uuid4()), job_owner())}
+    for job_id, owner in jobs.values():
+        query_db("INSERT INTO batch_jobs (id, file, status, owner, created_at) VALUES (%s, 'c.csv', 'running', %s, %s)",
+                 (job_id, owner, datetime.now()))
+    try:
+        assert fail_interrupted_jobs() >= 2
+        statuses = {name: query_db("SELECT status FROM batch_jobs WHERE id = %s", (job_id,))[0][0]
+                    for name, (job_id, _) in jobs.items()}
+        assert statuses == {"earlier server": "failed", "before owners": "failed", "this process": "running"}
+    finally:
+        for job_id, _ in jobs.values():
+            query_db("DELETE FROM batch_jobs WHERE id = %s", (job_id,))
+
+class FakeJobConnection:
+    """Connection whose cursors record the batch_jobs updates of a job."""
+    def __init__(self, updates):
+        self.updates = updates
+    def cursor(self):
+        updates = self.updates
+        class Cursor:
+            def execute(self, sql, params):
+                columns = re.findall(r"`(\w+)` = %s", sql)
+                updates.append(dict(zip(columns, params)))
+            def close(self):
+                pass
+        return Cursor()
+    def commit(self):
+        pass
+    def close(self):
+        pass
+
+def test_batch_job_retries_database_errors_then_fails():
+    import batch
+    from mysql.connector.errors import InterfaceError
+    updates = []
+    unreachable = InterfaceError("2003: Can't connect to MySQL server")
+    checkouts = [unreachable] * batch.BATCH_CHECKOUT_ATTEMPTS + [FakeJobConnection(updates)]
+
+    def checkout():
+        result = checkouts.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with patch.object(batch, 'get_db_connection', checkout), patch.object(batch, 'BATCH_RETRY_BACKOFF', 0), \
+         patch.object(batch, 'process_container_file') as process:
+        batch._run_job("job-1", "does-not-exist.csv", 100, remove_after=False)
+    process.assert_not_called()
+    assert updates[-1]["status"] == "failed"
+    assert "Can't connect" in json.loads(updates[-1]["result"])["error"]
+
+def test_batch_job_recovers_from_transient_database_error():
+    import batch
+    from mysql.connector.errors import OperationalError
+    updates = []
+    checkouts = [OperationalError("2013: Lost connection to MySQL server"), FakeJobConnection(updates)]
+
+    def checkout():
+        result = checkouts.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with patch.object(batch, 'get_db_connection', checkout), patch.object(batch, 'BATCH_RETRY_BACKOFF', 0), \
+         patch.object(batch, 'process_container_file', return_value={"stats": {"parsed": 3}}):
+        batch._run_job("job-2", "does-not-exist.csv", 100, remove_after=False)
+    assert [update["status"] for update in updates if "status" in update] == ["running", "done"]
+
+def test_container_cache_lru_eviction():
+    from containers import ContainerWeightCache
+    cache = ContainerWeightCache(max_size=2, ttl=60)
+    cache.put("C-1", 100)
+    cache.put("C-2", 200)
+    assert cache.get("C-1") == 100  # C-1 becomes most recently used
+    cache.put("C-3", 300)
+    assert cache.get("C-2") is None
+    assert cache.get("C-1") == 100 and cache.get("C-3") == 300
+    cache.invalidate(["C-1"])
+    assert cache.get("C-1") is None
+    assert cache.stats()["evictions"] == 1
+
+class FakeContainerCursor:
+    """Answers the container generation and weight queries from dicts, and records them."""
+    def __init__(self, weights, generation=1):
+        self.weights = weights  # container_id -> (weight, unit)
+        self.generation = generation
+        self.queries = []
+        self.rows = []
+    def execute(self, sql, params=()):
+        self.queries.append((sql, list(params)))
+        if "cache_generations" in sql:
+            self.rows = [(self.generation,)]
+        else:
+            self.rows = [(c, *self.weights[c]) for c in params if c in self.weights]
+    def fetchall(self):
+        return self.rows
+
+def test_container_cache_follows_registration_generation():
+    from containers import ContainerWeightCache
+    cache = ContainerWeightCache(max_size=10, ttl=60)
+    assert cache.sync(3)
+    cache.put("C-1", 100, 3)
+    assert cache.get("C-1") == 100
+    assert not cache.sync(2)  # A transaction that started before the last registration bypasses the cache
+    assert cache.get("C-1") == 100
+    cache.put("C-2", 200, 2)  # A weight read in an older generation is not cached
+    assert cache.get("C-2") is None
+    assert cache.sync(4)  # A registration, from any worker, drops every entry
+    assert cache.get("C-1") is None
+
+def test_registration_in_another_worker_invalidates_cached_tares():
+    from containers import resolve_container_weights, container_cache
+    cursor = FakeContainerCursor({"G-1": (100, "kg")})
+    try:
+        # A weighing passes the generation it read along with its session
+        assert resolve_container_weights(cursor, ["G-1"], generation=1000)[0] == {"G-1": 100}
+        # Re-registered by another process: only the generation in the database tells
+        cursor.weights["G-1"] = (150, "kg")
+        assert resolve_container_weights(cursor, ["G-1"], generation=1000)[0] == {"G-1": 100}
+        assert resolve_container_weights(cursor, ["G-1"], generation=1001)[0] == {"G-1": 150}
+        assert not any("cache_generations" in sql for sql, _ in cursor.queries)
+    finally:
+        container_cache.invalidate()
+        container_cache.generation = container_cache.synced_at = None
+
+def test_lookups_recheck_generation_after_interval(monkeypatch):
+    import containers
+    from containers import resolve_container_weights, container_cache
+    monkeypatch.setattr(containers, "GENERATION_INTERVAL", 60)
+    cursor = FakeContainerCursor({"H-1": (100, "kg")}, generation=3000)
+    try:
+        assert resolve_container_weights(cursor, ["H-1"])[0] == {"H-1": 100}
+        cursor.queries.clear()
+        cursor.weights["H-1"] = (150, "kg")
+        cursor.generation = 3001
+        assert resolve_container_weights(cursor, ["H-1"])[0] == {"H-1": 100}
+        assert cursor.queries == []  # A cached lookup within the interval makes no database call
+        monkeypatch.setattr(containers, "GENERATION_INTERVAL", 0)
+        assert resolve_container_weights(cursor, ["H-1"])[0] == {"H-1": 150}
+    finally:
+        container_cache.invalidate()
+        container_cache.generation = container_cache.synced_at = None
+
+def test_get_cache_stats(client):
+    response = client.get("/health/cache")
+    assert response.status_code == 200
+    assert {"size", "max_size", "hits", "misses"} <= set(response.get_json())
+
+def test_resolve_container_weights_reports_unknown():
+    from containers import resolve_container_weights
+    cursor = FakeContainerCursor({"R-1": (100, "kg"), "R-2": (220, "lbs"), "R-3": (None, None)})
+    weights, unknown = resolve_container_weights(cursor, ["R-4", "R-1", "R-3", "R-2", "R-4"], use_cache=False)
+    assert weights == {"R-1": 100, "R-2": 100}  # Converted to kg
+    assert unknown == ["R-4", "R-3"]  # Unregistered or without a weight, in request order, once
+
+def test_resolve_container_weights_chunks_in_lists():
+    from containers import resolve_container_weights, IN_LIST_CHUNK
+    ids = [f"K-{i}" for i in range(2 * IN_LIST_CHUNK + 1)]
+    cursor = FakeContainerCursor({c: (i, "kg") for i, c in enumerate(ids) if i % 2})
+    weights, unknown = resolve_container_weights(cursor, ids, use_cache=False)
+    lookups = [params for sql, params in cursor.queries if "containers_registered" in sql]
+    assert [len(params) for params in lookups] == [IN_LIST_CHUNK, IN_LIST_CHUNK, 1]
+    assert sorted(c for params in lookups for c in params) == sorted(ids)
+    assert len(weights) == IN_LIST_CHUNK and unknown == ids[::2]
+
+def test_resolve_container_weights_without_cache_reads_database():
+    from containers import resolve_container_weights, container_cache
+    cursor = FakeContainerCursor({"W-1": (150, "kg")}, generation=2000)
+    try:
+        container_cache.sync(2000)
+        container_cache.put("W-1", 100, 2000)
+        assert resolve_container_weights(cursor, ["W-1"], use_cache=False)[0] == {"W-1": 150}
+        assert not any("cache_generations" in sql for sql, _ in cursor.queries)
+        assert container_cache.get("W-1") == 100  # Left as it was
+        assert resolve_container_weights(cursor, ["W-1"])[0] == {"W-1": 100}
+    finally:
+        container_cache.invalidate()
+        container_cache.generation = container_cache.synced_at = None
+
+def test_concurrent_weighings_keep_sessions_apart():
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    run = uuid.uuid4().hex[:8]
+    trucks = [f"st-{run}-{i}" for i in range(20)]
+    cycles = 3
+
+    def drive(truck):
+        # Each truck goes in and out several times; trucks run in parallel
+        with app.test_client() as c:
+            sessions = []
+            for cycle in range(cycles):
+                weight_in = 10000 + cycle
+                r_in = c.post("/weight", json={"direction": "in", "truck": truck, "containers": f"C-{run}",
+                                               "weight": weight_in, "unit": "kg", "produce": "orange"})
+                assert r_in.status_code == 201, r_in.get_data(as_text=True)
+                r_out = c.post("/weight", json={"direction": "out", "truck": truck,
+                                                "weight": 4000, "unit": "kg"})
+                assert r_out.status_code == 201, r_out.get_data(as_text=True)
+                in_data, out_data = r_in.get_json(), r_out.get_json()
+                assert out_data["id"] == in_data["id"]
+                assert out_data["truck"] == truck and out_data["bruto"] == weight_in
+                sessions.append(in_data["id"])
+            return truck, sessions
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = dict(pool.map(drive, trucks))
+
+    all_sessions = [s for sessions in results.values() for s in sessions]
+    assert len(set(all_sessions)) == len(trucks) * cycles  # No lost or shared sessions
+    with app.test_client() as c:
+        for truck, sessions in results.items():
+            for session_id in sessions:
+                data = c.get(f"/session/{session_id}").get_json()
+                assert data["truck"] == truck
+                assert data["truckTara"] == 4000
+
+def test_get_weight_invalid_pagination(client):
+    assert client.get("/weight?limit=0").status_code == 400
+    assert client.get("/weight?limit=abc").status_code == 400
+    assert client.get("/weight?limit=10&stream=true").status_code == 400
+    assert client.get("/weight?cursor=not-a-cursor").status_code == 400
+
+def test_get_weight_invalid_format(client):
+    response = client.get("/weight?format=xml")
+    assert response.status_code == 400
+    assert "ndjson" in response.get_json()["error"]
+
+def test_get_weight_pages_match_full_range(client):
+    query = "/weight?t1=20000101000000&t2=20991231235959"
+    full = client.get(query)
+    assert full.status_code in [200, 201]
+    streamed = client.get(query + "&stream=true")
+    assert streamed.get_json() == full.get_json()
+
+    paged = []
+    url = query + "&limit=7"
+    while url:
+        response = client.get(url)
+        assert response.status_code in [200, 201]
+        page = response.get_json()
+        assert len(page) <= 7
+        paged.extend(page)
+        next_cursor = response.headers.get("X-Next-Cursor")
+        url = f"{query}&limit=7&cursor={next_cursor}" if next_cursor else None
+    assert paged == full.get_json()
+
+def test_get_weight_export_formats_match_json(client):
+    query = "/weight?t1=20000101000000&t2=20991231235959"
+    records = client.get(query).get_json()
+
+    lines = client.get(query + "&format=ndjson").get_data(as_text=True).splitlines()
+    exported = [json.loads(line) for line in lines]
+    assert [r["id"] for r in exported] == [r["id"] for r in records]
+    assert all(isinstance(r["containers"], list) for r in exported)
+
+    rows = list(csv.DictReader(io.StringIO(client.get(query + "&format=csv").get_data(as_text=True))))
+    assert [int(r["id"]) for r in rows] == [r["id"] for r in records]
+
+def test_get_weight_summary_invalid_group(client):
+    assert client.get("/weight/summary?group=day,color").status_code == 400
+    assert client.get("/weight/summary?t1=yesterday").status_code == 400
+
+def test_weight_summary_follows_weighings(client):
+    import uuid
+    truck = f"sum-{uuid.uuid4().hex[:8]}"
+    query = "/weight/summary?group=truck,direction&filter=in,out"
+
+    def totals():
+        rows = client.get(query).get_json()
+        return {r["direction"]: r for r in rows if r["truck"] == truck}
+
+    assert totals() == {}
+    client.post("/weight", json={"direction": "in", "truck": truck, "containers": "C-sum",
+                                 "weight": 9000, "unit": "kg", "produce": "orange"})
+    client.post("/weight", json={"direction": "out", "truck": truck, "weight": 4000, "unit": "kg"})
+    summary = totals()
+    assert summary["in"]["transactions"] == 1 and summary["in"]["bruto"] == 9000
+    assert summary["in"]["truckTara"] == 4000
+    assert summary["out"]["transactions"] == 1 and summary["out"]["truckTara"] == 4000
+
+def test_unknown_set_follows_registration(client):
+    import uuid
+    container = f"U-{uuid.uuid4().hex[:8]}".capitalize()
+    response = client.post("/weight", json={"direction": "none", "containers": container,
+                                            "weight": 500, "unit": "kg"})
+    assert response.status_code in [201, 400]  # 400 when the last record is an open 'in'
+    if response.status_code == 400:
+        return
+    assert f'"{container}"' in client.get("/unknown").get_data(as_text=True)
+
+    upload = io.BytesIO(f'"id","kg"\n{container},100\n'.encode())
+    response = client.post("/batch-weight", data={"file": (upload, "containers.csv")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 200
+    assert f'"{container}"' not in client.get("/unknown").get_data(as_text=True)
+
+def test_pair_sessions():
+    from sessions import pair_sessions
+    history = [(1, "out", None), (2, "in", None), (3, "out", 2), (4, "in", None), (5, "out", None),
+               (6, "in", None), (7, "in", None), (8, "out", None)]
+    # Already linked rows and outs without an earlier in are left alone; an out closes the latest in
+    assert pair_sessions(history) == [(4, 5), (7, 8)]
+
+def test_post_items_requires_ids(client):
+    assert client.post("/items", json={}).status_code == 400
+    assert client.post("/items", json={"ids": "12345"}).status_code == 400
+    assert client.post("/sessions", json={"ids": []}).status_code == 400
+    assert client.post("/items", json={"ids": ["12345"], "from": "yesterday"}).status_code == 400
+
+def test_bulk_lookups_match_single_endpoints(client):
+    item_ids = ["12345", "no-such-item"]
+    items = client.post("/items", json={"ids": item_ids, "from": "20000101000000", "to": "20991231235959"})
+    assert items.status_code == 200
+    items = items.get_json()
+    assert set(items) == set(item_ids)
+    for item_id in item_ids:
+        single = client.get(f"/item/{item_id}?from=20000101000000&to=20991231235959")
+        assert items[item_id] == (single.get_json() if single.status_code == 200 else None)
+
+    session_ids = (items["12345"] or {"sessions": []})["sessions"][:5] + ["abc123"]
+    sessions = client.post("/sessions", json={"ids": session_ids}).get_json()
+    for session_id in session_ids:
+        single = client.get(f"/session/{session_id}")
+        assert sessions[str(session_id)] == (single.get_json() if single.status_code == 200 else None)
+
+def test_instrumented_cursor_records_queries():
+    import metrics
+
+    class FakeCursor:
+        def __init__(self):
+            self.rows = [(1,), (2,), (3,)]
+        def execute(self, sql, params=None):
+            pass
+        def fetchmany(self, size):
+            rows, self.rows = self.rows[:size], self.rows[size:]
+            return rows
+        def close(self):
+            pass
+
+    metrics.reset()
+    cursor = metrics.InstrumentedCursor(FakeCursor())
+    cursor.execute("SELECT id\n    FROM transactions WHERE id IN (%s, %s, %s)", (1, 2, 3))
+    while cursor.fetchmany(2):
+        pass
+    cursor.close()
+    text = metrics.render()
+    labels = 'route="background",query="SELECT id FROM transactions WHERE id IN (%s, ...)"'
+    assert f'weight_db_query_duration_seconds_count{{{labels}}} 1' in text
+    assert f'weight_db_query_rows_total{{{labels}}} 3' in text
+
+def test_get_metrics(client):
+    client.get("/health/pool")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    assert "# TYPE weight_http_request_duration_seconds histogram" in text
+    assert 'weight_http_request_duration_seconds_count{method="GET",route="/health/pool",status="200"}' in text
+
+def test_retired_worker_metrics_are_merged(tmp_path):
+    import json
+    import metrics
+    line = 'weight_db_query_rows_total{route="background",query="SELECT 1"}'
+    for name, rows in (("101-1.json", 2), ("102-1.json", 3), ("103-1.json", 4)):
+        (tmp_path / name).write_text(json.dumps(
+            [["weight_db_query_rows_total", [["route", "background"], ["query", "SELECT 1"]], [rows]]]))
+    metrics.reset()
+    with patch.object(metrics, 'METRICS_DIR', str(tmp_path)):
+        try:
+            assert f"{line} 9" in metrics.render()
+            metrics.retire(101)
+            assert f"{line} 9" in metrics.render()  # Counted once, from the retired file
+            metrics.retire(102)
+            assert f"{line} 9" in metrics.render()
+            assert not (tmp_path / "101-1.json").exists()  # Removed once superseded
+            assert {p.name for p in tmp_path.glob("*.json")} == {
+                "retired.json", "102-1.json", "103-1.json", metrics._snapshot_name}
+        finally:
+            metrics.reset()
+
+def test_metrics_disabled_records_nothing(client):
+    import metrics
+    metrics.reset()
+    with patch.object(metrics, 'ENABLED', False):
+        client.get("/health/pool")
+        assert metrics.render().count("\n") == 2 * len(metrics.FAMILIES)  # HELP and TYPE lines only
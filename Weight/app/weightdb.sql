@@ -18,7 +18,7 @@ CREATE TABLE IF NOT EXISTS `containers_registered` (
   `weight` int(12) DEFAULT NULL,
   `unit` varchar(10) DEFAULT NULL,
   PRIMARY KEY (`container_id`)
-) ENGINE=MyISAM AUTO_INCREMENT=10001 ;
+) ENGINE=InnoDB ;
 
 -- --------------------------------------------------------
 
@@ -37,13 +37,100 @@ CREATE TABLE IF NOT EXISTS `transactions` (
   --   "neto": <int> or "na" // na if some of containers unknown
   `neto` int(12) DEFAULT NULL,
   `produce` varchar(50) DEFAULT NULL,
+  --   'out' rows: id of the 'in' transaction that opened the session
+  `session_id` int(12) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_truck_datetime` (`truck`, `datetime`),
+  KEY `idx_datetime_direction` (`datetime`, `direction`),
+  KEY `idx_direction_neto` (`direction`, `neto`),
+  KEY `idx_datetime_id` (`datetime`, `id`),
+  KEY `idx_session_id` (`session_id`)
+) ENGINE=InnoDB AUTO_INCREMENT=10001 ;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `transaction_containers`
+-- One row per (transaction, container) pair; indexed container lookups
+--
+
+CREATE TABLE IF NOT EXISTS `transaction_containers` (
+  `transaction_id` int(12) NOT NULL,
+  `container_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`transaction_id`, `container_id`),
+  KEY `idx_container_transaction` (`container_id`, `transaction_id`)
+) ENGINE=InnoDB ;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `unknown_containers`
+-- Containers seen in transactions without a registered weight (/unknown)
+--
+
+CREATE TABLE IF NOT EXISTS `unknown_containers` (
+  `container_id` varchar(50) NOT NULL,
+  PRIMARY KEY (`container_id`)
+) ENGINE=InnoDB ;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `batch_jobs`
+-- Status of background /batch-weight jobs
+--
+
+CREATE TABLE IF NOT EXISTS `batch_jobs` (
+  `id` varchar(36) NOT NULL,
+  `file` varchar(255) NOT NULL,
+  `status` varchar(10) NOT NULL,
+  `owner` varchar(64) DEFAULT NULL,
+  `rows_parsed` int(12) NOT NULL DEFAULT 0,
+  `result` text DEFAULT NULL,
+  `created_at` datetime NOT NULL,
+  `started_at` datetime(3) DEFAULT NULL,
+  `finished_at` datetime(3) DEFAULT NULL,
   PRIMARY KEY (`id`)
-) ENGINE=MyISAM AUTO_INCREMENT=10001 ;
+) ENGINE=InnoDB ;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `daily_rollups`
+-- Per-day weighing totals behind /weight/summary
+--
+
+CREATE TABLE IF NOT EXISTS `daily_rollups` (
+  `day` date NOT NULL,
+  `direction` varchar(10) NOT NULL,
+  `produce` varchar(50) NOT NULL,
+  `truck` varchar(50) NOT NULL,
+  `transactions` int(12) NOT NULL DEFAULT 0,
+  `bruto_sum` bigint NOT NULL DEFAULT 0,
+  `truck_tara_sum` bigint NOT NULL DEFAULT 0,
+  `neto_sum` bigint NOT NULL DEFAULT 0,
+  `neto_known` int(12) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`day`, `direction`, `produce`, `truck`)
+) ENGINE=InnoDB ;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `cache_generations`
+-- Bumped by every container registration; invalidates the container weight caches of all workers
+--
+
+CREATE TABLE IF NOT EXISTS `cache_generations` (
+  `name` varchar(50) NOT NULL,
+  `generation` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB ;
 
 show tables;
 
 describe containers_registered;
 describe transactions;
+describe transaction_containers;
 
 
 
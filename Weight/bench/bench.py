@@ -0,0 +1,416 @@
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, APP_DIR)
+
+from db import get_db_connection  # noqa: E402
+from containers import fill_unknown_containers  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+"""
+Weight API Benchmark
+--------------------
+Load and latency benchmark for a running Weight service and its MySQL database.
+
+Phases:
+1. batch: Registers M synthetic containers through POST /batch-weight (upload)
+2. seed: Writes K days of in/out history for N trucks straight into MySQL
+   (transactions, transaction_containers, session links), then refreshes the
+   daily rollups and the unknown container set with the app's own helpers
+3. gate: Concurrent in/out cycles through POST /weight, one truck per gate thread at a time
+4. read: Concurrent GET /weight ranges, streamed exports, /item, /items,
+   /session and /weight/summary
+
+The report is JSON: p50/p95/p99 latency, requests/s and rows/s per endpoint,
+plus the parameters and git commit, so runs can be compared across commits
+with `bench.py compare`.
+
+Run it against a fresh database (docker compose down -v) so results stay
+comparable; the database settings come from the same DB_* variables as the app.
+
+Usage:
+    python bench.py run --url http://localhost:8082 --trucks 200 --containers 5000 --days 30 -o after.json
+    python bench.py compare before.json after.json --threshold 10
+"""
+
+PRODUCE = ['orange', 'tangerine', 'mandarin', 'navel', 'blood', 'grapefruit', 'clementine']
+INSERT_CHUNK = 1000
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+    """Thread-safe latency and row counts per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+        self._rows = {}
+        self._wall = {}
+
+    def timed(self, name, call):
+        """Runs call() -> (ok, rows) and records its latency."""
+        started = time.perf_counter()
+        try:
+            ok, rows = call()
+        except requests.RequestException:
+            ok, rows = False, 0
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies.setdefault(name, []).append(elapsed)
+            self._rows[name] = self._rows.get(name, 0) + rows
+            if not ok:
+                self._errors[name] = self._errors.get(name, 0) + 1
+        return ok
+
+    def add_wall_time(self, names, seconds):
+        with self._lock:
+            for name in names:
+                self._wall[name] = self._wall.get(name, 0) + seconds
+
+    def report(self):
+        endpoints = {}
+        for name, latencies in self._latencies.items():
+            values = sorted(latencies)
+            wall = self._wall.get(name) or sum(values)
+            entry = {
+                "requests": len(values),
+                "errors": self._errors.get(name, 0),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "requests_per_second": round(len(values) / wall, 1) if wall else None,
+            }
+            if self._rows.get(name):
+                entry["rows"] = self._rows[name]
+                entry["rows_per_second"] = round(self._rows[name] / wall, 1) if wall else None
+            endpoints[name] = entry
+        return endpoints
+
+
+class Dataset:
+    """Deterministic synthetic trucks, containers and history for one random seed."""
+
+    def __init__(self, trucks, containers, days, sessions_per_day, unknown_ratio, seed):
+        self.random = random.Random(seed)
+        self.trucks = {f"T-{i:05d}": self.random.randint(5000, 9000) for i in range(1, trucks + 1)}  # id -> tara
+        self.containers = {f"C-{i:06d}": self.random.randint(50, 400) for i in range(1, containers + 1)}  # id -> kg
+        registered = int(len(self.containers) * (1 - unknown_ratio))
+        self.registered = dict(list(self.containers.items())[:registered])
+        self.days = days
+        self.sessions_per_day = sessions_per_day
+
+    def containers_csv(self):
+        lines = ['"id","kg"'] + [f"{c},{w}" for c, w in self.registered.items()]
+        return ('\n'.join(lines) + '\n').encode()
+
+    def pick_containers(self):
+        return self.random.sample(list(self.containers), self.random.randint(1, 3))
+
+    def neto(self, bruto, tara, containers):
+        if any(c not in self.registered for c in containers):
+            return None
+        return bruto - tara - sum(self.registered[c] for c in containers)
+
+    def history(self, first_id, end):
+        """
+        Yields (transaction row, containers) in id order, for `days` days before `end`.
+
+        Rows are (id, datetime, direction, truck, containers, bruto, truckTara, neto, produce, session_id).
+        """
+        next_id = first_id
+        for day in range(self.days, 0, -1):
+            start = (end - timedelta(days=day)).replace(hour=6, minute=0, second=0, microsecond=0)
+            events = []
+            for truck, tara in self.trucks.items():
+                for _ in range(self.sessions_per_day):
+                    events.append((start + timedelta(seconds=self.random.randint(0, 12 * 3600)), truck, tara))
+            events.sort()
+            for moment, truck, tara in events:
+                containers = self.pick_containers()
+                produce = self.random.choice(PRODUCE)
+                bruto = tara + sum(self.containers[c] for c in containers) + self.random.randint(1000, 10000)
+                neto = self.neto(bruto, tara, containers)
+                out_time = moment + timedelta(minutes=self.random.randint(20, 90))
+                joined = ','.join(containers)
+                yield (next_id, moment, 'in', truck, joined, bruto, None, None, produce, None), containers
+                yield (next_id + 1, out_time, 'out', truck, joined, bruto, tara, neto, produce, next_id), containers
+                next_id += 2
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed_history(dataset, log):
+    """Inserts the synthetic history; returns {"rows", "seconds", "rows_per_second", "first_day", "session_ids"}."""
+    started = time.perf_counter()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    session_ids = []
+    rows = 0
+    try:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM transactions")
+        first_id = cursor.fetchone()[0]
+        for chunk in _chunks(dataset.history(first_id, datetime.now()), INSERT_CHUNK):
+            cursor.executemany("""
+                INSERT INTO transactions
+                (id, datetime, direction, truck, containers, bruto, truckTara, neto, produce, session_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, [row for row, _ in chunk])
+            cursor.executemany(
+                "INSERT IGNORE INTO transaction_containers (transaction_id, container_id) VALUES (%s, %s)",
+                [(row[0], c) for row, containers in chunk for c in dict.fromkeys(containers)]
+            )
+            conn.commit()
+            session_ids.extend(row[0] for row, _ in chunk if row[2] == 'in')
+            rows += len(chunk)
+            log(f"seed: {rows} transactions")
+    finally:
+        cursor.close()
+        conn.close()
+    seconds = time.perf_counter() - started
+
+    first_day = (datetime.now() - timedelta(days=dataset.days)).date()
+    conn = get_db_connection()
+    try:
+        fill_unknown_containers(conn)
+        rebuild_rollups(conn, since=first_day, progress=lambda line: None)
+    finally:
+        conn.close()
+    return {"rows": rows, "seconds": round(seconds, 3), "rows_per_second": round(rows / seconds, 1),
+            "first_day": first_day, "session_ids": session_ids}
+
+
+def run_batch(session, url, dataset, recorder):
+    """Registers the dataset's containers through a /batch-weight upload."""
+    def call():
+        response = session.post(f"{url}/batch-weight",
+                                files={"file": ("bench_containers.csv", io.BytesIO(dataset.containers_csv()))},
+                                timeout=600)
+        return response.status_code == 200, len(dataset.registered)
+
+    started = time.perf_counter()
+    recorder.timed("POST /batch-weight", call)
+    recorder.add_wall_time(["POST /batch-weight"], time.perf_counter() - started)
+
+
+def run_gate(url, dataset, recorder, concurrency, cycles):
+    """Drives concurrent in/out cycles; every thread works on its own trucks."""
+    trucks = list(dataset.trucks)
+    lanes = [trucks[i::concurrency] for i in range(concurrency)]
+    cycles_per_lane = [cycles // concurrency + (1 if i < cycles % concurrency else 0) for i in range(concurrency)]
+
+    def lane(index):
+        session = requests.Session()
+        rng = random.Random(index)
+        own = lanes[index] or trucks
+        for n in range(cycles_per_lane[index]):
+            truck = own[n % len(own)]
+            containers = ','.join(rng.sample(list(dataset.registered or dataset.containers), 2))
+            bruto = dataset.trucks[truck] + rng.randint(2000, 10000)
+            recorder.timed("POST /weight in", lambda: (session.post(f"{url}/weight", json={
+                "direction": "in", "truck": truck, "containers": containers, "weight": bruto,
+                "unit": "kg", "produce": rng.choice(PRODUCE), "force": "true"}, timeout=30).status_code == 201, 1))
+            recorder.timed("POST /weight out", lambda: (session.post(f"{url}/weight", json={
+                "direction": "out", "truck": truck, "weight": dataset.trucks[truck],
+                "unit": "kg", "force": "true"}, timeout=30).status_code == 201, 1))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lane, range(concurrency)))
+    recorder.add_wall_time(["POST /weight in", "POST /weight out"], time.perf_counter() - started)
+
+
+def run_reads(url, dataset, recorder, concurrency, requests_per_endpoint, session_ids, first_day):
+    """Drives concurrent read traffic, one endpoint at a time."""
+    local = threading.local()
+    trucks = list(dataset.trucks)
+    t1 = first_day.strftime('%Y%m%d000000')
+    t2 = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    def http():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def one_day(rng):
+        day = first_day + timedelta(days=rng.randrange(max(dataset.days, 1)))
+        response = http().get(f"{url}/weight", params={"t1": day.strftime('%Y%m%d000000'),
+                                                      "t2": day.strftime('%Y%m%d235959')}, timeout=60)
+        return response.status_code in (200, 201), len(response.json()) if response.ok else 0
+
+    def full_export(rng):
+        response = http().get(f"{url}/weight", params={"t1": t1, "t2": t2, "format": "ndjson"},
+                              stream=True, timeout=600)
+        rows = sum(1 for line in response.iter_lines() if line)
+        return response.status_code in (200, 201), rows
+
+    def item(rng):
+        response = http().get(f"{url}/item/{rng.choice(trucks)}", params={"from": t1, "to": t2}, timeout=60)
+        return response.status_code == 200, 0
+
+    def items(rng):
+        ids = rng.sample(trucks, min(100, len(trucks)))
+        response = http().post(f"{url}/items", json={"ids": ids, "from": t1, "to": t2}, timeout=120)
+        return response.status_code == 200, len(ids)
+
+    def session(rng):
+        response = http().get(f"{url}/session/{rng.choice(session_ids)}", timeout=60)
+        return response.status_code == 200, 0
+
+    def summary(rng):
+        response = http().get(f"{url}/weight/summary", params={"t1": t1[:8], "t2": t2[:8],
+                                                              "group": "day,produce"}, timeout=60)
+        return response.status_code == 200, len(response.json()) if response.ok else 0
+
+    scenarios = [
+        ("GET /weight (1 day)", one_day, requests_per_endpoint),
+        ("GET /weight ndjson (all days)", full_export, max(1, requests_per_endpoint // 50)),
+        ("GET /item", item, requests_per_endpoint),
+        ("POST /items (100 trucks)", items, max(1, requests_per_endpoint // 10)),
+        ("GET /weight/summary", summary, requests_per_endpoint),
+    ]
+    if session_ids:
+        scenarios.append(("GET /session", session, requests_per_endpoint))
+
+    for name, call, count in scenarios:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda n: recorder.timed(name, lambda: call(random.Random(n))), range(count)))
+        recorder.add_wall_time([name], time.perf_counter() - started)
+
+
+def git_commit():
+    if os.getenv('BENCH_COMMIT'):
+        return os.getenv('BENCH_COMMIT')  # Set when the checkout is not visible, e.g. inside a container
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    log = (lambda line: None) if args.quiet else (lambda line: print(line, file=sys.stderr))
+    dataset = Dataset(args.trucks, args.containers, args.days, args.sessions_per_day, args.unknown_ratio, args.seed)
+    recorder = Recorder()
+    session = requests.Session()
+    url = args.url.rstrip('/')
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now().strftime('%Y%m%d%H%M%S'),
+            "url": url,
+            "python": platform.python_version(),
+            "parameters": {k: v for k, v in vars(args).items() if k not in ('func', 'output', 'quiet', 'url')},
+        }
+    }
+
+    log("batch: registering containers")
+    run_batch(session, url, dataset, recorder)
+
+    seed = {"session_ids": [], "first_day": (datetime.now() - timedelta(days=args.days)).date()}
+    if args.days:
+        log("seed: writing history")
+        seed = seed_history(dataset, log)
+        report["seed"] = {k: v for k, v in seed.items() if k in ("rows", "seconds", "rows_per_second")}
+
+    log("gate: in/out cycles")
+    run_gate(url, dataset, recorder, args.concurrency, args.cycles)
+
+    log("read: queries")
+    run_reads(url, dataset, recorder, args.concurrency, args.requests, seed["session_ids"], seed["first_day"])
+
+    report["endpoints"] = recorder.report()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"report written to {args.output}")
+    else:
+        print(output)
+
+
+def compare(args):
+    """Prints per-endpoint changes between two reports; exits 1 if p95 or throughput regressed beyond the threshold."""
+    with open(args.before) as f:
+        before = json.load(f)["endpoints"]
+    with open(args.after) as f:
+        after = json.load(f)["endpoints"]
+    regressed = False
+    print(f"{'endpoint':32} {'p95 ms':>18} {'req/s':>18}")
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        p95_change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+        rps_change = ((new["requests_per_second"] - old["requests_per_second"]) / old["requests_per_second"] * 100
+                      if old["requests_per_second"] else 0)
+        flag = p95_change > args.threshold or rps_change < -args.threshold
+        regressed = regressed or flag
+        print(f"{name:32} {old['p95_ms']:>8} -> {new['p95_ms']:<8} {old['requests_per_second']:>8} -> "
+              f"{new['requests_per_second']:<8}{'  REGRESSION' if flag else ''}")
+    sys.exit(1 if regressed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weight API load and latency benchmark")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Generate data, drive traffic and write a JSON report')
+    run_parser.add_argument('--url', default=os.getenv('WEIGHT_URL', 'http://localhost:8082'))
+    run_parser.add_argument('--trucks', type=int, default=100, help='Synthetic trucks (N)')
+    run_parser.add_argument('--containers', type=int, default=2000, help='Synthetic containers (M)')
+    run_parser.add_argument('--days', type=int, default=30, help='Days of seeded history (K), 0 to skip seeding')
+    run_parser.add_argument('--sessions-per-day', type=int, default=2, help='In/out sessions per truck and day')
+    run_parser.add_argument('--unknown-ratio', type=float, default=0.02,
+                            help='Share of containers left unregistered')
+    run_parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client threads')
+    run_parser.add_argument('--cycles', type=int, default=500, help='Gate in/out cycles in total')
+    run_parser.add_argument('--requests', type=int, default=500, help='Requests per read endpoint')
+    run_parser.add_argument('--seed', type=int, default=42, help='Random seed for the synthetic data')
+    run_parser.add_argument('-o', '--output', help='Report file (default: stdout)')
+    run_parser.add_argument('-q', '--quiet', action='store_true')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two reports')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10, help='Allowed change in percent')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()